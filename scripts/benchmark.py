@@ -0,0 +1,367 @@
+"""
+Load-test harness for the JSON-RPC API.
+
+Starts a CommentDaemon against a throwaway SQLite file seeded with a corpus
+of fake comments, runs a FakeLBRYNet (see scripts/lbrynet.py) and a stub
+notification endpoint on local aiohttp servers, then replays a weighted mix
+of validly signed API calls against it.
+
+The report is written as JSON so runs can be diffed between commits:
+
+    $ python -m scripts.benchmark --comments 50000 --requests 20000 -o before.json
+    $ git checkout some-branch
+    $ python -m scripts.benchmark --comments 50000 --requests 20000 -o after.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import aiohttp
+from aiohttp import web
+
+from src.definitions import CONFIG_FILE, ROOT_DIR
+from src.main import get_config
+from src.server.app import CommentDaemon, create_tables
+from src.database.models import bulk_create_comments
+from src.database.models import create_comment_id
+from scripts.lbrynet import FakeLBRYNet
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIX = {
+    'get_claim_comments': 80,
+    'create_comment': 10,
+    'hide_comments': 5,
+    'edit_comment': 5,
+}
+
+
+def parse_mix(value: str) -> dict:
+    # parses 'get_claim_comments=80,create_comment=10' into a dict of weights
+    mix = {}
+    for part in value.split(','):
+        method, weight = part.split('=')
+        mix[method.strip()] = int(weight)
+    return mix
+
+
+def percentile(values: list, pct: float) -> float:
+    # nearest-rank percentile over an already sorted list
+    if not values:
+        return 0.0
+    rank = max(int(math.ceil(pct / 100 * len(values))) - 1, 0)
+    return values[rank]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def fake_hex(rng: random.Random, length: int) -> str:
+    return '%0*x' % (length, rng.getrandbits(length * 4))
+
+
+class Corpus:
+    """ Deterministic set of channels, claims and comments used to seed the database """
+
+    def __init__(self, lbrynet: FakeLBRYNet, n_comments: int, n_claims: int,
+                 n_channels: int, seed: int = 0):
+        self.rng = random.Random(seed)
+        self.channels, claims = lbrynet.generate(n_channels, n_claims)
+        self.claim_ids = [claim['claim_id'] for claim in claims]
+        # the channel that signed each claim is the one allowed to hide comments on it
+        self.claim_owners = {
+            claim['claim_id']: lbrynet.channels[claim['signing_channel']['claim_id']]
+            for claim in claims
+        }
+        self.n_comments = n_comments
+        self.comments = []  # (comment_id, claim_id, channel)
+
+    def body(self) -> str:
+        words = self.rng.randint(5, 120)
+        return ' '.join(f'w{self.rng.randint(0, 5000)}' for _ in range(words))
+
+    def signature(self) -> str:
+        return fake_hex(self.rng, 128)
+
+    def seed(self, db, chunk_size: int = 1000):
+        now = int(time.time())
+        rows = []
+        for i in range(self.n_comments):
+            channel = self.rng.choice(self.channels)
+            claim_id = self.rng.choice(self.claim_ids)
+            body = self.body()
+            timestamp = now - self.rng.randint(0, 86400 * 365)
+            # salt with the index so seeded ids never collide
+            comment_id = create_comment_id(f'{i}:{body}', channel.claim_id, timestamp)
+            parent = None
+            if self.comments and self.rng.random() < 0.2:
+                parent, claim_id, _ = self.rng.choice(self.comments[-500:])
+            # seeded signatures are not verified by any read path, so skip the signing cost
+            rows.append({
+                'comment_id': comment_id,
+                'comment': body,
+                'claim_id': claim_id,
+                'channel_id': channel.claim_id,
+                'channel_name': channel.name,
+                'parent_id': parent,
+                'signature': self.signature(),
+                'signing_ts': str(timestamp),
+                'timestamp': timestamp,
+            })
+            self.comments.append((comment_id, claim_id, channel))
+            if len(rows) >= chunk_size:
+                with db.atomic():
+                    bulk_create_comments(rows)
+                rows = []
+        if rows:
+            with db.atomic():
+                bulk_create_comments(rows)
+
+
+class Workload:
+    """ Produces validly signed JSON-RPC request bodies following a weighted method mix """
+
+    def __init__(self, corpus: Corpus, mix: dict, seed: int = 0):
+        self.corpus = corpus
+        self.rng = random.Random(seed + 1)
+        self.methods = list(mix.keys())
+        self.weights = [mix[m] for m in self.methods]
+        self.next_id = 0
+
+    def get_claim_comments(self) -> dict:
+        return {
+            'claim_id': self.rng.choice(self.corpus.claim_ids),
+            'page': self.rng.choice((1, 1, 1, 2, 3)),
+            'page_size': self.rng.choice((20, 50)),
+            'top_level': self.rng.random() < 0.5,
+        }
+
+    def get_claim_summaries(self) -> dict:
+        # a feed page worth of claims
+        return {'claim_ids': self.rng.sample(self.corpus.claim_ids, min(50, len(self.corpus.claim_ids)))}
+
+    def search_comments(self) -> dict:
+        params = {'query': ' '.join(f'w{self.rng.randint(0, 5000)}' for _ in range(self.rng.randint(1, 2)))}
+        if self.rng.random() < 0.5:
+            params['claim_id'] = self.rng.choice(self.corpus.claim_ids)
+        return params
+
+    def create_comment(self) -> dict:
+        channel = self.rng.choice(self.corpus.channels)
+        body = self.corpus.body()
+        return {
+            'comment': body,
+            'claim_id': self.rng.choice(self.corpus.claim_ids),
+            'channel_id': channel.claim_id,
+            'channel_name': channel.name,
+            **channel.sign(body),
+        }
+
+    def hide_comments(self) -> dict:
+        claim_id = self.rng.choice(self.corpus.claim_ids)
+        owner = self.corpus.claim_owners[claim_id]
+        candidates = [c for c in self.corpus.comments[-5000:] if c[1] == claim_id]
+        comment_ids = [c[0] for c in candidates[:self.rng.randint(1, 3)]]
+        if not comment_ids:
+            comment_ids = [self.rng.choice(self.corpus.comments)[0]]
+        return {'pieces': [{'comment_id': cid, **owner.sign(cid)} for cid in comment_ids]}
+
+    def edit_comment(self) -> dict:
+        comment_id, _, channel = self.rng.choice(self.corpus.comments)
+        body = self.corpus.body()
+        return {'comment_id': comment_id, 'comment': body, **channel.sign(body)}
+
+    def __call__(self) -> dict:
+        method = self.rng.choices(self.methods, self.weights)[0]
+        self.next_id += 1
+        return {
+            'jsonrpc': '2.0',
+            'id': self.next_id,
+            'method': method,
+            'params': getattr(self, method)(),
+        }
+
+
+def stub_notifications_app() -> web.Application:
+    async def handle(request: web.Request):
+        request.app['received'] += 1
+        return web.Response(text='OK')
+
+    app = web.Application()
+    app['received'] = 0
+    app.add_routes([web.get('/', handle)])
+    return app
+
+
+async def start_stub(app: web.Application, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def replay(url: str, workload: Workload, n_requests: int, concurrency: int) -> dict:
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    remaining = n_requests
+
+    async def worker(session: aiohttp.ClientSession):
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            body = workload()
+            start = time.perf_counter()
+            async with session.post(url, json=body) as resp:
+                result = await resp.json()
+            latencies[body['method']].append(time.perf_counter() - start)
+            if resp.status != 200 or not isinstance(result, dict) or 'error' in result:
+                errors[body['method']] += 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    methods = {}
+    for method, values in latencies.items():
+        values.sort()
+        methods[method] = {
+            'count': len(values),
+            'errors': errors[method],
+            'mean_ms': round(sum(values) / len(values) * 1000, 3),
+            'p50_ms': round(percentile(values, 50) * 1000, 3),
+            'p95_ms': round(percentile(values, 95) * 1000, 3),
+            'p99_ms': round(percentile(values, 99) * 1000, 3),
+            'max_ms': round(values[-1] * 1000, 3),
+        }
+    return {
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(n_requests / elapsed, 2),
+        'methods': methods,
+    }
+
+
+async def run_benchmark(args) -> dict:
+    host = '127.0.0.1'
+    lbrynet = FakeLBRYNet(
+        latency=args.lbrynet_latency,
+        jitter=args.lbrynet_latency / 2,
+        error_rate=args.lbrynet_error_rate,
+        seed=args.seed
+    )
+    corpus = Corpus(lbrynet, args.comments, args.claims, args.channels, seed=args.seed)
+    workload = Workload(corpus, args.mix, seed=args.seed)
+
+    await lbrynet.start(host, args.port + 1)
+    notifications_app = stub_notifications_app()
+    notifications = await start_stub(notifications_app, host, args.port + 2)
+
+    config = get_config(CONFIG_FILE)
+    config.pop('slack_webhook', None)
+    config.pop('rate_limits', None)
+    config['mode'] = 'testing'
+    config['testing']['file'] = args.db
+    config['lbrynet'] = lbrynet.url
+    config['notifications'] = {'url': f'http://{host}:{args.port + 2}/', 'auth_token': 'benchmark'}
+    if args.group_commit is not None:
+        config['group_commit'] = {'enabled': True, 'window_ms': args.group_commit}
+
+    server = CommentDaemon(config)
+    db = server.app['db']
+    db.connect()
+    create_tables(db)
+    seed_start = time.perf_counter()
+    corpus.seed(db)
+    seed_elapsed = time.perf_counter() - seed_start
+    db.close()
+
+    await server.start(host=host, port=args.port)
+    try:
+        if args.warmup:
+            await replay(f'http://{host}:{args.port}/api', workload, args.warmup, args.concurrency)
+        results = await replay(f'http://{host}:{args.port}/api', workload, args.requests, args.concurrency)
+    finally:
+        await server.stop()
+        await lbrynet.stop()
+        await notifications.cleanup()
+
+    results.update({
+        'revision': git_revision(),
+        'python': sys.version.split()[0],
+        'seed_s': round(seed_elapsed, 3),
+        'notifications_received': notifications_app['received'],
+        'lbrynet_calls': dict(lbrynet.calls),
+        'lbrynet_errors': dict(lbrynet.errors),
+        'params': {
+            'comments': args.comments,
+            'claims': args.claims,
+            'channels': args.channels,
+            'requests': args.requests,
+            'warmup': args.warmup,
+            'concurrency': args.concurrency,
+            'seed': args.seed,
+            'mix': args.mix,
+            'lbrynet_latency': args.lbrynet_latency,
+            'lbrynet_error_rate': args.lbrynet_error_rate,
+            'group_commit_ms': args.group_commit,
+        },
+    })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the comment server JSON-RPC API')
+    parser.add_argument('--comments', type=int, default=10000, help='size of the seeded corpus')
+    parser.add_argument('--claims', type=int, default=200)
+    parser.add_argument('--channels', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='weighted method mix, e.g. get_claim_comments=80,create_comment=20')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--lbrynet-latency', type=float, default=0.0,
+                        help='seconds of simulated latency per lbrynet call')
+    parser.add_argument('--lbrynet-error-rate', type=float, default=0.0,
+                        help='fraction of lbrynet calls answered with an error')
+    parser.add_argument('--port', type=int, default=5941,
+                        help='server port, the stubs take the next two ports')
+    parser.add_argument('--group-commit', type=float, default=None, metavar='WINDOW_MS',
+                        help='coalesce comment creations within this window')
+    parser.add_argument('--db', type=str, default=None, help='sqlite file, defaults to a temporary one')
+    parser.add_argument('-o', '--output', type=str, default=None, help='write the JSON report here')
+    parser.add_argument('--log-level', type=str, default='CRITICAL')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper())
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.db is None:
+            args.db = os.path.join(tmpdir, 'benchmark.db')
+        report = asyncio.get_event_loop().run_until_complete(run_benchmark(args))
+
+    dump = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(dump)
+    print(dump)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""
+Reports how much space the body store saves, and moves the bodies of
+comments written before it was enabled into it.
+
+With `body_store.enabled` in conf.yml, new comments get the hash of their body
+and a body posted more than once is kept once in COMMENT_BODY. `--backfill`
+does the same for the comments that are already there, a batch at a time, so
+an interrupted run can simply be run again:
+
+    $ python -m scripts.body_store
+    $ python -m scripts.body_store --backfill --batch-size 5000
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+
+from peewee import Case, fn
+
+from src.definitions import CONFIG_FILE
+from src.main import get_config, setup_db_from_config
+from src.server.app import setup_database, create_tables
+from src.database.models import CommentBody, STORED_BODY_MIN_LENGTH
+from src.database.models import body_hash, body_store_in_use, comment_tiers, recount_bodies
+from src.database.shards import ShardSet
+
+
+logger = logging.getLogger(__name__)
+
+# what a hash costs a comment: the column, and its index entry which also holds the comment_id
+HASH_BYTES = 64 * 3
+
+
+def hash_bodies(db, model, batch_size: int) -> int:
+    # gives comments written before the store was enabled the hash of their body
+    after, hashed = '', 0
+    while True:
+        rows = list(model
+                    .select(model.comment_id, model.comment)
+                    .where((model.comment_id > after) & model.body_hash.is_null())
+                    .order_by(model.comment_id)
+                    .limit(batch_size)
+                    .tuples())
+        if not rows:
+            return hashed
+        with db.atomic():
+            for comment_id, body in rows:
+                if len(body) >= STORED_BODY_MIN_LENGTH:
+                    model.update(body_hash=body_hash(body)).where(model.comment_id == comment_id).execute()
+                    hashed += 1
+        after = rows[-1][0]
+
+
+def store_repeats(db, batch_size: int) -> int:
+    # moves the bodies more than one comment still has a copy of into COMMENT_BODY
+    copies = {}
+    for model in comment_tiers():
+        for h, n in (model
+                     .select(model.body_hash, fn.COUNT(model.comment_id))
+                     .where(model.body_hash.is_null(False) & (model.comment != ''))
+                     .group_by(model.body_hash)
+                     .tuples()):
+            copies[h] = copies.get(h, 0) + n
+    stored = {h for h, in CommentBody.select(CommentBody.body_hash).tuples()}
+    repeats = [h for h, n in copies.items() if n > 1 or h in stored]
+
+    for i in range(0, len(repeats), batch_size):
+        batch = repeats[i:i + batch_size]
+        with db.atomic():
+            for h in batch:
+                if h not in stored:
+                    body = next(filter(None, (model
+                                              .select(model.comment)
+                                              .where((model.body_hash == h) & (model.comment != ''))
+                                              .scalar() for model in comment_tiers())))
+                    CommentBody.insert(body_hash=h, body=body, refs=0).execute()
+                for model in comment_tiers():
+                    model.update(comment='').where((model.body_hash == h) & (model.comment != '')).execute()
+            recount_bodies(batch)
+        logger.info(f'Stored {min(i + batch_size, len(repeats))} of {len(repeats)} bodies')
+    return len(repeats)
+
+
+def report() -> dict:
+    # sizes as LENGTH() counts them, bytes for mysql and characters for sqlite
+    totals = {'comments': 0, 'hashed': 0, 'references': 0, 'inline_bytes': 0}
+    for model in comment_tiers():
+        comments, hashed, references, inline = (model
+                                                .select(fn.COUNT(model.comment_id),
+                                                        fn.COUNT(model.body_hash),
+                                                        fn.SUM(Case(None, [(model.comment == '', 1)], 0)),
+                                                        fn.SUM(fn.LENGTH(model.comment)))
+                                                .tuples()
+                                                .get())
+        totals['comments'] += comments
+        totals['hashed'] += hashed
+        totals['references'] += references or 0
+        totals['inline_bytes'] += inline or 0
+    bodies, stored, referenced = (CommentBody
+                                  .select(fn.COUNT(CommentBody.body_hash),
+                                          fn.SUM(fn.LENGTH(CommentBody.body)),
+                                          fn.SUM(fn.LENGTH(CommentBody.body) * CommentBody.refs))
+                                  .tuples()
+                                  .get())
+    without = totals['inline_bytes'] + (referenced or 0)
+    saved = (referenced or 0) - (stored or 0) - totals['hashed'] * HASH_BYTES
+    return {
+        **totals,
+        'stored_bodies': bodies,
+        'stored_bytes': stored or 0,
+        'bytes_without_store': without,
+        'bytes_saved': saved,
+        'saved_percent': round(100 * saved / without, 2) if without else 0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backfill', action='store_true', help='store the bodies of existing comments first')
+    parser.add_argument('--batch-size', type=int, default=1000, help='comments or bodies per transaction')
+    parser.add_argument('--config', type=str, default=CONFIG_FILE)
+    parser.add_argument('--mode', type=str, default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    config = get_config(args.config)
+    if args.mode:
+        config['mode'] = args.mode
+    setup_db_from_config(config)
+    app = {'config': config}
+    setup_database(app)
+    if not body_store_in_use():
+        parser.error('body_store is not enabled in the config')
+
+    # every shard has a body store of its own
+    results = []
+    for db in app['shards'].databases if 'shards' in app else [app['db']]:
+        with ShardSet.using(db):
+            db.connect()
+            try:
+                create_tables(db)
+                result = {}
+                if args.backfill:
+                    start = time.perf_counter()
+                    result['hashed'] = sum(hash_bodies(db, model, args.batch_size) for model in comment_tiers())
+                    result['stored'] = store_repeats(db, args.batch_size)
+                    result['elapsed_s'] = round(time.perf_counter() - start, 3)
+                result['report'] = report()
+                results.append(result)
+            finally:
+                db.close()
+    print(json.dumps(results if len(results) > 1 else results[0], indent=2))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Streaming export of comments as JSONL.
+
+Walks the COMMENT table in bounded chunks, so memory use stays flat no matter
+how large the database is. Comments can be filtered by claim, channel and time
+range, and optionally enriched with the name & permanent url of the claim they
+were made on through batched lbrynet lookups.
+
+    $ python -m scripts.export_comments -o comments.jsonl
+    $ python -m scripts.export_comments --claim-id <claim_id> --since 1577836800 --enrich
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import sys
+import typing
+from collections import OrderedDict
+
+from src.definitions import CONFIG_FILE
+from src.main import get_config, setup_db_from_config
+from src.server.app import setup_database
+from src.database.models import iter_comments
+from src.misc import get_claims_from_ids
+
+
+logger = logging.getLogger(__name__)
+
+# claim_search won't return more than this many claims per page
+LBRYNET_BATCH_SIZE = 50
+
+
+class ClaimCache:
+    """ Bounded LRU of resolved claims so enrichment doesn't grow with the export """
+
+    def __init__(self, app, max_size: int = 10000):
+        self.app = app
+        self.max_size = max_size
+        self.claims = OrderedDict()
+
+    async def fetch(self, claim_ids: typing.Iterable[str]) -> dict:
+        claim_ids = set(claim_ids)
+        missing = [cid for cid in claim_ids if cid not in self.claims]
+        for i in range(0, len(missing), LBRYNET_BATCH_SIZE):
+            batch = missing[i:i + LBRYNET_BATCH_SIZE]
+            try:
+                found = await get_claims_from_ids(self.app, batch)
+            except Exception:
+                logger.exception(f'Failed to resolve {len(batch)} claims, exporting them unenriched')
+                found = {}
+            for cid in batch:
+                claim = found.get(cid)
+                self.claims[cid] = claim and {
+                    'name': claim['name'],
+                    'permanent_url': claim['permanent_url']
+                }
+        result = {}
+        for cid in claim_ids:
+            self.claims.move_to_end(cid)
+            result[cid] = self.claims[cid]
+        while len(self.claims) > self.max_size:
+            self.claims.popitem(last=False)
+        return result
+
+
+async def export_comments(out, comments: typing.Iterator[dict], cache: ClaimCache = None,
+                          chunk_size: int = 1000) -> int:
+    exported = 0
+    while True:
+        chunk = list(itertools.islice(comments, chunk_size))
+        if not chunk:
+            return exported
+        if cache:
+            claims = await cache.fetch(c['claim_id'] for c in chunk)
+            for comment in chunk:
+                if claims[comment['claim_id']]:
+                    comment['claim'] = claims[comment['claim_id']]
+        for comment in chunk:
+            out.write(json.dumps(comment) + '\n')
+        exported += len(chunk)
+        logger.info(f'{exported} comments exported')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export comments as JSONL')
+    parser.add_argument('-o', '--output', type=str, default=None, help='defaults to stdout')
+    parser.add_argument('--claim-id', type=str, default=None)
+    parser.add_argument('--channel-id', type=str, default=None)
+    parser.add_argument('--since', type=int, default=None, help='unix timestamp, inclusive')
+    parser.add_argument('--until', type=int, default=None, help='unix timestamp, exclusive')
+    parser.add_argument('--enrich', action='store_true', help='add claim names & urls from lbrynet')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--config', type=str, default=CONFIG_FILE)
+    parser.add_argument('--mode', type=str, default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    config = get_config(args.config)
+    if args.mode:
+        config['mode'] = args.mode
+    setup_db_from_config(config)
+    app = {'config': config}
+    setup_database(app)
+    app['db'].connect()
+
+    filters = dict(
+        claim_id=args.claim_id,
+        channel_id=args.channel_id,
+        since=args.since,
+        until=args.until,
+        chunk_size=args.chunk_size
+    )
+    # every shard's comments, in one comment_id order
+    comments = app['shards'].iter_comments(**filters) if 'shards' in app else iter_comments(**filters)
+    cache = ClaimCache(app) if args.enrich else None
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        total = asyncio.get_event_loop().run_until_complete(
+            export_comments(out, comments, cache, args.chunk_size)
+        )
+    finally:
+        (app['shards'] if 'shards' in app else app['db']).close()
+        if out is not sys.stdout:
+            out.close()
+    logger.info(f'Exported {total} comments')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Bulk import of a comment dump into the database configured in conf.yml.
+
+Streams a JSONL or CSV file through validation into batched multi-row
+inserts, upserting channels along the way. Each batch is committed in its own
+transaction, so an interrupted import can simply be re-run: rows that already
+exist are skipped.
+
+Every row needs `comment`, `claim_id` (or a `parent_id` that is already known),
+`channel_id`, `channel_name`, `signature` and `signing_ts`; `comment_id`,
+`parent_id`, `timestamp` and `is_hidden` are kept when present.
+Replies should come after their parents in the dump.
+
+    $ python -m scripts.import_comments dump.jsonl --batch-size 20000
+"""
+import argparse
+import csv
+import itertools
+import json
+import logging
+import sys
+import time
+import typing
+
+from src.definitions import CONFIG_FILE
+from src.main import get_config, setup_db_from_config
+from src.server.app import setup_database, create_tables
+from src.database.models import bulk_create_comments
+
+
+logger = logging.getLogger(__name__)
+
+
+def read_jsonl(fp) -> typing.Iterator[dict]:
+    for line in fp:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_csv(fp) -> typing.Iterator[dict]:
+    for row in csv.DictReader(fp):
+        # empty cells mean null, not empty strings
+        yield {k: v for k, v in row.items() if v != ''}
+
+
+def import_comments(db, rows: typing.Iterable[dict], batch_size: int = 10000) -> dict:
+    totals = {'inserted': 0, 'duplicates': 0, 'invalid': 0}
+    rows = iter(rows)
+    start = time.perf_counter()
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        with db.atomic():
+            result = bulk_create_comments(batch)
+        for k, v in result.items():
+            totals[k] += v
+        processed = sum(totals.values())
+        logger.info(f'{processed} rows processed, {totals["inserted"]} inserted, '
+                    f'{processed / (time.perf_counter() - start):.0f} rows/sec')
+    elapsed = time.perf_counter() - start
+    totals.update({
+        'elapsed_s': round(elapsed, 3),
+        'rows_per_sec': round(sum(totals.values()) / elapsed, 1) if elapsed else 0,
+    })
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk import comments from a JSONL or CSV dump')
+    parser.add_argument('path', type=str)
+    parser.add_argument('--format', choices=('jsonl', 'csv'), default=None,
+                        help='defaults to the file extension')
+    parser.add_argument('--batch-size', type=int, default=10000, help='rows per transaction')
+    parser.add_argument('--config', type=str, default=CONFIG_FILE)
+    parser.add_argument('--mode', type=str, default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    config = get_config(args.config)
+    if args.mode:
+        config['mode'] = args.mode
+    setup_db_from_config(config)
+    app = {'config': config}
+    setup_database(app)
+    app['db'].connect()
+    create_tables(app['db'])
+
+    fmt = args.format or ('csv' if args.path.endswith('.csv') else 'jsonl')
+    reader = read_csv if fmt == 'csv' else read_jsonl
+    try:
+        with open(args.path, 'r', newline='') as fp:
+            totals = import_comments(app['db'], reader(fp), args.batch_size)
+    finally:
+        app['db'].close()
+    print(json.dumps(totals, indent=2))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""
+Local stand-in for the lbrynet daemon.
+
+Implements just enough of `claim_search` and `resolve` for the comment server,
+backed by generated channels holding real secp256k1 keys so that comments,
+edits, abandons and hides can be signed exactly like the SDK would sign them.
+Latency and error injection make it usable for benchmarking claim lookups
+under realistic upstream conditions.
+
+    lbrynet = FakeLBRYNet(latency=0.05, error_rate=0.01)
+    channel = lbrynet.add_channel('@someone')
+    claim = lbrynet.add_claim(channel=channel)
+    await lbrynet.start('localhost', 5279)
+    signed = channel.sign('my comment')   # {'signature': ..., 'signing_ts': ...}
+"""
+import asyncio
+import binascii
+import hashlib
+import random
+import time
+import typing
+from collections import Counter
+
+from aiohttp import web
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import Prehashed
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+from cryptography.hazmat.primitives.serialization import Encoding
+from cryptography.hazmat.primitives.serialization import PublicFormat
+
+
+def random_claim_id(rng: random.Random = random) -> str:
+    return '%040x' % rng.getrandbits(160)
+
+
+class FakeChannel:
+    def __init__(self, name: str, claim_id: str = None):
+        self.name = name
+        self.claim_id = claim_id or random_claim_id()
+        self.private_key = ec.generate_private_key(ec.SECP256K1(), default_backend())
+        self.public_key = binascii.hexlify(self.private_key.public_key().public_bytes(
+            Encoding.DER, PublicFormat.SubjectPublicKeyInfo
+        )).decode()
+
+    @property
+    def url(self) -> str:
+        return f'lbry://{self.name}#{self.claim_id}'
+
+    def sign(self, data: str, signing_ts: str = None) -> dict:
+        # same digest the SDK signs: sha256(signing_ts + reversed channel hash + data)
+        signing_ts = signing_ts or str(int(time.time()))
+        channel_hash = binascii.unhexlify(self.claim_id.encode())[::-1]
+        digest = hashlib.sha256(b''.join((signing_ts.encode(), channel_hash, data.encode()))).digest()
+        der = self.private_key.sign(digest, ec.ECDSA(Prehashed(hashes.SHA256())))
+        r, s = decode_dss_signature(der)
+        return {'signature': '%064x%064x' % (r, s), 'signing_ts': signing_ts}
+
+    def to_claim(self) -> dict:
+        return {
+            'claim_id': self.claim_id,
+            'name': self.name,
+            'normalized_name': self.name.lower(),
+            'permanent_url': self.url,
+            'value_type': 'channel',
+            'value': {'public_key': self.public_key},
+        }
+
+
+class FakeLBRYNet:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.channels: typing.Dict[str, FakeChannel] = {}
+        self.claims: typing.Dict[str, dict] = {}
+        self.calls = Counter()
+        self.errors = Counter()
+        self.runner = None
+        self.host = None
+        self.port = None
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.port}/'
+
+    def add_channel(self, name: str = None, claim_id: str = None) -> FakeChannel:
+        claim_id = claim_id or random_claim_id(self.rng)
+        channel = FakeChannel(name or f'@channel-{len(self.channels)}', claim_id)
+        self.channels[channel.claim_id] = channel
+        return channel
+
+    def add_claim(self, claim_id: str = None, channel: FakeChannel = None, name: str = None) -> dict:
+        claim_id = claim_id or random_claim_id(self.rng)
+        name = name or f'stream-{claim_id[:8]}'
+        claim = {
+            'claim_id': claim_id,
+            'name': name,
+            'normalized_name': name.lower(),
+            'permanent_url': f'lbry://{name}#{claim_id}',
+            'value_type': 'stream',
+            'value': {},
+        }
+        if channel:
+            claim['signing_channel'] = channel.to_claim()
+        self.claims[claim_id] = claim
+        return claim
+
+    def generate(self, n_channels: int, n_claims: int) -> typing.Tuple[list, list]:
+        channels = [self.add_channel() for _ in range(n_channels)]
+        claims = [self.add_claim(channel=self.rng.choice(channels)) for _ in range(n_claims)]
+        return channels, claims
+
+    def get_claim(self, claim_id: str) -> typing.Optional[dict]:
+        if claim_id in self.channels:
+            return self.channels[claim_id].to_claim()
+        return self.claims.get(claim_id)
+
+    def claim_search(self, claim_id: str = None, claim_ids: list = None, channel_ids: list = None,
+                     page: int = 1, page_size: int = 20, **kwargs) -> dict:
+        ids = list(claim_ids or [])
+        if claim_id:
+            ids.append(claim_id)
+        items = [c for c in (self.get_claim(cid) for cid in ids) if c]
+        if channel_ids:
+            channel_ids = set(channel_ids)
+            items += [c for c in self.claims.values()
+                      if c.get('signing_channel', {}).get('claim_id') in channel_ids]
+        total = len(items)
+        items = items[(page - 1) * page_size:page * page_size]
+        return {'items': items, 'page': page, 'page_size': page_size, 'total_items': total}
+
+    def resolve(self, urls: typing.Union[str, list] = None, **kwargs) -> dict:
+        urls = [urls] if isinstance(urls, str) else (urls or [])
+        results = {}
+        for url in urls:
+            name, _, claim_id = url.replace('lbry://', '').partition('#')
+            claim = None
+            if claim_id:
+                claim = self.get_claim(claim_id)
+            else:
+                claim = next((c.to_claim() for c in self.channels.values() if c.name == name), None)
+            results[url] = claim or {'error': {'name': 'NOT_FOUND', 'text': f'Could not find claim at "{url}".'}}
+        return results
+
+    async def handle(self, request: web.Request):
+        body = await request.json()
+        method = body.get('method')
+        params = body.get('params', {})
+        self.calls[method] += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(self.latency + self.rng.uniform(-self.jitter, self.jitter), 0))
+
+        response = {'jsonrpc': '2.0', 'id': body.get('id')}
+        if method not in ('claim_search', 'resolve'):
+            response['error'] = {'code': -32601, 'message': f'Method {method} not found'}
+        elif self.error_rate and self.rng.random() < self.error_rate:
+            self.errors[method] += 1
+            response['error'] = {'code': -32500, 'message': 'Injected lbrynet failure'}
+        else:
+            response['result'] = getattr(self, method)(**params)
+        return web.json_response(response)
+
+    async def start(self, host: str = 'localhost', port: int = 5279):
+        app = web.Application()
+        app.add_routes([web.post('/', self.handle)])
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        self.host, self.port = host, port
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
@@ -0,0 +1,168 @@
+"""
+Moves comments to the shard their claim belongs on, after shards were added
+to or are about to be removed from `shards` in conf.yml.
+
+Claims are placed by a jump consistent hash, so adding a shard only moves the
+claims that now land on it. To remove shards, leave them configured and run
+with `--drain N` for the last N of them; once it's done they hold nothing and
+can be taken out of the config.
+
+Each batch of claims is copied, re-indexed and then deleted from where it was,
+so an interrupted run can simply be run again. The servers should be stopped
+while it runs.
+
+    $ python -m scripts.reshard --batch-size 100
+    $ python -m scripts.reshard --drain 1
+    $ python -m scripts.reshard --rebuild-index
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+import typing
+
+from peewee import Database, chunked
+
+from src.definitions import CONFIG_FILE
+from src.main import get_config, setup_db_from_config
+from src.server.app import setup_database, create_tables
+from src.database.models import Comment, Channel, ClaimSummary, CommentShard, CommentBody
+from src.database.models import insert_ignore_many, parents_first, rebuild_channel_stats, restore_claims
+from src.database.models import stored_refs, store_bodies, release_bodies, recount_bodies
+from src.database.shards import ShardSet
+
+
+logger = logging.getLogger(__name__)
+
+
+def claims_on(shards: ShardSet, db: Database) -> typing.List[str]:
+    with shards.using(db):
+        claims = {claim_id for claim_id, in Comment.select(Comment.claim_id).distinct().tuples()}
+        claims.update(claim_id for claim_id, in ClaimSummary.select(ClaimSummary.claim_id).tuples())
+    return sorted(claims)
+
+
+def move_claims(shards: ShardSet, source: Database, target: Database, claim_ids: typing.List[str]) -> int:
+    with shards.using(source):
+        # archived claims travel from the hot tier, the archiver puts them back on the target
+        restore_claims(claim_ids)
+        comments = parents_first(list(Comment.select().where(Comment.claim_id.in_(claim_ids)).dicts()))
+        # bodies kept in the source's COMMENT_BODY travel inside their comments
+        released = stored_refs(Comment, [c['comment_id'] for c in comments])
+        if released:
+            bodies = dict(CommentBody
+                          .select(CommentBody.body_hash, CommentBody.body)
+                          .where(CommentBody.body_hash.in_(list(released)))
+                          .tuples())
+            for c in comments:
+                c['comment'] = c['comment'] or bodies[c['body_hash']]
+        channel_ids = list({c['channel'] for c in comments if c['channel']})
+        channels = list(Channel.select().where(Channel.claim_id.in_(channel_ids)).dicts()) if channel_ids else []
+        summaries = list(ClaimSummary.select().where(ClaimSummary.claim_id.in_(claim_ids)).dicts())
+
+    # parents go in before their replies, the summaries' versions keep going up
+    with shards.using(target), target.atomic():
+        insert_ignore_many(Channel, channels)
+        store_bodies(comments)
+        for batch in chunked(comments, 500):
+            Comment.insert_many(batch).on_conflict_ignore().execute()
+        recount_bodies(c['body_hash'] for c in comments)
+        for summary in summaries:
+            ClaimSummary.insert({**summary, 'version': summary['version'] + 1}).on_conflict_replace().execute()
+        # counted again rather than added to, a rerun finds some of the comments there already
+        rebuild_channel_stats(channel_ids)
+    shards.record([c['comment_id'] for c in comments], target)
+
+    # and the replies come out before their parents
+    with shards.using(source), source.atomic():
+        for batch in chunked([c['comment_id'] for c in reversed(comments)], 500):
+            Comment.delete().where(Comment.comment_id.in_(batch)).execute()
+        release_bodies(released)
+        ClaimSummary.delete().where(ClaimSummary.claim_id.in_(claim_ids)).execute()
+        rebuild_channel_stats(channel_ids)
+    return len(comments)
+
+
+def reshard(shards: ShardSet, drain: int = 0, batch_size: int = 100) -> dict:
+    # claims are placed over the shards that stay, drained ones are emptied into them
+    keep = len(shards.databases) - drain
+    if keep < 1:
+        raise ValueError('At least the first shard has to stay')
+    totals = {'claims': 0, 'comments': 0}
+    start = time.perf_counter()
+    for index, source in enumerate(shards.databases):
+        moves = {}
+        for claim_id in claims_on(shards, source):
+            target = shards.shard_of(claim_id, keep)
+            if target != index:
+                moves.setdefault(target, []).append(claim_id)
+        for target, claim_ids in moves.items():
+            for batch in chunked(claim_ids, batch_size):
+                totals['comments'] += move_claims(shards, source, shards.databases[target], batch)
+                totals['claims'] += len(batch)
+            logger.info(f'Moved {len(claim_ids)} claims from shard {index} to shard {target}')
+    totals['elapsed_s'] = round(time.perf_counter() - start, 3)
+    return totals
+
+
+def rebuild_index(shards: ShardSet, chunk_size: int = 10000) -> int:
+    # recreates COMMENT_SHARD from what each shard holds
+    with shards.using(shards.home):
+        CommentShard.delete().execute()
+    indexed = 0
+    for db in shards.databases:
+        after = ''
+        while True:
+            with shards.using(db):
+                comment_ids = [comment_id for comment_id, in (Comment
+                                                              .select(Comment.comment_id)
+                                                              .where(Comment.comment_id > after)
+                                                              .order_by(Comment.comment_id)
+                                                              .limit(chunk_size)
+                                                              .tuples())]
+            if not comment_ids:
+                break
+            shards.record(comment_ids, db)
+            indexed += len(comment_ids)
+            after = comment_ids[-1]
+    return indexed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--drain', type=int, default=0, help='empty the last N configured shards')
+    parser.add_argument('--batch-size', type=int, default=100, help='claims moved per transaction')
+    parser.add_argument('--rebuild-index', action='store_true', help='recreate COMMENT_SHARD and move nothing')
+    parser.add_argument('--config', type=str, default=CONFIG_FILE)
+    parser.add_argument('--mode', type=str, default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    config = get_config(args.config)
+    if args.mode:
+        config['mode'] = args.mode
+    setup_db_from_config(config)
+    app = {'config': config}
+    setup_database(app)
+    if 'shards' not in app:
+        parser.error(f'no shards are configured for {config["mode"]}')
+    shards = app['shards']
+    for db in shards.databases:
+        with shards.using(db):
+            create_tables(db)
+    with shards.using(shards.home):
+        CommentShard.create_table()
+
+    try:
+        if args.rebuild_index:
+            result = {'indexed': rebuild_index(shards)}
+        else:
+            result = reshard(shards, args.drain, args.batch_size)
+    finally:
+        shards.close()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
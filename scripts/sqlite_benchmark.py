@@ -0,0 +1,166 @@
+"""
+Compares the SQLite profiles in conf.yml with several processes sharing one
+database file, which is where the `testing` profile runs into
+"database is locked".
+
+Every mode gets a fresh file seeded with the same comments. Each worker
+process then sets the database up the way the server does for that mode and,
+for `--seconds`, creates comments and lists claims in a `--write-share` mix:
+writes in a transaction on the writer connection, reads wherever the server
+would send them. The report has the throughput, latencies and errors of
+every mode:
+
+    $ python -m scripts.sqlite_benchmark --processes 4 --seconds 10
+    $ python -m scripts.sqlite_benchmark --modes testing standalone -o sqlite.json
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from peewee import OperationalError
+
+from src.definitions import CONFIG_FILE
+from src.main import get_config
+from src.server.app import setup_database, create_tables
+from src.database.models import bulk_create_comments, comment_list, create_comment
+from scripts.benchmark import percentile, fake_hex, git_revision
+
+
+logger = logging.getLogger(__name__)
+
+
+def configure(mode: str, path: str) -> dict:
+    config = get_config(CONFIG_FILE)
+    if config[mode]['database'] != 'sqlite':
+        raise ValueError(f'{mode} is not a sqlite mode')
+    config['mode'] = mode
+    config[mode] = {**config[mode], 'file': path}
+    return config
+
+
+def seed(config: dict, claims: list, n_comments: int, seed: int):
+    rng = random.Random(seed)
+    app = {'config': config}
+    setup_database(app)
+    db = app['db']
+    db.connect()
+    create_tables(db)
+    with db.atomic():
+        bulk_create_comments([{
+            'claim_id': rng.choice(claims),
+            'comment': f'Seeded comment #{i}',
+            'channel_id': fake_hex(rng, 40),
+            'channel_name': f'@seed{i}',
+            'signature': fake_hex(rng, 128),
+            'signing_ts': str(i),
+            'timestamp': 1500000000 + i,
+        } for i in range(n_comments)])
+    db.close()
+
+
+def work(config: dict, claims: list, seconds: float, write_share: float, seed: int, start_at: float) -> dict:
+    rng = random.Random(seed)
+    app = {'config': config}
+    setup_database(app)
+    db, replicas = app['db'], app['replicas']
+    latencies = {'write': [], 'read': []}
+    errors = Counter()
+
+    # every worker starts at the same moment, so they contend from the first request on
+    time.sleep(max(start_at - time.time(), 0))
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        claim_id = rng.choice(claims)
+        kind = 'write' if rng.random() < write_share else 'read'
+        start = time.perf_counter()
+        try:
+            if kind == 'write':
+                with db.atomic():
+                    create_comment(
+                        claim_id=claim_id, comment=f'Benchmark comment {fake_hex(rng, 16)}',
+                        channel_id=fake_hex(rng, 40), channel_name='@benchmark',
+                        signature=fake_hex(rng, 128), signing_ts=str(int(time.time()))
+                    )
+            else:
+                replicas.run(replicas.reader([claim_id]), comment_list, claim_id, page_size=50)
+        except OperationalError as e:
+            errors[f'{kind}: {e}'] += 1
+            continue
+        latencies[kind].append(time.perf_counter() - start)
+
+    replicas.close()
+    if not db.is_closed():
+        db.close()
+    return {'latencies': latencies, 'errors': dict(errors)}
+
+
+def run_mode(mode: str, args, tmpdir: str) -> dict:
+    rng = random.Random(args.seed)
+    claims = [fake_hex(rng, 40) for _ in range(args.claims)]
+    config = configure(mode, os.path.join(tmpdir, f'{mode}.db'))
+    seed(config, claims, args.comments, args.seed)
+
+    start_at = time.time() + 1
+    jobs = [(config, claims, args.seconds, args.write_share, args.seed + 1 + i, start_at)
+            for i in range(args.processes)]
+    with multiprocessing.get_context('spawn').Pool(args.processes) as pool:
+        results = pool.starmap(work, jobs)
+
+    report = {}
+    errors = Counter()
+    for result in results:
+        errors.update(result['errors'])
+    for kind in ('write', 'read'):
+        latencies = sorted(t for result in results for t in result['latencies'][kind])
+        failed = sum(n for error, n in errors.items() if error.startswith(kind))
+        report[kind] = {
+            'ok': len(latencies),
+            'failed': failed,
+            'per_second': round(len(latencies) / args.seconds, 2),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        }
+    report['errors'] = dict(errors.most_common(5))
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', default=['testing', 'standalone'], help='sqlite modes of conf.yml')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--write-share', type=float, default=0.2, help='fraction of operations that write')
+    parser.add_argument('--comments', type=int, default=10000, help='size of the seeded corpus')
+    parser.add_argument('--claims', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', type=str, default=None, help='write the JSON report here')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    report = {
+        'revision': git_revision(),
+        'python': sys.version.split()[0],
+        'params': {k: v for k, v in vars(args).items() if k != 'output'},
+        'modes': {},
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for mode in args.modes:
+            logger.info(f'Running {mode} with {args.processes} processes for {args.seconds}s')
+            report['modes'][mode] = run_mode(mode, args, tmpdir)
+
+    dump = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(dump)
+    print(dump)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
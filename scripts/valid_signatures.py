@@ -1,86 +1,195 @@
-import binascii
-import logging
-import hashlib
-import json
-# todo: remove sqlite3 as a dependency
-import sqlite3
+"""
+Offline audit of comment signatures.
+
+Streams signed comments out of the database in chunks, resolves their channels
+through lbrynet in bounded batches, and verifies the signatures across a pool
+of worker processes. Invalid comments are appended to a JSONL report as they
+are found and progress is checkpointed after every chunk, so an audit of the
+whole database can be stopped and picked up again with --resume.
+
+    $ python -m scripts.valid_signatures --workers 16 --report invalid_comments.jsonl
+"""
+import argparse
 import asyncio
-import aiohttp
+import itertools
+import json
+import logging
+import os
+import sys
+import typing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from src.definitions import CONFIG_FILE
+from src.main import get_config, setup_db_from_config
+from src.server.app import setup_database
+from src.server.validation import validate_signature_from_claim
+from src.database.models import iter_comments
+from src.misc import get_claims_from_ids
 
-from src.server.validation import is_signature_valid, get_encoded_signature
 
 logger = logging.getLogger(__name__)
 
+# claim_search won't return more than this many claims per page
+LBRYNET_BATCH_SIZE = 50
 
-async def request_lbrynet(url, method, **params):
-    body = {'method': method, 'params': {**params}}
-    async with aiohttp.request('POST', url, json=body) as req:
-        try:
-            resp = await req.json()
-        finally:
-            if 'result' in resp:
-                return resp['result']
 
+def init_worker():
+    # failed verifications are expected here, they end up in the report instead
+    logging.getLogger('src.server.validation').setLevel(logging.CRITICAL)
 
-def get_comments_with_signatures(_conn: sqlite3.Connection) -> list:
-    with _conn:
-        curs = _conn.execute("SELECT * FROM COMMENTS_ON_CLAIMS WHERE signature IS NOT NULL")
-        return [dict(r) for r in curs.fetchall()]
 
+def verify_batch(batch: typing.List[typing.Tuple[dict, str]]) -> typing.List[bool]:
+    # runs inside the worker processes; each item is (comment, channel public key)
+    return [
+        bool(validate_signature_from_claim(
+            claim={'claim_id': comment['channel_id'], 'value': {'public_key': public_key}},
+            signature=comment['signature'],
+            signing_ts=comment['signing_ts'],
+            data=comment['comment']
+        ))
+        for comment, public_key in batch
+    ]
 
-def is_valid_signature(pubkey, channel_id, signature, signing_ts, data: str) -> bool:
-    try:
-        if pubkey:
-            claim_hash = binascii.unhexlify(channel_id.encode())[::-1]
-            injest = b''.join((signing_ts.encode(), claim_hash, data.encode()))
-            return is_signature_valid(
-                encoded_signature=get_encoded_signature(signature),
-                signature_digest=hashlib.sha256(injest).digest(),
-                public_key_bytes=binascii.unhexlify(pubkey.encode())
-            )
-        else:
-            raise Exception("Pubkey is null")
-    except Exception as e:
-        print(e)
-        return False
-
-
-async def get_channel_pubkeys(comments: list):
-    urls = {c['channel_url'] for c in comments}
-    claims = await request_lbrynet('http://localhost:5279', 'resolve', urls=list(urls))
-    cids = {c['channel_id']: None for c in comments}
-    error_claims = []
-    for url, claim in claims.items():
-        if 'error' not in claim:
-            cids.update({
-                claim['claim_id']: claim['value']['public_key']
-            })
-        else:
-            error_claims.append({url: claim})
-    return cids, error_claims
-
-
-def count_valid_signatures(cmts: list, chan_pubkeys: dict):
-    invalid_comments = []
-    for c in cmts:
-        pubkey = chan_pubkeys.get(c['channel_id'])
-        if not is_valid_signature(pubkey, c['channel_id'], c['signature'], c['signing_ts'], c['comment']):
-            invalid_comments.append(c)
-    return len(cmts) - len(invalid_comments), invalid_comments
 
+class ChannelKeys:
+    """ Bounded LRU of channel public keys, filled from lbrynet in batches """
 
-if __name__ == '__main__':
-    conn = sqlite3.connect('database/default.db')
-    conn.row_factory = sqlite3.Row
-    comments = get_comments_with_signatures(conn)
+    def __init__(self, app, max_size: int = 100000):
+        self.app = app
+        self.max_size = max_size
+        self.keys = OrderedDict()
+
+    async def fetch(self, channel_ids: typing.Iterable[str]) -> dict:
+        channel_ids = set(channel_ids)
+        missing = [cid for cid in channel_ids if cid not in self.keys]
+        for i in range(0, len(missing), LBRYNET_BATCH_SIZE):
+            batch = missing[i:i + LBRYNET_BATCH_SIZE]
+            found = await get_claims_from_ids(self.app, batch)
+            for cid in batch:
+                claim = found.get(cid)
+                self.keys[cid] = claim and claim.get('value', {}).get('public_key')
+        result = {}
+        for cid in channel_ids:
+            self.keys.move_to_end(cid)
+            result[cid] = self.keys[cid]
+        while len(self.keys) > self.max_size:
+            self.keys.popitem(last=False)
+        return result
+
+
+class Checkpoint:
+    """ Progress of an audit, rewritten atomically after each chunk """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.last_comment_id = None
+        self.totals = {'checked': 0, 'valid': 0, 'invalid': 0, 'unresolved': 0}
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path) as fp:
+                state = json.load(fp)
+            self.last_comment_id = state['last_comment_id']
+            self.totals.update(state['totals'])
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump({'last_comment_id': self.last_comment_id, 'totals': self.totals}, fp)
+        os.replace(tmp, self.path)
+
+
+async def audit(comments: typing.Iterator[dict], keys: ChannelKeys, pool: ProcessPoolExecutor,
+                checkpoint: Checkpoint, report, workers: int, chunk_size: int) -> dict:
     loop = asyncio.get_event_loop()
-    chan_keys, errored = loop.run_until_complete(get_channel_pubkeys(comments))
-    valid_sigs, invalid_coms = count_valid_signatures(comments, chan_keys)
-    print(f'Total Signatures: {len(comments)}\nValid Signatures: {valid_sigs}')
-    print(f'Invalid Signatures: {len(comments) - valid_sigs}')
-    print(f'Percent Valid: {round(valid_sigs/len(comments)*100, 3)}%')
-    print(f'# Unresolving claims: {len(errored)}')
-    print(f'Num invalid comments: {len(invalid_coms)}')
-    print(json.dumps(errored, indent=2))
-    json.dump(invalid_coms, 'invalid_coms.json', indent=2)
+    totals = checkpoint.totals
+    while True:
+        chunk = list(itertools.islice(comments, chunk_size))
+        if not chunk:
+            return totals
+        signed = [c for c in chunk if c.get('signature') and c.get('channel_id')]
+        public_keys = await keys.fetch(c['channel_id'] for c in signed)
+
+        to_verify = []
+        for comment in signed:
+            public_key = public_keys[comment['channel_id']]
+            if public_key:
+                to_verify.append((comment, public_key))
+            else:
+                totals['unresolved'] += 1
+                report.write(json.dumps({'reason': 'unresolved_channel', **comment}) + '\n')
+
+        size = max(len(to_verify) // workers, 1)
+        batches = [to_verify[i:i + size] for i in range(0, len(to_verify), size)]
+        results = await asyncio.gather(*(loop.run_in_executor(pool, verify_batch, b) for b in batches))
+        for (comment, _), is_valid in zip(to_verify, itertools.chain.from_iterable(results)):
+            if is_valid:
+                totals['valid'] += 1
+            else:
+                totals['invalid'] += 1
+                report.write(json.dumps({'reason': 'invalid_signature', **comment}) + '\n')
+
+        totals['checked'] += len(signed)
+        report.flush()
+        checkpoint.last_comment_id = chunk[-1]['comment_id']
+        checkpoint.save()
+        logger.info(f'{totals["checked"]} signatures checked, {totals["invalid"]} invalid, '
+                    f'{totals["unresolved"]} with unresolvable channels')
+
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Audit the signatures of every signed comment')
+    parser.add_argument('--report', type=str, default='invalid_comments.jsonl',
+                        help='invalid comments are appended here as JSONL')
+    parser.add_argument('--checkpoint', type=str, default=None,
+                        help='defaults to the report path with a .checkpoint suffix')
+    parser.add_argument('--resume', action='store_true', help='continue from the last checkpoint')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--claim-id', type=str, default=None)
+    parser.add_argument('--channel-id', type=str, default=None)
+    parser.add_argument('--config', type=str, default=CONFIG_FILE)
+    parser.add_argument('--mode', type=str, default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    config = get_config(args.config)
+    if args.mode:
+        config['mode'] = args.mode
+    setup_db_from_config(config)
+    app = {'config': config}
+    setup_database(app)
+    app['db'].connect()
+
+    checkpoint = Checkpoint(args.checkpoint or args.report + '.checkpoint')
+    if args.resume:
+        checkpoint.load()
+    filters = dict(
+        claim_id=args.claim_id,
+        channel_id=args.channel_id,
+        after=checkpoint.last_comment_id,
+        chunk_size=args.chunk_size
+    )
+    # every shard's comments, in one comment_id order
+    comments = app['shards'].iter_comments(**filters) if 'shards' in app else iter_comments(**filters)
+    try:
+        with open(args.report, 'a' if args.resume else 'w') as report, \
+                ProcessPoolExecutor(args.workers, initializer=init_worker) as pool:
+            totals = asyncio.get_event_loop().run_until_complete(audit(
+                comments, ChannelKeys(app), pool, checkpoint, report, args.workers, args.chunk_size
+            ))
+    finally:
+        (app['shards'] if 'shards' in app else app['db']).close()
+
+    checked = totals['checked']
+    print(f'Total Signatures: {checked}\nValid Signatures: {totals["valid"]}')
+    print(f'Invalid Signatures: {totals["invalid"]}')
+    print(f'# Unresolving channels: {totals["unresolved"]}')
+    if checked:
+        print(f'Percent Valid: {round(totals["valid"] / checked * 100, 3)}%')
+    print(f'Invalid comments written to {args.report}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
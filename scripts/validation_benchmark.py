@@ -0,0 +1,89 @@
+"""
+Microbenchmark of the per-request validation cost.
+
+Times the checks a create_comment request goes through, over a corpus of
+fake params where one in `--invalid` requests is malformed, with logging
+left on so failures cost what they do on a live server. Run it on two
+commits to compare them:
+
+    $ python -m scripts.validation_benchmark -o before.json
+    $ git checkout some-branch
+    $ python -m scripts.validation_benchmark -o after.json
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import timeit
+
+import faker
+
+from src.server import validation
+from src.server.validation import is_valid_base_comment
+
+
+fake = faker.Faker()
+
+
+def make_params(n: int, invalid_every: int, channels: int) -> list:
+    # comments from a limited pool of channels, the way real traffic is skewed
+    pool = [('@' + fake.user_name(), fake.sha1()) for _ in range(channels)]
+    corpus = []
+    for i in range(n):
+        channel_name, channel_id = random.choice(pool)
+        params = {
+            'comment': fake.text(max_nb_chars=500),
+            'claim_id': fake.sha1(),
+            'parent_id': None,
+            'channel_id': channel_id,
+            'channel_name': channel_name,
+            'signature': fake.sha256() + fake.sha256(),
+            'signing_ts': str(fake.unix_time()).split('.')[0],
+        }
+        if invalid_every and i % invalid_every == 0:
+            params['signature'] = params['signature'][:100]
+        corpus.append(params)
+    return corpus
+
+
+def run(corpus: list, repeat: int) -> dict:
+    def base():
+        for params in corpus:
+            is_valid_base_comment(**params)
+
+    report = {'requests': len(corpus), 'is_valid_base_comment_us': best(base, repeat) / len(corpus) * 1e6}
+    if hasattr(validation, 'validate_params'):
+        def schema():
+            for params in corpus:
+                validation.validate_params('create_comment', params)
+        report['validate_params_us'] = best(schema, repeat) / len(corpus) * 1e6
+    return report
+
+
+def best(fn, repeat: int) -> float:
+    return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--channels', type=int, default=500)
+    parser.add_argument('--invalid', type=int, default=20, help='one in this many requests is malformed')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('-o', '--output', help='write the report here as well')
+    args = parser.parse_args(argv)
+
+    # log to nowhere, but still pay for formatting the records
+    logging.basicConfig(stream=open('/dev/null', 'w'), level=logging.INFO)
+    random.seed(0)
+    faker.Faker.seed(0)
+    report = run(make_params(args.requests, args.invalid, args.channels), args.repeat)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
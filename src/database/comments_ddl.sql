@@ -32,6 +32,8 @@ CREATE TABLE `COMMENT` (
         `timestamp`   INTEGER NOT NULL,
         -- there's no way that the timestamp will ever reach 22 characters
         `ishidden`    BOOLEAN                    DEFAULT FALSE,
+        -- sha256 of bodies long enough to be kept in COMMENT_BODY once they repeat
+        `bodyhash`    CHAR(64)               DEFAULT NULL,
         CONSTRAINT `COMMENT_PRIMARY_KEY` PRIMARY KEY (`commentid`)
          -- setting null implies comment is top level
     )
@@ -48,3 +50,75 @@ ALTER TABLE COMMENT
 
 CREATE INDEX `claim_comment_index` ON `COMMENT` (`lbryclaimid`, `commentid`);
 CREATE INDEX `channel_comment_index` ON `COMMENT` (`channelid`, `commentid`);
+CREATE INDEX `comment_channelid_timestamp` ON `COMMENT` (`channelid`, `timestamp`);
+CREATE INDEX `comment_lbryclaimid_ishidden_timestamp` ON `COMMENT` (`lbryclaimid`, `ishidden`, `timestamp`);
+CREATE INDEX `comment_lbryclaimid_channelid` ON `COMMENT` (`lbryclaimid`, `channelid`);
+CREATE INDEX `comment_bodyhash` ON `COMMENT` (`bodyhash`);
+CREATE FULLTEXT INDEX `comment_body_fulltext` ON `COMMENT` (`body`);
+
+-- comments of claims that went cold, moved here whole by the archiver
+DROP TABLE IF EXISTS `COMMENT_ARCHIVE`;
+CREATE TABLE `COMMENT_ARCHIVE` LIKE `COMMENT`;
+ALTER TABLE `COMMENT_ARCHIVE` DROP INDEX `comment_body_fulltext`;
+
+-- bodies posted more than once, the comments referencing them have an empty body
+DROP TABLE IF EXISTS `COMMENT_BODY`;
+CREATE TABLE `COMMENT_BODY` (
+        `bodyhash` CHAR(64) NOT NULL,
+        `body`     TEXT
+            CHARACTER SET utf8mb4
+            COLLATE utf8mb4_unicode_ci
+            NOT NULL,
+        `refs`     INTEGER  NOT NULL DEFAULT 0,
+        CONSTRAINT `comment_body_pk` PRIMARY KEY (`bodyhash`)
+    )
+CHARACTER SET utf8mb4
+COLLATE utf8mb4_unicode_ci;
+
+DROP TABLE IF EXISTS `CHANNEL_STATS`;
+CREATE TABLE `CHANNEL_STATS` (
+        `channelid`      CHAR(40) NOT NULL,
+        `totalcomments`  INTEGER  NOT NULL DEFAULT 0,
+        `hiddencomments` INTEGER  NOT NULL DEFAULT 0,
+        CONSTRAINT `channel_stats_pk` PRIMARY KEY (`channelid`),
+        CONSTRAINT `channel_stats_channel_fk` FOREIGN KEY (`channelid`) REFERENCES `CHANNEL` (`claimid`)
+            ON DELETE CASCADE ON UPDATE CASCADE
+    )
+CHARACTER SET utf8mb4
+COLLATE utf8mb4_unicode_ci;
+
+DROP TABLE IF EXISTS `CLAIM_SUMMARY`;
+CREATE TABLE `CLAIM_SUMMARY` (
+        `lbryclaimid`      CHAR(40) NOT NULL,
+        `totalcomments`    INTEGER  NOT NULL DEFAULT 0,
+        `toplevelcomments` INTEGER  NOT NULL DEFAULT 0,
+        `channels`         INTEGER  NOT NULL DEFAULT 0,
+        `latesttimestamp`  INTEGER           DEFAULT NULL,
+        `version`          INTEGER  NOT NULL DEFAULT 0,
+        CONSTRAINT `claim_summary_pk` PRIMARY KEY (`lbryclaimid`)
+    )
+CHARACTER SET utf8mb4
+COLLATE utf8mb4_unicode_ci;
+
+-- only on the first shard, when comments are sharded by claim
+DROP TABLE IF EXISTS `COMMENT_SHARD`;
+CREATE TABLE `COMMENT_SHARD` (
+        `commentid` CHAR(64) NOT NULL,
+        `shard`     SMALLINT NOT NULL,
+        CONSTRAINT `comment_shard_pk` PRIMARY KEY (`commentid`)
+    )
+CHARACTER SET utf8mb4
+COLLATE utf8mb4_unicode_ci;
+
+-- only on the first shard, when the live stream relays events between workers
+DROP TABLE IF EXISTS `STREAM_EVENT`;
+CREATE TABLE `STREAM_EVENT` (
+        `id`      INTEGER AUTO_INCREMENT NOT NULL,
+        `origin`  CHAR(32) NOT NULL,
+        `created` INTEGER NOT NULL,
+        `events`  TEXT NOT NULL,
+        CONSTRAINT `stream_event_pk` PRIMARY KEY (`id`)
+    )
+CHARACTER SET utf8mb4
+COLLATE utf8mb4_unicode_ci;
+CREATE INDEX `streamevent_created` ON `STREAM_EVENT` (`created`);
@@ -0,0 +1,77 @@
+import contextlib
+import contextvars
+import time
+import typing
+
+from peewee import SqliteDatabase, MySQLDatabase, OperationalError
+
+
+# monotonic time by which the current request has to be done, tracked per asyncio task
+current_deadline: contextvars.ContextVar = contextvars.ContextVar('current_deadline', default=None)
+
+
+# never refused, a transaction has to be able to finish or roll back past its deadline
+TRANSACTION_CONTROL = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE')
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def deadline(seconds: typing.Optional[float]):
+    if seconds is None:
+        yield
+        return
+    token = current_deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+
+def deadline_passed() -> bool:
+    expires = current_deadline.get()
+    return expires is not None and time.monotonic() >= expires
+
+
+class DeadlineMixin:
+    """
+    Refuses to start statements once the current deadline has passed, and has the
+    database stop ones that run past it. An interrupted statement surfaces as
+    DeadlineExceeded, rolling back whatever transaction it was part of.
+    """
+
+    def statement_timeout(self, sql: str, remaining: float) -> str:
+        return sql
+
+    def execute_sql(self, sql, *args, **kwargs):
+        expires = current_deadline.get()
+        if expires is not None and not sql.lstrip().upper().startswith(TRANSACTION_CONTROL):
+            remaining = expires - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded('Deadline passed before the query could run')
+            sql = self.statement_timeout(sql, remaining)
+        try:
+            return super().execute_sql(sql, *args, **kwargs)
+        except OperationalError as e:
+            if deadline_passed():
+                raise DeadlineExceeded('Query interrupted by the deadline') from e
+            raise
+
+
+class DeadlineSqliteDatabase(DeadlineMixin, SqliteDatabase):
+    # sqlite calls the progress handler every so many VM instructions, a truthy return interrupts
+    progress_interval = 1000
+
+    def _add_conn_hooks(self, conn):
+        super()._add_conn_hooks(conn)
+        conn.set_progress_handler(deadline_passed, self.progress_interval)
+
+
+class DeadlineMySQLDatabase(DeadlineMixin, MySQLDatabase):
+    # only SELECTs honour the optimizer hint, writes are bounded by innodb_lock_wait_timeout
+    def statement_timeout(self, sql: str, remaining: float) -> str:
+        if sql.startswith('SELECT '):
+            return f'SELECT /*+ MAX_EXECUTION_TIME({max(int(remaining * 1000), 1)}) */ ' + sql[7:]
+        return sql
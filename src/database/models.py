@@ -1,15 +1,21 @@
+import heapq
+import itertools
 import json
 import time
 
 import logging
 import math
+import re
 import typing
+from collections import Counter
 
 from peewee import *
+from playhouse.mysql_ext import Match
+from playhouse.sqlite_ext import FTS5Model, SearchField, RowIDField
 import nacl.hash
 
 from src.server.validation import is_valid_base_comment
-from src.misc import clean
+from src.misc import clean, is_true
 
 
 class Channel(Model):
@@ -42,69 +48,280 @@ class Comment(Model):
     signature = FixedCharField(max_length=128, column_name='signature', null=True, unique=True)
     signing_ts = TextField(column_name='signingts', null=True)
     timestamp = IntegerField(column_name='timestamp')
+    # sha256 of bodies long enough to be worth storing once, see store_bodies
+    body_hash = FixedCharField(column_name='bodyhash', max_length=64, null=True, index=True)
 
     class Meta:
         table_name = 'COMMENT'
         indexes = (
             (('channel', 'comment_id'), False),
             (('claim_id', 'comment_id'), False),
+            (('channel', 'timestamp'), False),
+            # hidden comments are few, so listing or counting them shouldn't touch the visible ones
+            (('claim_id', 'is_hidden', 'timestamp'), False),
+            (('claim_id', 'channel'), False),
         )
 
 
-FIELDS = {
-    'comment': Comment.comment,
-    'comment_id': Comment.comment_id,
-    'claim_id': Comment.claim_id,
-    'timestamp': Comment.timestamp,
-    'signature': Comment.signature,
-    'signing_ts': Comment.signing_ts,
-    'is_hidden': Comment.is_hidden,
-    'parent_id': Comment.parent.alias('parent_id'),
-    'channel_id': Channel.claim_id.alias('channel_id'),
-    'channel_name': Channel.name.alias('channel_name'),
-    'channel_url': ('lbry://' + Channel.name + '#' + Channel.claim_id).alias('channel_url')
-}
+class ArchivedComment(Comment):
+    # comments of claims nobody has commented on in a while, moved out of COMMENT
+    # by archive_cold_claims. only used on a database with the archive enabled
+    class Meta:
+        table_name = 'COMMENT_ARCHIVE'
 
 
-def comment_list(claim_id: str = None, parent_id: str = None,
-                 top_level: bool = False, exclude_mode: str = None,
-                 page: int = 1, page_size: int = 50, expressions=None,
-                 select_fields: list = None, exclude_fields: list = None) -> dict:
-    fields = FIELDS.keys()
-    if exclude_fields:
-        fields -= set(exclude_fields)
-    if select_fields:
-        fields &= set(select_fields)
-    attributes = [FIELDS[field] for field in fields]
-    query = Comment.select(*attributes)
+class CommentBody(Model):
+    # bodies posted more than once, kept here once and left empty in the comments
+    # that reference them. only used on a database with the body store enabled
+    body_hash = FixedCharField(column_name='bodyhash', primary_key=True, max_length=64)
+    body = TextField(column_name='body')
+    refs = IntegerField(column_name='refs', default=0)
+
+    class Meta:
+        table_name = 'COMMENT_BODY'
+
+
+class ChannelStats(Model):
+    # precomputed per-channel totals, kept current by the write functions below
+    channel = ForeignKeyField(
+        column_name='channelid',
+        field='claim_id',
+        model=Channel,
+        primary_key=True,
+        backref='stats'
+    )
+    total_comments = IntegerField(column_name='totalcomments', default=0)
+    hidden_comments = IntegerField(column_name='hiddencomments', default=0)
+
+    class Meta:
+        table_name = 'CHANNEL_STATS'
+
+
+class ClaimSummary(Model):
+    # precomputed per-claim counts for feeds, kept current by the write functions below
+    claim_id = FixedCharField(column_name='lbryclaimid', primary_key=True, max_length=40)
+    total_comments = IntegerField(column_name='totalcomments', default=0)
+    top_level_comments = IntegerField(column_name='toplevelcomments', default=0)
+    channels = IntegerField(column_name='channels', default=0)
+    latest_timestamp = IntegerField(column_name='latesttimestamp', null=True)
+    # goes up with every write that touches the claim, and never back down
+    version = IntegerField(column_name='version', default=0)
+
+    class Meta:
+        table_name = 'CLAIM_SUMMARY'
+
+
+class CommentShard(Model):
+    # which shard a comment is on, for lookups by comment_id when comments are sharded by claim.
+    # only exists on the first database
+    comment_id = FixedCharField(column_name='commentid', primary_key=True, max_length=64)
+    shard = SmallIntegerField(column_name='shard')
+
+    class Meta:
+        table_name = 'COMMENT_SHARD'
+
+
+class StreamEvent(Model):
+    # live stream events, for the workers to pass each other's to their subscribers.
+    # only exists on the first database, when the stream relay is enabled
+    id = AutoField(column_name='id')
+    origin = FixedCharField(column_name='origin', max_length=32)
+    created = IntegerField(column_name='created', index=True)
+    events = TextField(column_name='events')
+
+    class Meta:
+        table_name = 'STREAM_EVENT'
+
+
+class CommentSearch(FTS5Model):
+    # external-content FTS5 index over COMMENT.body, only exists in sqlite mode.
+    # it is kept in sync with COMMENT by the triggers in SQLITE_SEARCH_DDL
+    rowid = RowIDField()
+    comment = SearchField(column_name='body')
+
+    class Meta:
+        table_name = 'COMMENT_FTS'
+
+
+SQLITE_SEARCH_DDL = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS COMMENT_FTS
+       USING fts5(body, content='COMMENT', content_rowid='rowid')""",
+    """CREATE TRIGGER IF NOT EXISTS comment_fts_insert AFTER INSERT ON COMMENT BEGIN
+         INSERT INTO COMMENT_FTS(rowid, body) VALUES (new.rowid, new.body);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS comment_fts_delete AFTER DELETE ON COMMENT BEGIN
+         INSERT INTO COMMENT_FTS(COMMENT_FTS, rowid, body) VALUES ('delete', old.rowid, old.body);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS comment_fts_update AFTER UPDATE OF body ON COMMENT BEGIN
+         INSERT INTO COMMENT_FTS(COMMENT_FTS, rowid, body) VALUES ('delete', old.rowid, old.body);
+         INSERT INTO COMMENT_FTS(rowid, body) VALUES (new.rowid, new.body);
+       END""",
+)
+
+
+def enable_tables(db, archive: bool = False, body_store: bool = False):
+    # which of the optional tables a database has, as the config says. binding the models
+    # along with their refs binds these too, so whether they're bound can't tell
+    db.archive_enabled = archive
+    db.body_store_enabled = body_store
+
+
+def archive_in_use() -> bool:
+    return getattr(Comment._meta.database, 'archive_enabled', False)
+
+
+def body_store_in_use() -> bool:
+    return getattr(Comment._meta.database, 'body_store_enabled', False)
+
+
+def comment_tiers() -> list:
+    return [Comment, ArchivedComment] if archive_in_use() else [Comment]
+
+
+def database_of(model) -> Database:
+    # the database the model's queries go to, through the sharding layer if there is one
+    db = model._meta.database
+    return getattr(db, 'obj', db)
+
+
+def setup_search_index(db: Database):
+    # sqlite gets an FTS5 table maintained by triggers, mysql a FULLTEXT index on body
+    if isinstance(db, SqliteDatabase):
+        CommentSearch.bind(db)
+        if not db.table_exists(CommentSearch._meta.table_name):
+            with db.atomic():
+                for statement in SQLITE_SEARCH_DDL:
+                    db.execute_sql(statement)
+                # pick up any comments written before the index existed
+                db.execute_sql("INSERT INTO COMMENT_FTS(COMMENT_FTS) VALUES ('rebuild')")
+    elif isinstance(db, MySQLDatabase):
+        if 'comment_body_fulltext' not in {i.name for i in db.get_indexes(Comment._meta.table_name)}:
+            db.execute_sql('CREATE FULLTEXT INDEX comment_body_fulltext ON COMMENT (body)')
+
+
+def fields_of(model) -> dict:
+    # rows whose body is in COMMENT_BODY have an empty one of their own, see join_bodies
+    body = fn.COALESCE(fn.NULLIF(model.comment, ''), CommentBody.body, '') if body_store_in_use() else model.comment
+    return {
+        'comment': body.alias('comment'),
+        'comment_id': model.comment_id,
+        'claim_id': model.claim_id,
+        'timestamp': model.timestamp,
+        'signature': model.signature,
+        'signing_ts': model.signing_ts,
+        'is_hidden': model.is_hidden,
+        'parent_id': model.parent.alias('parent_id'),
+        'channel_id': Channel.claim_id.alias('channel_id'),
+        'channel_name': Channel.name.alias('channel_name'),
+        'channel_url': ('lbry://' + Channel.name + '#' + Channel.claim_id).alias('channel_url')
+    }
+
+
+FIELDS = fields_of(Comment)
+# what pages are ordered by, needed to put the two tiers' pages together
+ORDER_FIELDS = {'timestamp', 'comment_id'}
+
+
+def join_bodies(query, model):
+    if not body_store_in_use():
+        return query
+    return query.join_from(model, CommentBody, JOIN.LEFT_OUTER, on=(model.body_hash == CommentBody.body_hash))
+
+
+def page_order(comment: dict) -> tuple:
+    return comment['timestamp'], comment['comment_id']
+
+
+def filter_comments(model, fields, claim_id: str = None, parent_id: str = None,
+                    top_level: bool = False, exclude_mode: str = None, channel_id: str = None,
+                    comment_ids: typing.List[str] = None, before: typing.Tuple[int, str] = None):
+    attributes = fields_of(model)
+    query = model.select(*[attributes[field] for field in fields])
 
     # todo: allow this process to be more automated, so it can just be an expression
     if claim_id:
-        query = query.where(Comment.claim_id == claim_id)
+        query = query.where(model.claim_id == claim_id)
         if top_level:
-            query = query.where(Comment.parent.is_null())
+            query = query.where(model.parent.is_null())
 
     if parent_id:
-        query = query.where(Comment.ParentId == parent_id)
+        query = query.where(model.ParentId == parent_id)
+
+    if channel_id:
+        query = query.where(model.channel == channel_id)
 
     if exclude_mode:
         show_hidden = exclude_mode.lower() == 'hidden'
-        query = query.where((Comment.is_hidden == show_hidden))
+        query = query.where((model.is_hidden == show_hidden))
+
+    if comment_ids is not None:
+        query = query.where(model.comment_id.in_(comment_ids))
+
+    if before:
+        # keyset on (timestamp, comment_id), for cursors
+        timestamp, comment_id = before
+        query = query.where((model.timestamp < timestamp) |
+                            ((model.timestamp == timestamp) & (model.comment_id < comment_id)))
+    return query
+
+
+def page_of(query, page: int, page_size: int) -> typing.List[dict]:
+    model = query.model
+    query = (join_bodies(query.join(Channel, JOIN.LEFT_OUTER), model)
+             .order_by(model.timestamp.desc(), model.comment_id.desc())
+             .paginate(page, page_size))
+    return [clean(item) for item in query.dicts()]
+
+
+def add_archived(query, filters: dict, fields, items: typing.List[dict], total: typing.Optional[int],
+                 page: int, page_size: int) -> typing.Tuple[typing.Optional[int], typing.List[dict]]:
+    # the newest archived match tells whether the page reaches into the archive at all,
+    # if it does both tiers are read down to the end of the page and merged
+    archived = filter_comments(ArchivedComment, fields, **filters)
+    newest = page_of(archived, 1, 1)
+    if not newest:
+        return total, items
+    if total is not None:
+        total += archived.count()
+    if len(items) == page_size and page_order(items[-1]) > page_order(newest[0]):
+        return total, items
+    depth = page * page_size
+    merged = heapq.merge(page_of(query, 1, depth), page_of(archived, 1, depth), key=page_order, reverse=True)
+    return total, list(itertools.islice(merged, depth - page_size, depth))
 
+
+def comment_list(claim_id: str = None, parent_id: str = None,
+                 top_level: bool = False, exclude_mode: str = None,
+                 page: int = 1, page_size: int = 50, expressions=None,
+                 select_fields: list = None, exclude_fields: list = None,
+                 channel_id: str = None, with_total: bool = True,
+                 comment_ids: typing.List[str] = None, before: typing.Tuple[int, str] = None) -> dict:
+    fields = FIELDS.keys()
+    if exclude_fields:
+        fields -= set(exclude_fields)
+    if select_fields:
+        fields &= set(select_fields)
+    filters = {
+        'claim_id': claim_id, 'parent_id': parent_id, 'top_level': top_level, 'exclude_mode': exclude_mode,
+        'channel_id': channel_id, 'comment_ids': comment_ids, 'before': before,
+    }
+    # raw expressions are written against COMMENT, so they only ever read the hot tier
+    tiered = archive_in_use() and not expressions
+    query = filter_comments(Comment, fields | ORDER_FIELDS if tiered else fields, **filters)
     if expressions:
         query = query.where(expressions)
 
-    total = query.count()
-    query = (query
-             .join(Channel, JOIN.LEFT_OUTER)
-             .order_by(Comment.timestamp.desc())
-             .paginate(page, page_size))
-    items = [clean(item) for item in query.dicts()]
+    # callers that know the total from elsewhere can skip the count
+    total = query.count() if with_total else None
+    items = page_of(query, page, page_size)
+    if tiered:
+        total, items = add_archived(query, filters, fields | ORDER_FIELDS, items, total, page, page_size)
+        items = [{k: v for k, v in item.items() if k in fields} for item in items]
     # has_hidden_comments is deprecated
     data = {
         'page': page,
         'page_size': page_size,
-        'total_pages': math.ceil(total / page_size),
+        'total_pages': math.ceil(total / page_size) if with_total else None,
         'total_items': total,
         'items': items,
         'has_hidden_comments': exclude_mode is not None and exclude_mode == 'hidden',
@@ -112,15 +329,161 @@ def comment_list(claim_id: str = None, parent_id: str = None,
     return data
 
 
+def search_comments(query: str, claim_id: str = None, channel_id: str = None,
+                    page: int = 1, page_size: int = 50) -> dict:
+    # every word in the query has to match, results are ordered by relevance.
+    # words are quoted so user input can never be parsed as search syntax
+    terms = re.findall(r'\w+', query or '')
+    if not terms:
+        raise ValueError('Search query must contain at least one word')
+
+    # bodies in COMMENT_BODY are left out of the search index along with their rows' empty ones
+    select = Comment.select(*fields_of(Comment).values())
+    if isinstance(database_of(Comment), SqliteDatabase):
+        match = CommentSearch.match(' '.join(f'"{term}"' for term in terms))
+        rank = CommentSearch.rank()
+        select = (select
+                  .join(CommentSearch, on=(CommentSearch.rowid == Column(Comment._meta.table, 'rowid')))
+                  .switch(Comment))
+    else:
+        match = Match((Comment.comment,), ' '.join(f'+{term}' for term in terms), 'IN BOOLEAN MODE')
+        rank = match.desc()
+    select = select.where(match)
+
+    if claim_id:
+        select = select.where(Comment.claim_id == claim_id)
+    if channel_id:
+        select = select.where(Comment.channel == channel_id)
+
+    total = select.count()
+    select = (join_bodies(select.join(Channel, JOIN.LEFT_OUTER), Comment)
+              .order_by(rank, Comment.timestamp.desc())
+              .paginate(page, page_size))
+    return {
+        'page': page,
+        'page_size': page_size,
+        'total_pages': math.ceil(total / page_size),
+        'total_items': total,
+        'items': [clean(item) for item in select.dicts()],
+    }
+
+
+def comment_as_dict(comment: Comment, channel: Channel = None) -> dict:
+    # same shape as the items of comment_list, for writes that already hold the row
+    return clean({
+        'comment': comment.comment,
+        'comment_id': comment.comment_id,
+        'claim_id': comment.claim_id,
+        'timestamp': comment.timestamp,
+        'signature': comment.signature,
+        'signing_ts': comment.signing_ts,
+        'is_hidden': bool(comment.is_hidden),
+        'parent_id': getattr(comment, Comment.parent.object_id_name),
+        'channel_id': channel and channel.claim_id,
+        'channel_name': channel and channel.name,
+        'channel_url': channel and f'lbry://{channel.name}#{channel.claim_id}',
+    })
+
+
 def get_comment(comment_id: str) -> dict:
     try:
-        comment = comment_list(expressions=(Comment.comment_id == comment_id), page_size=1).get('items').pop()
+        comment = comment_list(comment_ids=[comment_id], page_size=1).get('items').pop()
     except IndexError:
         raise ValueError(f'Comment does not exist with id {comment_id}')
     else:
         return comment
 
 
+def get_channel_comments(channel_id: str, claim_id: str = None, hidden: bool = None,
+                         page_size: int = 50, cursor: str = None) -> dict:
+    # newest first, keyset paginated over the (channel, timestamp) index so
+    # deep pages cost the same as the first one. `cursor` is the `next_cursor`
+    # of the previous page, totals come from CHANNEL_STATS rather than a count
+    before = None
+    if cursor:
+        try:
+            timestamp, comment_id = cursor.split(':')
+            before = int(timestamp), comment_id
+        except ValueError:
+            raise ValueError(f'Invalid cursor: {cursor}')
+
+    exclude_mode = None if hidden is None else ('hidden' if hidden else 'visible')
+    items = comment_list(
+        channel_id=channel_id,
+        claim_id=claim_id,
+        exclude_mode=exclude_mode,
+        before=before,
+        page_size=page_size + 1,
+        with_total=False
+    )['items']
+    has_more = len(items) > page_size
+    items = items[:page_size]
+
+    stats = ChannelStats.get_or_none(ChannelStats.channel == channel_id)
+    return {
+        'items': items,
+        'page_size': page_size,
+        'next_cursor': f'{items[-1]["timestamp"]}:{items[-1]["comment_id"]}' if has_more else None,
+        'total_items': stats.total_comments if stats else 0,
+        'hidden_items': stats.hidden_comments if stats else 0,
+    }
+
+
+def get_claim_summaries(claim_ids: typing.List[str]) -> dict:
+    summaries = {s['claim_id']: s for s in (ClaimSummary
+                                            .select()
+                                            .where(ClaimSummary.claim_id.in_(claim_ids))
+                                            .dicts())}
+    items = []
+    for claim_id in claim_ids:
+        summary = summaries.get(claim_id, {'claim_id': claim_id})
+        items.append(clean({
+            'claim_id': claim_id,
+            'total_comments': summary.get('total_comments', 0),
+            'top_level_comments': summary.get('top_level_comments', 0),
+            'channels': summary.get('channels', 0),
+            'latest_timestamp': summary.get('latest_timestamp'),
+        }))
+    return {'items': items}
+
+
+def iter_comments(claim_id: str = None, channel_id: str = None, since: int = None,
+                  until: int = None, after: str = None, chunk_size: int = 1000) -> typing.Iterator[dict]:
+    # streams comments in comment_id order, one bounded query per chunk.
+    # keyset pagination on comment_id rides the primary key, or the
+    # (claim_id, comment_id) / (channel, comment_id) index when filtering.
+    # `after` resumes a previous walk from the last comment_id it saw.
+    # only the shard in use is walked, ShardSet.iter_comments goes over them all
+    def walk(model) -> typing.Iterator[dict]:
+        query = (join_bodies(model.select(*fields_of(model).values()).join(Channel, JOIN.LEFT_OUTER), model)
+                 .order_by(model.comment_id)
+                 .limit(chunk_size))
+        if claim_id:
+            query = query.where(model.claim_id == claim_id)
+        if channel_id:
+            query = query.where(model.channel == channel_id)
+        if since:
+            query = query.where(model.timestamp >= since)
+        if until:
+            query = query.where(model.timestamp < until)
+
+        last_id = after
+        while True:
+            chunk = query if last_id is None else query.where(model.comment_id > last_id)
+            count = 0
+            for item in chunk.dicts().iterator():
+                count += 1
+                last_id = item['comment_id']
+                yield clean(item)
+            if count < chunk_size:
+                return
+
+    if not archive_in_use():
+        return walk(Comment)
+    # both tiers walk in comment_id order, so they interleave into one
+    return heapq.merge(walk(Comment), walk(ArchivedComment), key=lambda c: c['comment_id'])
+
+
 def create_comment_id(comment: str, channel_id: str, timestamp: int):
     # We convert the timestamp from seconds into minutes
     # to prevent spammers from commenting the same BS everywhere.
@@ -136,6 +499,94 @@ def create_comment_id(comment: str, channel_id: str, timestamp: int):
     return nacl.hash.sha256(prehash).decode()
 
 
+# shorter bodies would save less than their hash costs in the row and its index
+STORED_BODY_MIN_LENGTH = 128
+
+
+def body_hash(body: str) -> str:
+    return nacl.hash.sha256(body.encode()).decode()
+
+
+def store_bodies(rows: typing.List[dict]) -> typing.List[dict]:
+    # gives the rows about to be written their body's hash, and leaves their body empty
+    # if it's in COMMENT_BODY. a body goes in there once a second comment has it, the
+    # comments that had it to themselves give up their copy then
+    if not body_store_in_use():
+        return rows
+    repeats = Counter()
+    for row in rows:
+        row['body_hash'] = body_hash(row['comment']) if len(row['comment']) >= STORED_BODY_MIN_LENGTH else None
+        if row['body_hash']:
+            repeats[row['body_hash']] += 1
+    if not repeats:
+        return rows
+
+    bodies = {row['body_hash']: row['comment'] for row in rows if row['body_hash']}
+    stored = {h for h, in (CommentBody
+                           .select(CommentBody.body_hash)
+                           .where(CommentBody.body_hash.in_(list(repeats)))
+                           .tuples())}
+    for h, n in repeats.items():
+        if h in stored:
+            CommentBody.update(refs=CommentBody.refs + n).where(CommentBody.body_hash == h).execute()
+            continue
+        n += sum(model
+                 .update(comment='')
+                 .where((model.body_hash == h) & (model.comment != ''))
+                 .execute() for model in comment_tiers())
+        if n > 1:
+            CommentBody.insert(body_hash=h, body=bodies[h], refs=n).execute()
+            stored.add(h)
+    for row in rows:
+        if row['body_hash'] in stored:
+            row['comment'] = ''
+    return rows
+
+
+def stored_refs(model, comment_ids: typing.List[str]) -> Counter:
+    # how many of the comments reference each stored body
+    refs = Counter()
+    if body_store_in_use():
+        for batch in chunked(comment_ids, 500):
+            refs.update(h for h, in (model
+                                     .select(model.body_hash)
+                                     .where(model.comment_id.in_(batch) & (model.comment == '') &
+                                            model.body_hash.is_null(False))
+                                     .tuples()))
+    return refs
+
+
+def release_bodies(refs: typing.Dict[str, int]):
+    # drops references to stored bodies, and the bodies nothing references anymore
+    refs = {h: n for h, n in refs.items() if h and n}
+    if not body_store_in_use() or not refs:
+        return
+    for h, n in refs.items():
+        CommentBody.update(refs=CommentBody.refs - n).where(CommentBody.body_hash == h).execute()
+    CommentBody.delete().where(CommentBody.body_hash.in_(list(refs)) & (CommentBody.refs <= 0)).execute()
+
+
+def recount_bodies(hashes: typing.Iterable[str]):
+    # recomputes the references of stored bodies, for writes that can't tell which of their rows made it
+    hashes = list({h for h in hashes if h})
+    if not body_store_in_use() or not hashes:
+        return
+    refs = Counter()
+    for model, batch in itertools.product(comment_tiers(), chunked(hashes, 500)):
+        refs.update(dict(model
+                         .select(model.body_hash, fn.COUNT(model.comment_id))
+                         .where(model.body_hash.in_(batch) & (model.comment == ''))
+                         .group_by(model.body_hash)
+                         .tuples()))
+    for h in hashes:
+        CommentBody.update(refs=refs[h]).where(CommentBody.body_hash == h).execute()
+    CommentBody.delete().where(CommentBody.body_hash.in_(hashes) & (CommentBody.refs <= 0)).execute()
+
+
+def channel_renamed(channel: Channel) -> str:
+    return f'Channel {channel.claim_id} is known as {channel.name}'
+
+
 def create_comment(comment: str = None, claim_id: str = None,
                    parent_id: str = None, channel_id: str = None,
                    channel_name: str = None, signature: str = None,
@@ -151,56 +602,510 @@ def create_comment(comment: str = None, claim_id: str = None,
     ):
         raise ValueError('Invalid Parameters given for comment')
 
-    channel, _ = Channel.get_or_create(name=channel_name, claim_id=channel_id)
+    channel, _ = Channel.get_or_create(claim_id=channel_id, defaults={'name': channel_name})
+    if channel.name != channel_name:
+        raise ValueError(channel_renamed(channel))
+    restore_claims([claim_id] if claim_id else [], comment_ids=[parent_id] if parent_id else [])
     if parent_id and not claim_id:
         parent: Comment = Comment.get_by_id(parent_id)
         claim_id = parent.claim_id
 
     timestamp = int(time.time())
     comment_id = create_comment_id(comment, channel_id, timestamp)
+    row, = store_bodies([{'comment': comment}])
     new_comment = Comment.create(
             claim_id=claim_id,
             comment_id=comment_id,
-            comment=comment,
             parent=parent_id,
             channel=channel,
             signature=signature,
             signing_ts=signing_ts,
-            timestamp=timestamp
+            timestamp=timestamp,
+            **row
         )
-    return get_comment(new_comment.comment_id)
+    new_comment.comment = comment
+    adjust_channel_stats({channel_id: (1, 0)})
+    add_to_claim_summaries([{'claim_id': claim_id, 'channel': channel_id, 'parent': parent_id, 'timestamp': timestamp}])
+    return comment_as_dict(new_comment, channel)
 
 
-def delete_comment(comment_id: str) -> bool:
+def create_comment_batch(comments: typing.List[dict]) -> typing.List[typing.Union[dict, Exception]]:
+    # creates several comments with multi-row inserts, meant to run inside one transaction.
+    # every comment gets either its created row or the error it would have raised on its own
+    results: typing.List[typing.Union[dict, Exception]] = [None] * len(comments)
+    rows, channels = {}, {}
+    timestamp = int(time.time())
+    for i, c in enumerate(comments):
+        if not is_valid_base_comment(**c):
+            results[i] = ValueError('Invalid Parameters given for comment')
+            continue
+        channels[c['channel_id']] = c['channel_name']
+        rows[i] = {
+            'claim_id': c.get('claim_id'),
+            'comment_id': create_comment_id(c['comment'], c['channel_id'], timestamp),
+            'comment': c['comment'],
+            'parent': c.get('parent_id'),
+            'channel': c['channel_id'],
+            'signature': c.get('signature'),
+            'signing_ts': c.get('signing_ts'),
+            'timestamp': timestamp,
+        }
+
+    # replies given without a claim_id inherit it from their parent
+    parent_ids = {row['parent'] for row in rows.values() if not row['claim_id']}
+    restore_claims({row['claim_id'] for row in rows.values() if row['claim_id']}, comment_ids=parent_ids)
+    if parent_ids:
+        parent_claims = dict(Comment
+                             .select(Comment.comment_id, Comment.claim_id)
+                             .where(Comment.comment_id.in_(list(parent_ids)))
+                             .tuples())
+        for i, row in list(rows.items()):
+            if not row['claim_id']:
+                if row['parent'] not in parent_claims:
+                    results[i] = ValueError(f'Comment does not exist with id {row["parent"]}')
+                    del rows[i]
+                else:
+                    row['claim_id'] = parent_claims[row['parent']]
+
+    insert_ignore_many(Channel, [{'claim_id': k, 'name': v} for k, v in channels.items()])
+    stored = Channel.select().where(Channel.claim_id.in_(list(channels)))
+    stored = {channel.claim_id: channel for channel in stored}
+    for i, row in list(rows.items()):
+        if stored[row['channel']].name != comments[i]['channel_name']:
+            results[i] = ValueError(channel_renamed(stored[row['channel']]))
+            del rows[i]
+    store_bodies(list(rows.values()))
     try:
-        comment: Comment = Comment.get_by_id(comment_id)
-    except DoesNotExist as e:
-        raise ValueError from e
-    else:
-        return 0 < comment.delete_instance(True, delete_nullable=True)
+        with Comment._meta.database.atomic():
+            for batch in chunked(list(rows.values()), 100):
+                Comment.insert_many(batch).execute()
+    except IntegrityError:
+        # somebody's duplicate spoils the batch, fall back to one savepoint per comment
+        for i, row in list(rows.items()):
+            try:
+                with Comment._meta.database.atomic():
+                    Comment.insert(row).execute()
+            except IntegrityError as e:
+                results[i] = e
+                if not row['comment']:
+                    release_bodies({row['body_hash']: 1})
+                del rows[i]
+
+    adjust_channel_stats({ch: (n, 0) for ch, n in Counter(row['channel'] for row in rows.values()).items()})
+    add_to_claim_summaries(list(rows.values()))
+    for i, row in rows.items():
+        results[i] = comment_as_dict(Comment(**{**row, 'comment': comments[i]['comment']}), stored[row['channel']])
+    return results
+
+
+def insert_ignore_many(model, rows: typing.List[dict]) -> int:
+    # compiles the INSERT once and leaves the batching to the driver's executemany,
+    # (pymysql rewrites it into multi-row inserts) which skips peewee's per-value
+    # query building. rows are dicts keyed by field name, conflicting rows are skipped
+    if not rows:
+        return 0
+    fields = [f for f in model._meta.sorted_fields if f.name in rows[0]]
+    sql, _ = model.insert({f: '' for f in fields}).on_conflict_ignore().sql()
+    cursor = model._meta.database.cursor()
+    cursor.executemany(sql, [tuple(row[f.name] for f in fields) for row in rows])
+    return cursor.rowcount
+
+
+def bulk_create_comments(comments: typing.Iterable[dict]) -> dict:
+    # inserts a batch of comments using multi-row inserts, meant for imports & migrations.
+    # rows may carry their own comment_id & timestamp, duplicates are ignored
+    # should be called inside a transaction, one per batch
+    channels, rows, invalid = {}, [], 0
+    orphans = []
+    for c in comments:
+        if not is_valid_base_comment(
+                comment=c.get('comment'),
+                claim_id=c.get('claim_id'),
+                parent_id=c.get('parent_id'),
+                channel_id=c.get('channel_id'),
+                channel_name=c.get('channel_name'),
+                signature=c.get('signature'),
+                signing_ts=c.get('signing_ts')
+        ):
+            invalid += 1
+            continue
+        channels[c['channel_id']] = c['channel_name']
+        timestamp = int(c.get('timestamp') or time.time())
+        row = {
+            'comment_id': c.get('comment_id') or create_comment_id(c['comment'], c['channel_id'], timestamp),
+            'claim_id': c.get('claim_id'),
+            'comment': c['comment'],
+            'parent': c.get('parent_id'),
+            'channel': c['channel_id'],
+            'signature': c['signature'],
+            'signing_ts': c['signing_ts'],
+            'timestamp': timestamp,
+            'is_hidden': is_true(c.get('is_hidden', False)),
+        }
+        if not row['claim_id']:
+            orphans.append(row)
+        rows.append(row)
+
+    restore_claims({row['claim_id'] for row in rows if row['claim_id']},
+                   comment_ids={row['parent'] for row in orphans})
+    # replies given without a claim_id inherit it from their parent
+    if orphans:
+        batch_claims = {row['comment_id']: row['claim_id'] for row in rows if row['claim_id']}
+        missing = {row['parent'] for row in orphans if row['parent'] not in batch_claims}
+        if missing:
+            batch_claims.update(Comment
+                                .select(Comment.comment_id, Comment.claim_id)
+                                .where(Comment.comment_id.in_(list(missing)))
+                                .tuples())
+        for row in orphans:
+            row['claim_id'] = batch_claims.get(row['parent'])
+        invalid += sum(1 for row in orphans if not row['claim_id'])
+        rows = [row for row in rows if row['claim_id']]
 
+    insert_ignore_many(Channel, [{'claim_id': k, 'name': v} for k, v in channels.items()])
+    # the duplicates that get skipped can't be told apart, so stored bodies are counted afterwards
+    store_bodies(rows)
+    inserted = insert_ignore_many(Comment, rows)
+    recount_bodies(row.get('body_hash') for row in rows)
+    rebuild_channel_stats(list(channels))
+    rebuild_claim_summaries(list({row['claim_id'] for row in rows}))
+    return {
+        'inserted': inserted,
+        'duplicates': len(rows) - inserted,
+        'invalid': invalid,
+    }
+
+
+def upsert(model, row: dict, update: dict):
+    # mysql infers the conflict from the primary key, sqlite has to be told
+    target = None if isinstance(database_of(model), MySQLDatabase) else [model._meta.primary_key]
+    return model.insert(row).on_conflict(conflict_target=target, update=update).execute()
+
+
+def adjust_channel_stats(deltas: typing.Dict[str, typing.Tuple[int, int]]):
+    # applies (total, hidden) increments to each channel's totals
+    for channel_id, (total, hidden) in deltas.items():
+        if channel_id is None or not (total or hidden):
+            continue
+        upsert(
+            ChannelStats,
+            {'channel': channel_id, 'total_comments': max(total, 0), 'hidden_comments': max(hidden, 0)},
+            {ChannelStats.total_comments: ChannelStats.total_comments + total,
+             ChannelStats.hidden_comments: ChannelStats.hidden_comments + hidden}
+        )
+
+
+def rebuild_channel_stats(channel_ids: typing.List[str] = None):
+    # recomputes channel totals from COMMENT, for backfills and bulk writes
+    totals = (Comment
+              .select(Comment.channel, fn.COUNT(Comment.comment_id), fn.COALESCE(fn.SUM(Comment.is_hidden), 0))
+              .where(Comment.channel.is_null(False))
+              .group_by(Comment.channel))
+    stale = ChannelStats.delete()
+    if channel_ids is not None:
+        if not channel_ids:
+            return
+        totals = totals.where(Comment.channel.in_(channel_ids))
+        stale = stale.where(ChannelStats.channel.in_(channel_ids))
+    stale.execute()
+    (ChannelStats
+     .insert_from(totals, [ChannelStats.channel, ChannelStats.total_comments, ChannelStats.hidden_comments])
+     .execute())
+    if archive_in_use():
+        # archived comments still count towards their channels
+        archived = (ArchivedComment
+                    .select(ArchivedComment.channel, fn.COUNT(ArchivedComment.comment_id),
+                            fn.COALESCE(fn.SUM(ArchivedComment.is_hidden), 0))
+                    .where(ArchivedComment.channel.is_null(False))
+                    .group_by(ArchivedComment.channel))
+        if channel_ids is not None:
+            archived = archived.where(ArchivedComment.channel.in_(channel_ids))
+        adjust_channel_stats({channel_id: (total, hidden) for channel_id, total, hidden in archived.tuples()})
+
+
+def add_to_claim_summaries(rows: typing.List[dict]):
+    # folds freshly inserted comment rows into the summaries of their claims
+    by_claim = {}
+    for row in rows:
+        by_claim.setdefault(row['claim_id'], []).append(row)
+    for claim_id, new in by_claim.items():
+        # a channel is new to the claim if its only comments there are the ones just added
+        new_channels = sum(1 for channel_id, n in Counter(row['channel'] for row in new).items()
+                           if Comment.select()
+                                     .where((Comment.claim_id == claim_id) & (Comment.channel == channel_id))
+                                     .limit(n + 1)
+                                     .count() == n)
+        top_level = sum(1 for row in new if not row['parent'])
+        latest = max(row['timestamp'] for row in new)
+        upsert(
+            ClaimSummary,
+            {'claim_id': claim_id, 'total_comments': len(new), 'top_level_comments': top_level,
+             'channels': new_channels, 'latest_timestamp': latest, 'version': 1},
+            {ClaimSummary.total_comments: ClaimSummary.total_comments + len(new),
+             ClaimSummary.top_level_comments: ClaimSummary.top_level_comments + top_level,
+             ClaimSummary.channels: ClaimSummary.channels + new_channels,
+             ClaimSummary.latest_timestamp: Case(None, [(ClaimSummary.latest_timestamp > latest,
+                                                         ClaimSummary.latest_timestamp)], latest),
+             ClaimSummary.version: ClaimSummary.version + 1}
+        )
+
+
+def bump_claim_versions(claim_ids: typing.Iterable[str]):
+    claim_ids = list(set(claim_ids))
+    if claim_ids:
+        (ClaimSummary
+         .update(version=ClaimSummary.version + 1)
+         .where(ClaimSummary.claim_id.in_(claim_ids))
+         .execute())
+
+
+def claim_totals(model):
+    return (model
+            .select(model.claim_id,
+                    fn.COUNT(model.comment_id),
+                    fn.SUM(Case(None, [(model.parent.is_null(), 1)], 0)),
+                    fn.COUNT(fn.DISTINCT(model.channel)),
+                    fn.MAX(model.timestamp))
+            .group_by(model.claim_id))
+
+
+def rebuild_claim_summaries(claim_ids: typing.List[str] = None):
+    # recomputes claim summaries from COMMENT, for backfills, deletes and bulk writes.
+    # a claim's comments are all in one tier, so archived claims are summed up on their own
+    tiers = comment_tiers()
+    fields = [ClaimSummary.claim_id, ClaimSummary.total_comments, ClaimSummary.top_level_comments,
+              ClaimSummary.channels, ClaimSummary.latest_timestamp]
+    if claim_ids is None:
+        ClaimSummary.delete().execute()
+        for model in tiers:
+            ClaimSummary.insert_from(claim_totals(model).select_extend(SQL('1')),
+                                     fields + [ClaimSummary.version]).execute()
+        return
+
+    found = set()
+    summaries = (claim_totals(model).where(model.claim_id.in_(claim_ids)).tuples() for model in tiers)
+    for summary in itertools.chain.from_iterable(summaries):
+        row = dict(zip((f.name for f in fields), summary))
+        upsert(
+            ClaimSummary,
+            {**row, 'version': 1},
+            {**{f: row[f.name] for f in fields[1:]}, ClaimSummary.version: ClaimSummary.version + 1}
+        )
+        found.add(row['claim_id'])
+    # claims left without comments keep their row, so their version doesn't start over
+    emptied = [claim_id for claim_id in claim_ids if claim_id not in found]
+    if emptied:
+        (ClaimSummary
+         .update(total_comments=0, top_level_comments=0, channels=0, latest_timestamp=None,
+                 version=ClaimSummary.version + 1)
+         .where(ClaimSummary.claim_id.in_(emptied))
+         .execute())
+
+
+def select_thread(comment_ids: typing.List[str]) -> typing.List[tuple]:
+    # the comments along with every reply below them, as (comment_id, claim_id, channel_id, is_hidden)
+    columns = (Comment.comment_id, Comment.claim_id, Comment.channel, Comment.is_hidden)
+    rows = list(Comment.select(*columns).where(Comment.comment_id.in_(comment_ids)).tuples())
+    seen = {row[0] for row in rows}
+    frontier = list(seen)
+    while frontier:
+        # replies that were asked for directly are already in there
+        children = [row for row in Comment.select(*columns).where(Comment.parent.in_(frontier)).tuples()
+                    if row[0] not in seen]
+        rows += children
+        seen.update(row[0] for row in children)
+        frontier = [row[0] for row in children]
+    return rows
+
+
+def thread_ids(comment_ids: typing.List[str]) -> typing.List[str]:
+    # what deleting the comments would take along, with archived threads brought back first
+    restore_claims(comment_ids=comment_ids)
+    return [row[0] for row in select_thread(comment_ids)]
 
-def edit_comment(comment_id: str, new_comment: str, new_sig: str, new_ts: str) -> bool:
+
+def existing_comments(comment_ids: typing.List[str]) -> typing.List[str]:
+    found = []
+    for batch in chunked(comment_ids, 500):
+        found += [comment_id for comment_id, in Comment.select(Comment.comment_id)
+                  .where(Comment.comment_id.in_(batch)).tuples()]
+    return found
+
+
+def delete_comments(comment_ids: typing.List[str]) -> typing.List[str]:
+    # replies get deleted along with the comments, returns the ids that existed
+    restore_claims(comment_ids=comment_ids)
+    thread = select_thread(comment_ids)
+    released = stored_refs(Comment, [row[0] for row in thread])
+    # deepest replies first, as far as the walk tells
+    for batch in chunked([row[0] for row in reversed(thread)], 500):
+        Comment.delete().where(Comment.comment_id.in_(batch)).execute()
+    release_bodies(released)
+    totals, hidden = Counter(), Counter()
+    for _, _, channel_id, is_hidden in thread:
+        totals[channel_id] -= 1
+        hidden[channel_id] -= int(bool(is_hidden))
+    adjust_channel_stats({ch: (totals[ch], hidden[ch]) for ch in totals})
+    rebuild_claim_summaries(list({row[1] for row in thread}))
+    found = {row[0] for row in thread}
+    return [comment_id for comment_id in comment_ids if comment_id in found]
+
+
+def delete_comment(comment_id: str) -> bool:
+    if not delete_comments([comment_id]):
+        raise ValueError(f'Comment does not exist with id {comment_id}')
+    return True
+
+
+def set_body(comment: Comment, body: str):
+    # swaps the body of a row about to be saved, along with its reference to a stored one
+    if comment.body_hash and comment.body_hash == body_hash(body):
+        return
+    if not comment.comment:
+        release_bodies({comment.body_hash: 1})
+    row, = store_bodies([{'comment': body}])
+    comment.comment = row['comment']
+    comment.body_hash = row.get('body_hash')
+
+
+def edit_comment(comment_id: str, new_comment: str, new_sig: str, new_ts: str) -> typing.Optional[dict]:
+    restore_claims(comment_ids=[comment_id])
     try:
-        comment: Comment = Comment.get_by_id(comment_id)
+        comment: Comment = (Comment
+                            .select(Comment, Channel)
+                            .join(Channel, JOIN.LEFT_OUTER)
+                            .where(Comment.comment_id == comment_id)
+                            .get())
     except DoesNotExist as e:
         raise ValueError from e
     else:
-        comment.comment = new_comment
+        set_body(comment, new_comment)
         comment.signature = new_sig
         comment.signing_ts = new_ts
 
         # todo: add a 'last-modified' timestamp
         comment.timestamp = int(time.time())
-        return comment.save() > 0
+        if comment.save() > 0:
+            bump_claim_versions([comment.claim_id])
+            comment.comment = new_comment
+            return comment_as_dict(comment, comment.channel)
+
+
+def edit_comments(edits: typing.List[dict]) -> typing.List[dict]:
+    # applies many edits of the form {comment_id, comment, signature, signing_ts},
+    # returns the updated comments; ids that don't exist are skipped
+    edits = {edit['comment_id']: edit for edit in edits}
+    restore_claims(comment_ids=list(edits))
+    query = (Comment
+             .select(Comment, Channel)
+             .join(Channel, JOIN.LEFT_OUTER)
+             .where(Comment.comment_id.in_(list(edits))))
+    timestamp = int(time.time())
+    updated = {}
+    for comment in query:
+        edit = edits[comment.comment_id]
+        set_body(comment, edit['comment'])
+        comment.signature = edit['signature']
+        comment.signing_ts = edit['signing_ts']
+        comment.timestamp = timestamp
+        if comment.save() > 0:
+            comment.comment = edit['comment']
+            updated[comment.comment_id] = comment_as_dict(comment, comment.channel)
+    bump_claim_versions(c['claim_id'] for c in updated.values())
+    return [updated[comment_id] for comment_id in edits if comment_id in updated]
 
 
 def set_hidden_flag(comment_ids: typing.List[str], hidden=True) -> bool:
     # sets `is_hidden` flag for all `comment_ids` to the `hidden` param
+    restore_claims(comment_ids=comment_ids)
+    flipping = list(Comment
+                    .select(Comment.channel, Comment.claim_id)
+                    .where(Comment.comment_id.in_(comment_ids) & (Comment.is_hidden != hidden))
+                    .tuples())
+    flipped = Counter(channel_id for channel_id, _ in flipping)
     update = (Comment
               .update(is_hidden=hidden)
               .where(Comment.comment_id.in_(comment_ids)))
-    return update.execute() > 0
+    updated = update.execute() > 0
+    adjust_channel_stats({ch: (0, n if hidden else -n) for ch, n in flipped.items()})
+    bump_claim_versions(claim_id for _, claim_id in flipping)
+    return updated
+
+
+def parents_first(rows: typing.List[dict]) -> typing.List[dict]:
+    # orders comment rows by how deep their replies are, so every parent comes before its
+    # replies. timestamps don't, an edit moves a comment's up past the ones replying to it
+    parents = {row['comment_id']: row['parent'] for row in rows}
+    depths = {}
+    for comment_id in parents:
+        chain = []
+        while comment_id in parents and comment_id not in depths and comment_id not in chain:
+            chain.append(comment_id)
+            comment_id = parents[comment_id]
+        depth = depths.get(comment_id, -1)
+        for comment_id in reversed(chain):
+            depth += 1
+            depths[comment_id] = depth
+    return sorted(rows, key=lambda row: (depths[row['comment_id']], row['timestamp'], row['comment_id']))
+
+
+def move_comments(source, target, claim_ids: typing.List[str]) -> int:
+    # moves every comment of the claims between COMMENT and COMMENT_ARCHIVE. summaries
+    # and channel totals count both, so they're left as they are
+    rows = parents_first(list(source.select().where(source.claim_id.in_(claim_ids)).dicts()))
+    with Comment._meta.database.atomic():
+        # parents go in before their replies and come out after them
+        for batch in chunked(rows, 500):
+            target.insert_many(batch).execute()
+        for batch in chunked([row['comment_id'] for row in reversed(rows)], 500):
+            source.delete().where(source.comment_id.in_(batch)).execute()
+    return len(rows)
+
+
+def restore_claims(claim_ids: typing.Iterable[str] = (), comment_ids: typing.Iterable[str] = ()) -> int:
+    # brings archived claims back into COMMENT before anything writes to them, along
+    # with the claims of any archived `comment_ids`. claims stay whole in either tier
+    if not archive_in_use():
+        return 0
+    claim_ids, comment_ids = set(claim_ids), list(comment_ids)
+    if comment_ids:
+        claim_ids.update(claim_id for claim_id, in (ArchivedComment
+                                                    .select(ArchivedComment.claim_id)
+                                                    .where(ArchivedComment.comment_id.in_(comment_ids))
+                                                    .distinct()
+                                                    .tuples()))
+    if not claim_ids:
+        return 0
+    archived = [claim_id for claim_id, in (ArchivedComment
+                                           .select(ArchivedComment.claim_id)
+                                           .where(ArchivedComment.claim_id.in_(list(claim_ids)))
+                                           .distinct()
+                                           .tuples())]
+    return move_comments(ArchivedComment, Comment, archived) if archived else 0
+
+
+def archive_cold_claims(before: int, after: str = '', limit: int = 100) -> typing.Tuple[typing.Optional[str], int]:
+    # archives the next `limit` claims after `after` whose newest comment is older than `before`.
+    # returns the claim_id to carry on after, or None once every claim was looked at,
+    # and how many comments were moved
+    candidates = [claim_id for claim_id, in (ClaimSummary
+                                             .select(ClaimSummary.claim_id)
+                                             .where((ClaimSummary.claim_id > after) &
+                                                    (ClaimSummary.latest_timestamp < before))
+                                             .order_by(ClaimSummary.claim_id)
+                                             .limit(limit)
+                                             .tuples())]
+    if not candidates:
+        return None, 0
+    # the summary misses edits, those move a comment's timestamp up
+    cold = [claim_id for claim_id, newest in (Comment
+                                              .select(Comment.claim_id, fn.MAX(Comment.timestamp))
+                                              .where(Comment.claim_id.in_(candidates))
+                                              .group_by(Comment.claim_id)
+                                              .tuples())
+            if newest < before]
+    moved = move_comments(Comment, ArchivedComment, cold) if cold else 0
+    return candidates[-1], moved
 
 
 if __name__ == '__main__':
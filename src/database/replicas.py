@@ -0,0 +1,110 @@
+import contextlib
+import logging
+import time
+import typing
+from collections import OrderedDict
+
+from peewee import Database, InterfaceError, OperationalError
+
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaSet:
+    """
+    Routes reads between the primary and its read replicas. Replicas are taken
+    in turn, skipping the ones whose last health check or query failed, and
+    the primary answers when none are left.
+
+    Anything written through this server (its claims, channels and comments)
+    is pinned to the primary for `pin_seconds`, so whoever just wrote it reads
+    it back even while the replicas are still catching up. The pins are this
+    worker's own, the writer carries a cookie for its reads through the others.
+    """
+
+    def __init__(self, primary: Database, replicas: typing.List[Database], models: list,
+                 pin_seconds: float = 2.0, max_pins: int = 100000):
+        self.primary = primary
+        self.replicas = replicas
+        self.models = models
+        self.healthy = list(replicas)
+        self.turn = 0
+        self.pin_seconds = pin_seconds
+        self.max_pins = max_pins
+        # key -> when its pin expires, kept in expiry order since every pin lasts as long
+        self.pins: typing.Dict[str, float] = OrderedDict()
+
+    def pin(self, keys: typing.Iterable[str]):
+        expires = time.monotonic() + self.pin_seconds
+        for key in keys:
+            if key:
+                self.pins[key] = expires
+                self.pins.move_to_end(key)
+        while len(self.pins) > self.max_pins:
+            self.pins.popitem(last=False)
+
+    def pinned(self, keys: typing.Iterable[str]) -> bool:
+        now = time.monotonic()
+        while self.pins:
+            key, expires = next(iter(self.pins.items()))
+            if expires > now:
+                break
+            del self.pins[key]
+        return any(key in self.pins for key in keys)
+
+    def reader(self, keys: typing.Iterable[str] = ()) -> Database:
+        if not self.healthy or (self.pins and self.pinned(keys)):
+            return self.primary
+        self.turn = (self.turn + 1) % len(self.healthy)
+        return self.healthy[self.turn]
+
+    @contextlib.contextmanager
+    def reading(self, db: Database):
+        # the models go back to the primary on the way out; nothing may await in between
+        if db is self.primary:
+            yield
+        else:
+            with db.bind_ctx(self.models, bind_refs=False, bind_backrefs=False):
+                yield
+
+    def run(self, db: Database, fn: typing.Callable, *args, **kwargs):
+        # runs a read on `db`, falling back to the primary if the replica can't answer
+        try:
+            with self.reading(db):
+                return fn(*args, **kwargs)
+        except (OperationalError, InterfaceError):
+            if db is self.primary:
+                raise
+            logger.exception('Read replica failed, reading from the primary')
+            self.mark_down(db)
+        return fn(*args, **kwargs)
+
+    def mark_down(self, db: Database):
+        if db in self.healthy:
+            self.healthy.remove(db)
+
+    @staticmethod
+    def check(db: Database) -> bool:
+        # made from a worker thread, which gets its own connection to close again
+        try:
+            db.connect(reuse_if_open=True)
+            db.execute_sql('SELECT 1')
+            return True
+        except Exception:
+            return False
+        finally:
+            if not db.is_closed():
+                db.close()
+
+    def update_health(self, results: typing.List[bool]):
+        healthy = [db for db, ok in zip(self.replicas, results) if ok]
+        for db in set(self.healthy) - set(healthy):
+            logger.warning(f'Read replica {db.database} failed its health check')
+        for db in set(healthy) - set(self.healthy):
+            logger.info(f'Read replica {db.database} is back')
+        self.healthy = healthy
+
+    def close(self):
+        for db in self.replicas:
+            if not db.is_closed():
+                db.close()
@@ -0,0 +1,139 @@
+import contextlib
+import contextvars
+import heapq
+import typing
+
+from peewee import Database, chunked
+
+from src.database.models import CommentShard, iter_comments
+
+
+# the shard the current request is working on, tracked per asyncio task
+current_shard: contextvars.ContextVar = contextvars.ContextVar('current_shard', default=None)
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    # jump consistent hash (Lamping & Veach): going from n to n+1 buckets
+    # only moves the keys that land in the new bucket, 1/(n+1) of them
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return b
+
+
+class ShardedDatabase:
+    """
+    What the models are bound to when comments are sharded: every attribute is looked
+    up on the database of the shard in use by the current task, or on the first one.
+    A transaction belongs to the shard it was started on.
+    """
+
+    def __init__(self, home: Database):
+        self.home = home
+
+    @property
+    def obj(self) -> Database:
+        db = current_shard.get()
+        return self.home if db is None else db
+
+    def __getattr__(self, attr):
+        return getattr(self.obj, attr)
+
+    def bind(self, models, bind_refs=True, bind_backrefs=True):
+        for model in models:
+            model.bind(self, bind_refs=bind_refs, bind_backrefs=bind_backrefs)
+
+
+class ShardSet:
+    """
+    Spreads comments over several databases by a hash of their claim_id, so all of a
+    claim's comments, its summary and its share of each channel's totals sit together.
+    The first database also keeps COMMENT_SHARD, which maps every comment_id to its
+    shard for requests that name comments rather than claims.
+    """
+
+    def __init__(self, databases: typing.List[Database]):
+        self.databases = databases
+        self.home = databases[0]
+        self.router = ShardedDatabase(self.home)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def using(db: Database):
+        token = current_shard.set(db)
+        try:
+            yield db
+        finally:
+            current_shard.reset(token)
+
+    def shard_of(self, claim_id: str, shards: int = None) -> int:
+        return jump_hash(int(claim_id[:16], 16), shards or len(self.databases))
+
+    def for_claim(self, claim_id: str) -> Database:
+        return self.databases[self.shard_of(claim_id)]
+
+    def by_claim(self, claim_ids: typing.Iterable[str]) -> typing.Dict[Database, list]:
+        groups = {}
+        for claim_id in claim_ids:
+            groups.setdefault(self.for_claim(claim_id), []).append(claim_id)
+        return groups
+
+    def lookup(self, comment_ids: typing.List[str]) -> typing.Dict[str, int]:
+        found = {}
+        with self.using(self.home):
+            for batch in chunked(comment_ids, 500):
+                found.update(CommentShard
+                             .select(CommentShard.comment_id, CommentShard.shard)
+                             .where(CommentShard.comment_id.in_(batch))
+                             .tuples())
+        return found
+
+    def for_comment(self, comment_id: str) -> Database:
+        return self.by_comment([comment_id]).popitem()[0]
+
+    def by_comment(self, comment_ids: typing.Iterable[str]) -> typing.Dict[Database, list]:
+        # comments missing from the index go to the first shard, which won't find them either
+        comment_ids = list(comment_ids)
+        found = self.lookup(comment_ids)
+        groups = {}
+        for comment_id in comment_ids:
+            shard = found.get(comment_id, 0)
+            db = self.databases[shard] if shard < len(self.databases) else self.home
+            groups.setdefault(db, []).append(comment_id)
+        return groups
+
+    def record(self, comment_ids: typing.Iterable[str], db: Database):
+        shard = self.databases.index(db)
+        rows = [{'comment_id': comment_id, 'shard': shard} for comment_id in comment_ids]
+        with self.using(self.home):
+            for batch in chunked(rows, 500):
+                CommentShard.insert_many(batch).on_conflict_replace().execute()
+
+    def forget(self, comment_ids: typing.Iterable[str]):
+        with self.using(self.home):
+            for batch in chunked(list(comment_ids), 500):
+                CommentShard.delete().where(CommentShard.comment_id.in_(batch)).execute()
+
+    def iter_comments(self, claim_id: str = None, **filters) -> typing.Iterator[dict]:
+        # iter_comments over every shard, merged back into one comment_id order.
+        # a generator can't keep its shard across yields, so each row is fetched
+        # on the shard it walks. a claim's comments all sit on one of them
+        def walk(db) -> typing.Iterator[dict]:
+            with self.using(db):
+                comments = iter_comments(claim_id=claim_id, **filters)
+            while True:
+                with self.using(db):
+                    comment = next(comments, None)
+                if comment is None:
+                    return
+                yield comment
+
+        databases = [self.for_claim(claim_id)] if claim_id else self.databases
+        return heapq.merge(*map(walk, databases), key=lambda c: c['comment_id'])
+
+    def close(self):
+        for db in self.databases:
+            if not db.is_closed():
+                db.close()
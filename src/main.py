@@ -88,8 +88,9 @@ def setup_db_from_config(config: dict):
         if not os.path.exists(DATABASE_DIR):
             os.mkdir(DATABASE_DIR)
 
-        config[mode]['db_file'] = os.path.join(
-            DATABASE_DIR, config[mode]['name']
+        # relative sqlite files live in the database directory
+        config[mode]['file'] = os.path.join(
+            DATABASE_DIR, config[mode]['file']
         )
 
 
@@ -14,6 +14,14 @@ async def get_claim_from_id(app, claim_id, **kwargs):
         return
 
 
+async def get_claims_from_ids(app, claim_ids: list, **kwargs) -> dict:
+    # resolves many claims in a single claim_search, mapped by claim_id
+    result = await request_lbrynet(
+        app, 'claim_search', claim_ids=claim_ids, page_size=len(claim_ids), no_totals=True, **kwargs
+    )
+    return {claim['claim_id']: claim for claim in result['items']}
+
+
 def clean_input_params(kwargs: dict):
     for k, v in kwargs.items():
         if type(v) is str and k != 'comment':
@@ -23,4 +31,11 @@ def clean_input_params(kwargs: dict):
 
 
 def clean(thing: dict) -> dict:
-    return {k: v for k, v in thing.items() if v is not None}
\ No newline at end of file
+    return {k: v for k, v in thing.items() if v is not None}
+
+
+def is_true(value) -> bool:
+    # flags read from CSV arrive as strings, where bool('False') would be True
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return bool(value)
\ No newline at end of file
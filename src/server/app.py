@@ -1,55 +1,306 @@
 # cython: language_level=3
 import asyncio
+import contextlib
 import logging
+import pathlib
 import signal
 import time
+import typing
 
 import aiojobs
 import aiojobs.aiohttp
 from aiohttp import web
 
 from peewee import *
-from src.server.handles import api_endpoint, get_api_endpoint
-from src.database.models import Comment, Channel
+from playhouse.migrate import SchemaMigrator, migrate
+from src.server.handles import api_endpoint, get_api_endpoint, METHODS
+from src.server.writer import GroupCommitWriter
+from src.server.versions import ClaimVersions
+from src.server.stream import CommentStream, stream_endpoint
+from src.server.responses import ResponseCache
+from src.server.ratelimit import RateLimiter
+from src.server.spam import SpamFilter
+from src.server.overload import LoadShedder
+from src.database.deadlines import DeadlineMySQLDatabase, DeadlineSqliteDatabase
+from src.database.replicas import ReplicaSet
+from src.database.shards import ShardSet
+from src.database.models import Comment, Channel, ChannelStats, ClaimSummary, CommentShard, ArchivedComment
+from src.database.models import CommentBody, StreamEvent, body_store_in_use, enable_tables
+from src.database.models import setup_search_index, archive_in_use, archive_cold_claims
+from src.database.models import rebuild_channel_stats, rebuild_claim_summaries
 
-MODELS = [Comment, Channel]
+MODELS = [Comment, Channel, ChannelStats, ClaimSummary]
+
+# tables derived from COMMENT, mapped to what fills them in
+# when they're added to a database that already has comments
+DERIVED_TABLES = {
+    ChannelStats: rebuild_channel_stats,
+    ClaimSummary: rebuild_claim_summaries,
+}
+# what the read-only sqlite connections take from the writer's pragmas
+READER_PRAGMAS = ('cache_size', 'mmap_size', 'temp_store')
 logger = logging.getLogger(__name__)
 
 
+def connect_database(settings: dict) -> Database:
+    # switch between Database objects
+    if settings['database'] == 'mysql':
+        return DeadlineMySQLDatabase(
+            database=settings['name'],
+            user=settings['user'],
+            host=settings['host'],
+            password=settings['password'],
+            port=settings['port'],
+            charset=settings['charset'],
+        )
+    elif settings['database'] == 'sqlite':
+        return DeadlineSqliteDatabase(
+            settings['file'],
+            pragmas=settings['pragmas'],
+            timeout=settings.get('timeout', 5),
+            lock_type=settings.get('lock_type')
+        )
+
+
+def connect_readers(settings: dict) -> typing.List[Database]:
+    # read-only connections to the writer's sqlite file. they see every commit right
+    # away, and in WAL mode neither wait on the writer nor hold it up
+    uri = pathlib.Path(settings['file']).absolute().as_uri() + '?mode=ro'
+    pragmas = {k: v for k, v in settings['pragmas'].items() if k in READER_PRAGMAS}
+    return [
+        DeadlineSqliteDatabase(uri, uri=True, pragmas={**pragmas, 'query_only': 1}, timeout=settings.get('timeout', 5))
+        for _ in range(settings.get('readers', 0))
+    ]
+
+
 def setup_database(app):
     config = app['config']
     mode = config['mode']
+    app['db'] = connect_database(config[mode])
 
-    # switch between Database objects
-    if config[mode]['database'] == 'mysql':
-        app['db'] = MySQLDatabase(
-            database=config[mode]['name'],
-            user=config[mode]['user'],
-            host=config[mode]['host'],
-            password=config[mode]['password'],
-            port=config[mode]['port'],
-            charset=config[mode]['charset'],
-        )
-    elif config[mode]['database'] == 'sqlite':
-        app['db'] = SqliteDatabase(
-            config[mode]['file'],
-            pragmas=config[mode]['pragmas']
+    # shards & read replicas take whatever they don't set from the primary's settings
+    settings = {k: v for k, v in config[mode].items() if k not in ('replicas', 'shards')}
+    replicas = [connect_database({**settings, **replica}) for replica in config[mode].get('replicas') or []]
+    readers = connect_readers(settings) if settings['database'] == 'sqlite' else []
+    if config[mode].get('shards'):
+        # the primary is the first shard, the models go through the sharding layer
+        app['shards'] = ShardSet(
+            [app['db']] + [connect_database({**settings, **shard}) for shard in config[mode]['shards']]
         )
+        app['db'] = app['shards'].router
+        if replicas or readers:
+            logger.warning('Read replicas are not used when comments are sharded')
+            replicas, readers = [], []
 
-    # bind the Model list to the database
-    app['db'].bind(MODELS, bind_refs=False, bind_backrefs=False)
+    # bind the Model list to the database, the archive & body store only when they're enabled,
+    # which every database is told so the models know wherever they're bound
+    archive = bool(config.get('archive', {}).get('enabled'))
+    body_store = bool(config.get('body_store', {}).get('enabled'))
+    shards = app['shards'].databases if 'shards' in app else []
+    for db in [app['db']] + shards + replicas + readers:
+        enable_tables(db, archive, body_store)
+    optional = ([ArchivedComment] if archive else []) + ([CommentBody] if body_store else [])
+    app['db'].bind(MODELS + optional + [CommentShard], bind_refs=False, bind_backrefs=False)
+    # the stream's relay goes through the first database, whichever shard a request is on
+    StreamEvent.bind(app['shards'].home if 'shards' in app else app['db'])
+
+    # readers of the same file are never behind, so there's nothing to pin
+    app['replicas'] = ReplicaSet(
+        app['db'],
+        replicas + readers,
+        MODELS + optional,
+        pin_seconds=config.get('read_your_writes_seconds', 2) if replicas else 0
+    )
+
+
+def add_columns(db, models: list):
+    # peewee only creates whole tables, columns added to a model since are added here.
+    # it has to come first, sqlite takes the indexes on missing columns for ones on a string
+    migrator = SchemaMigrator.from_database(db)
+    for model in models:
+        table = model._meta.table_name
+        if not db.table_exists(table):
+            continue
+        existing = {column.name for column in db.get_columns(table)}
+        for field in model._meta.sorted_fields:
+            if field.column_name not in existing:
+                logger.info(f'Adding {table}.{field.column_name}')
+                # along with the field's index
+                migrate(migrator.add_column(table, field.column_name, field))
+
+
+def add_indexes(db, models: list):
+    # nor are the indexes added to a model since, create_tables(safe=True) skips them with
+    # the table on mysql. an index counts as there when one on the same columns is, as the
+    # ones from comments_ddl.sql & the foreign keys have names of their own
+    for model in models:
+        table = model._meta.table_name
+        existing = {tuple(c.lower() for c in index.columns) for index in db.get_indexes(table)}
+        for index in model._meta.fields_to_index():
+            columns = tuple(field.column_name.lower() for field in index._expressions)
+            if columns not in existing:
+                logger.info(f'Adding index {index._name} on {table}')
+                db.execute(model._schema._create_index(index, safe=False))
+                existing.add(columns)
+
+
+def create_tables(db):
+    new_tables = [model for model in MODELS if not model.table_exists()]
+    optional = ([ArchivedComment] if archive_in_use() else []) + ([CommentBody] if body_store_in_use() else [])
+    add_columns(db, [Comment] + optional)
+    db.create_tables(MODELS + optional)
+    add_indexes(db, MODELS + optional)
+    setup_search_index(db)
+    if Comment not in new_tables:
+        with db.atomic():
+            for model in new_tables:
+                if model in DERIVED_TABLES:
+                    logger.info(f'Backfilling {model._meta.table_name}')
+                    DERIVED_TABLES[model]()
 
 
 async def start_background_tasks(app):
     app['db'].connect()
-    app['db'].create_tables(MODELS)
+    if 'shards' in app:
+        for db in app['shards'].databases:
+            with ShardSet.using(db):
+                create_tables(db)
+        CommentShard.create_table()
+    else:
+        create_tables(app['db'])
+    app['claim_versions'] = ClaimVersions(ttl=app['config'].get('claim_version_ttl', 1.0))
+    rate_limits = app['config'].get('rate_limits') or {}
+    if rate_limits.get('enabled'):
+        app['rate_limiter'] = RateLimiter(rate_limits.get('methods'), rate_limits.get('trusted_proxies'))
+    if app['config'].get('spam_filter', {}).get('enabled'):
+        app['spam_filter'] = SpamFilter(app['config']['spam_filter'])
+    app['response_cache'] = ResponseCache(max_bytes=app['config'].get('response_cache_mb', 64) * 2**20)
+    overload = app['config'].get('overload', {})
+    app['load_shedder'] = LoadShedder(
+        app['methods'].writes,
+        max_in_flight=overload.get('max_in_flight', 500),
+        write_share=overload.get('write_share', 0.5)
+    )
+
+    # live comment events for websocket subscribers
+    stream = app['config'].get('stream', {})
+    relay = stream.get('relay') or {}
+    app['comment_stream'] = CommentStream(
+        buffer_size=stream.get('buffer_size', 100),
+        max_claims=stream.get('max_claims', 1000),
+        relay=bool(relay.get('enabled')),
+        settle_seconds=relay.get('settle_seconds', 2),
+        keep_seconds=relay.get('keep_seconds', 60)
+    )
+    if app['comment_stream'].relay:
+        StreamEvent.create_table()
+        app['stream_relay'] = asyncio.ensure_future(relay_stream_events(app))
+
+    if app['replicas'].replicas:
+        app['replica_checks'] = asyncio.ensure_future(check_replicas(app))
+    if archive_in_use():
+        app['archiver'] = asyncio.ensure_future(archive_comments(app))
 
     # for requesting to external and internal APIs
     app['webhooks'] = await aiojobs.create_scheduler(pending_limit=0)
 
+    # opt-in coalescing of comment creations into shared transactions
+    group_commit = app['config'].get('group_commit', {})
+    if group_commit.get('enabled'):
+        app['comment_writer'] = GroupCommitWriter(
+            app['db'],
+            window=group_commit.get('window_ms', 5) / 1000,
+            max_batch=group_commit.get('max_batch', 200)
+        )
+
+
+async def check_replicas(app):
+    interval = app['config'].get('replica_health_interval', 5)
+    loop = asyncio.get_event_loop()
+    replicas = app['replicas']
+    while True:
+        results = await asyncio.gather(*(
+            loop.run_in_executor(None, replicas.check, db) for db in replicas.replicas
+        ))
+        replicas.update_health(results)
+        await asyncio.sleep(interval)
+
+
+async def relay_stream_events(app):
+    # hands the events published by the other workers to this one's subscribers
+    stream: CommentStream = app['comment_stream']
+    settings = app['config']['stream']['relay']
+    interval = settings.get('poll_seconds', 0.5)
+    last_pruned = 0
+    while True:
+        try:
+            stream.poll()
+            if time.monotonic() - last_pruned > stream.keep_seconds:
+                stream.prune()
+                last_pruned = time.monotonic()
+        except Exception:
+            logger.exception('Polling for stream events failed')
+        await asyncio.sleep(interval)
+
+
+async def archive_comments(app):
+    # moves the comments of claims nobody commented on in `age_days` to COMMENT_ARCHIVE,
+    # a few claims at a time with a pause in between so requests keep the database
+    settings = app['config']['archive']
+    shards = app['shards'].databases if 'shards' in app else [None]
+    while True:
+        before = int(time.time() - settings.get('age_days', 365) * 86400)
+        moved = 0
+        try:
+            for shard in shards:
+                after = ''
+                while after is not None:
+                    with ShardSet.using(shard):
+                        after, count = archive_cold_claims(before, after, settings.get('batch_size', 100))
+                    moved += count
+                    await asyncio.sleep(settings.get('pause_seconds', 1))
+        except Exception:
+            logger.exception('Archiving comments failed')
+        logger.info(f'Archived {moved} comments older than {before}')
+        await asyncio.sleep(settings.get('interval_minutes', 60) * 60)
+
 
 async def close_database_connections(app):
-    app['db'].close()
+    app['replicas'].close()
+    if 'shards' in app:
+        app['shards'].close()
+    else:
+        app['db'].close()
+
+
+async def close_replica_checks(app):
+    if 'replica_checks' in app:
+        app['replica_checks'].cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await app['replica_checks']
+
+
+async def close_archiver(app):
+    if 'archiver' in app:
+        app['archiver'].cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await app['archiver']
+
+
+async def close_stream_relay(app):
+    if 'stream_relay' in app:
+        app['stream_relay'].cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await app['stream_relay']
+
+
+async def close_comment_writer(app):
+    if 'comment_writer' in app:
+        await app['comment_writer'].close()
+
+
+async def close_streams(app):
+    await app['comment_stream'].close()
 
 
 async def close_schedulers(app):
@@ -68,9 +319,15 @@ class CommentDaemon:
         self.port = config['port']
 
         setup_database(app)
+        app['methods'] = METHODS.bind(config)
 
         # configure the order of tasks to run during app lifetime
         app.on_startup.append(start_background_tasks)
+        app.on_shutdown.append(close_comment_writer)
+        app.on_shutdown.append(close_replica_checks)
+        app.on_shutdown.append(close_archiver)
+        app.on_shutdown.append(close_stream_relay)
+        app.on_shutdown.append(close_streams)
         app.on_shutdown.append(close_schedulers)
         app.on_cleanup.append(close_database_connections)
         aiojobs.aiohttp.setup(app, **kwargs)
@@ -79,7 +336,8 @@ class CommentDaemon:
         app.add_routes([
             web.post('/api', api_endpoint),
             web.get('/', get_api_endpoint),
-            web.get('/api', get_api_endpoint)
+            web.get('/api', get_api_endpoint),
+            web.get('/stream', stream_endpoint)
         ])
         self.app = app
         self.app_runner = None
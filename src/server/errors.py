@@ -12,6 +12,10 @@ ERRORS = {
     'INTERNAL': {'code': -32603, 'message': 'Internal Server Error. Please notify a LBRY Administrator.'},
     'METHOD_NOT_FOUND': {'code': -32601, 'message': 'The method does not exist / is not available.'},
     'INVALID_REQUEST': {'code': -32600, 'message': 'The JSON sent is not a valid Request object.'},
+    'RATE_LIMITED': {'code': -32001, 'message': 'Too many requests, please slow down.'},
+    'BUSY': {'code': -32002, 'message': 'The server is overloaded, please retry later.'},
+    'DEADLINE_EXCEEDED': {'code': -32003, 'message': 'The request took too long and was abandoned.'},
+    'SPAM': {'code': -32004, 'message': 'The comment is too much like many others posted just now.'},
     'PARSE_ERROR': {
         'code': -32700,
         'message': 'Invalid JSON was received by the server.\n'
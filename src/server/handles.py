@@ -1,5 +1,6 @@
 import asyncio
 import logging
+import math
 import time
 import typing
 
@@ -7,21 +8,71 @@ from aiohttp import web
 from aiojobs.aiohttp import atomic
 from peewee import DoesNotExist
 
-from src.server.external import send_notification
-from src.server.validation import validate_signature_from_claim
-from src.misc import clean_input_params, get_claim_from_id
+from src.server.external import send_notifications
+from src.server.validation import validate_signature_from_claim, is_valid_credential_input, failure_log
+from src.server.registry import Method, MethodRegistry
+from src.server.ratelimit import RateLimited
+from src.server.spam import SpamRejected
+from src.server import sharding
+from src.misc import clean_input_params, get_claim_from_id, get_claims_from_ids
 from src.server.errors import make_error, report_error
+from src.server.versions import conditional_claim_ids, make_etag
+from src.server.responses import json_response, CachedResult
+from src.database.deadlines import deadline, DeadlineExceeded
 from src.database.models import Comment, Channel
 from src.database.models import get_comment
 from src.database.models import comment_list
 from src.database.models import create_comment
-from src.database.models import edit_comment
-from src.database.models import delete_comment
+from src.database.models import edit_comment, edit_comments
+from src.database.models import delete_comment, delete_comments
+from src.database.models import thread_ids, existing_comments
 from src.database.models import set_hidden_flag
+from src.database.models import search_comments
+from src.database.models import get_channel_comments
+from src.database.models import get_claim_summaries
 
 
 logger = logging.getLogger(__name__)
 
+# claim_search won't return more than this many claims per page
+LBRYNET_BATCH_SIZE = 50
+# until when a client's reads go to the primary, after it wrote something
+PIN_COOKIE = 'primary_until'
+
+
+async def notify(app: web.Application, action: str, comments: typing.List[dict]):
+    # tells the notification API and the live stream's subscribers about changed comments
+    app['replicas'].pin([c.get(key) for c in comments for key in ('channel_id', 'comment_id')])
+    if 'comment_stream' in app:
+        app['comment_stream'].publish(action, comments)
+    await app['webhooks'].spawn(send_notifications(app, action, comments))
+
+
+def pinned_client(request: web.Request) -> bool:
+    # whether the client wrote something a moment ago, through whichever worker
+    try:
+        return float(request.cookies.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def pin_client(request: web.Request, response: web.Response) -> web.Response:
+    # the pins made by a write only live in the worker that made it, the cookie has
+    # the writer's next reads go to the primary whichever worker they land on
+    seconds = request.app['replicas'].pin_seconds
+    if seconds and request.app['replicas'].replicas:
+        response.set_cookie(PIN_COOKIE, f'{time.time() + seconds:.3f}', max_age=math.ceil(seconds), httponly=True)
+    return response
+
+
+def invalidate_claims(app: web.Application, claim_ids: typing.Iterable[str]):
+    # drops cached versions of claims this server just wrote to,
+    # and has their reads go to the primary until the replicas catch up
+    claim_ids = list(claim_ids)
+    if 'claim_versions' in app:
+        app['claim_versions'].invalidate(claim_ids)
+    app['replicas'].pin(claim_ids)
+
 
 # noinspection PyUnusedLocal
 def ping(*args):
@@ -65,8 +116,7 @@ def handle_get_comments_by_id(
         app: web.Application,
         comment_ids: typing.Union[list, tuple]
 ) -> dict:
-    expression = Comment.comment_id.in_(comment_ids)
-    return comment_list(expressions=expression, page_size=len(comment_ids))
+    return comment_list(comment_ids=comment_ids, page_size=len(comment_ids))
 
 
 def handle_get_claim_comments(
@@ -102,6 +152,44 @@ def handle_get_claim_hidden_comments(
     )
 
 
+def handle_get_channel_comments(
+        app: web.Application,
+        channel_id: str,
+        claim_id: str = None,
+        hidden: bool = None,
+        page_size: int = 50,
+        cursor: str = None,
+) -> dict:
+    return get_channel_comments(
+        channel_id=channel_id,
+        claim_id=claim_id,
+        hidden=hidden,
+        page_size=page_size,
+        cursor=cursor
+    )
+
+
+def handle_get_claim_summaries(app: web.Application, claim_ids: list) -> dict:
+    return get_claim_summaries(claim_ids)
+
+
+def handle_search_comments(
+        app: web.Application,
+        query: str,
+        claim_id: str = None,
+        channel_id: str = None,
+        page: int = 1,
+        page_size: int = 50,
+) -> dict:
+    return search_comments(
+        query=query,
+        claim_id=claim_id,
+        channel_id=channel_id,
+        page=page,
+        page_size=page_size
+    )
+
+
 async def handle_abandon_comment(
         app: web.Application,
         comment_id: str,
@@ -117,21 +205,25 @@ async def handle_abandon_comment(
     else:
         if not validate_signature_from_claim(channel, signature, signing_ts, comment_id):
             raise ValueError('Abandon signature could not be validated')
-    await app['webhooks'].spawn(send_notification(app, 'DELETE', comment))
     with app['db'].atomic():
-        return {
-            'abandoned': delete_comment(comment_id)
-        }
+        abandoned = delete_comment(comment_id)
+    invalidate_claims(app, [comment['claim_id']])
+    await notify(app, 'DELETE', [comment])
+    return {
+        'abandoned': abandoned
+    }
 
 
 async def handle_hide_comments(app: web.Application, pieces: list, hide: bool = True) -> dict:
     # let's get all the distinct claim_ids from the list of comment_ids
     pieces_by_id = {p['comment_id']: p for p in pieces}
     comment_ids = list(pieces_by_id.keys())
-    comments = (Comment
-                .select(Comment.comment_id, Comment.claim_id)
-                .where(Comment.comment_id.in_(comment_ids))
-                .tuples())
+    comments = [(c['comment_id'], c['claim_id']) for c in comment_list(
+        comment_ids=comment_ids,
+        page_size=len(comment_ids),
+        select_fields=['comment_id', 'claim_id'],
+        with_total=False
+    )['items']]
 
     # resolve the claims and map them to their corresponding comment_ids
     claims = {}
@@ -166,11 +258,17 @@ async def handle_hide_comments(app: web.Application, pieces: list, hide: bool =
     # remaining items in pieces_by_id have been able to successfully validate
     with app['db'].atomic():
         set_hidden_flag(list(pieces_by_id.keys()), hidden=hide)
-
-    query = Comment.select().where(Comment.comment_id.in_(comment_ids)).objects()
+    invalidate_claims(app, list(claims))
+
+    query = comment_list(
+        comment_ids=comment_ids,
+        page_size=len(comment_ids),
+        select_fields=['comment_id', 'is_hidden'],
+        with_total=False
+    )['items']
     result = {
-        'hidden': [c.comment_id for c in query if c.is_hidden],
-        'visible': [c.comment_id for c in query if not c.is_hidden],
+        'hidden': [c['comment_id'] for c in query if c['is_hidden']],
+        'visible': [c['comment_id'] for c in query if not c['is_hidden']],
     }
     return result
 
@@ -183,60 +281,235 @@ async def handle_edit_comment(app, comment: str = None, comment_id: str = None,
         raise ValueError('Signature could not be validated')
 
     with app['db'].atomic():
-        if not edit_comment(comment_id, comment, signature, signing_ts):
+        updated_comment = edit_comment(comment_id, comment, signature, signing_ts)
+        if not updated_comment:
             raise ValueError('Comment could not be edited')
-        updated_comment = get_comment(comment_id)
-        await app['webhooks'].spawn(send_notification(app, 'UPDATE', updated_comment))
-        return updated_comment
+    invalidate_claims(app, [updated_comment['claim_id']])
+    await notify(app, 'UPDATE', [updated_comment])
+    return updated_comment
+
+
+async def validate_pieces(app, pieces: list, signed_field: str) -> typing.Tuple[list, list]:
+    # checks a list of signed pieces against the channels of the comments they refer to,
+    # resolving every distinct channel only once; returns (valid comments, failed comment_ids)
+    pieces_by_id = {p['comment_id']: p for p in pieces}
+    if not pieces_by_id:
+        return [], []
+    comments = comment_list(
+        comment_ids=list(pieces_by_id),
+        page_size=len(pieces_by_id),
+        with_total=False
+    )['items']
+
+    channel_ids = list({c['channel_id'] for c in comments if c.get('channel_id')})
+    channels = {}
+    for i in range(0, len(channel_ids), LBRYNET_BATCH_SIZE):
+        channels.update(await get_claims_from_ids(app, channel_ids[i:i + LBRYNET_BATCH_SIZE]))
+
+    valid = []
+    for comment in comments:
+        piece = pieces_by_id[comment['comment_id']]
+        channel = channels.get(comment.get('channel_id'))
+        if channel and validate_signature_from_claim(
+                claim=channel,
+                signature=piece.get('signature'),
+                signing_ts=piece.get('signing_ts'),
+                data=piece.get(signed_field)
+        ):
+            valid.append(comment)
+    valid_ids = {c['comment_id'] for c in valid}
+    return valid, [comment_id for comment_id in pieces_by_id if comment_id not in valid_ids]
+
+
+async def handle_edit_comments(app: web.Application, pieces: list) -> dict:
+    # pieces are {comment_id, comment, signature, signing_ts}, signed over the new comment
+    valid, failed = await validate_pieces(app, pieces, 'comment')
+    valid_ids = {c['comment_id'] for c in valid}
+    with app['db'].atomic():
+        edited = edit_comments([p for p in pieces if p['comment_id'] in valid_ids])
+    invalidate_claims(app, {c['claim_id'] for c in edited})
+    if edited:
+        await notify(app, 'UPDATE', edited)
+    return {
+        'edited': edited,
+        'failed': failed
+    }
+
+
+async def handle_abandon_comments(app: web.Application, pieces: list) -> dict:
+    # pieces are {comment_id, signature, signing_ts}, signed over the comment_id
+    valid, failed = await validate_pieces(app, pieces, 'comment_id')
+    with app['db'].atomic():
+        abandoned = delete_comments([c['comment_id'] for c in valid])
+    invalidate_claims(app, {c['claim_id'] for c in valid})
+    if valid:
+        await notify(app, 'DELETE', valid)
+    return {
+        'abandoned': abandoned,
+        'failed': failed
+    }
 
 
 # TODO: retrieve stake amounts for each channel & store in db
 async def handle_create_comment(app, comment: str = None, claim_id: str = None,
                           parent_id: str = None, channel_id: str = None, channel_name: str = None,
                           signature: str = None, signing_ts: str = None) -> dict:
-    with app['db'].atomic():
-        comment = create_comment(
-            comment=comment,
-            claim_id=claim_id,
-            parent_id=parent_id,
-            channel_id=channel_id,
-            channel_name=channel_name,
-            signature=signature,
-            signing_ts=signing_ts
-        )
-        await app['webhooks'].spawn(send_notification(app, 'CREATE', comment))
-        return comment
-
-
-METHODS = {
-    'ping': ping,
-    'get_claim_comments': handle_get_claim_comments,    # this gets used
-    'get_claim_hidden_comments': handle_get_claim_hidden_comments,  # this gets used
-    'get_comment_ids': handle_get_comment_ids,
-    'get_comments_by_id': handle_get_comments_by_id,    # this gets used
-    'get_channel_from_comment_id': handle_get_channel_from_comment_id,  # this gets used
-    'create_comment': handle_create_comment,   # this gets used
-    'delete_comment': handle_abandon_comment,
-    'abandon_comment': handle_abandon_comment,  # this gets used
-    'hide_comments': handle_hide_comments,  # this gets used
-    'edit_comment': handle_edit_comment     # this gets used
-}
-
-
-async def process_json(app, body: dict) -> dict:
+    params = dict(
+        comment=comment,
+        claim_id=claim_id,
+        parent_id=parent_id,
+        channel_id=channel_id,
+        channel_name=channel_name,
+        signature=signature,
+        signing_ts=signing_ts
+    )
+    # only once the credentials check out, so nobody runs down another channel's tokens
+    limiter = app.get('rate_limiter')
+    if limiter is not None and channel_id is not None \
+            and is_valid_credential_input(channel_id, channel_name, signature, signing_ts) \
+            and not limiter.allow_channel('create_comment', channel_id):
+        raise RateLimited(f'Too many comments from channel {channel_id}')
+    # before anything touches the database, so a wave of spam costs no more than this
+    spam_filter = app.get('spam_filter')
+    if spam_filter is not None and spam_filter.rejects(comment):
+        raise SpamRejected('Comment rejected as spam')
+    if 'comment_writer' in app:
+        comment = await app['comment_writer'].create_comment(**params)
+    else:
+        with app['db'].atomic():
+            comment = create_comment(**params)
+    invalidate_claims(app, [comment['claim_id']])
+    await notify(app, 'CREATE', [comment])
+    return comment
+
+
+PAGING = {'page', 'page_size'}
+SIGNED = {'signature', 'signing_ts'}
+
+METHODS = MethodRegistry([
+    Method('ping', ping),
+    Method('get_claim_comments', handle_get_claim_comments,  # this gets used
+           required={'claim_id'}, optional={'parent_id', 'top_level', *PAGING}, replica=True, cacheable=True,
+           shard_by=sharding.by_claim),
+    Method('get_claim_hidden_comments', handle_get_claim_hidden_comments,  # this gets used
+           required={'claim_id', 'hidden'}, optional=PAGING, replica=True, cacheable=True,
+           shard_by=sharding.by_claim),
+    Method('get_comment_ids', handle_get_comment_ids,
+           required={'claim_id'}, optional={'parent_id', 'flattened', *PAGING}, replica=True, cacheable=True,
+           shard_by=sharding.by_claim),
+    Method('get_comments_by_id', handle_get_comments_by_id,   # this gets used
+           required={'comment_ids'}, replica=True,
+           shard_by=sharding.by_comment_ids, merge=sharding.merge_comment_lists),
+    Method('get_channel_from_comment_id', handle_get_channel_from_comment_id,   # this gets used
+           required={'comment_id'}, replica=True, shard_by=sharding.by_comment),
+    Method('get_channel_comments', handle_get_channel_comments,
+           required={'channel_id'}, optional={'claim_id', 'hidden', 'page_size', 'cursor'}, replica=True,
+           shard_by=sharding.every_shard, merge=sharding.merge_channel_pages),
+    Method('search_comments', handle_search_comments,
+           required={'query'}, optional={'claim_id', 'channel_id', *PAGING}, replica=True,
+           shard_by=sharding.by_search, merge=sharding.merge_search_pages),
+    Method('get_claim_summaries', handle_get_claim_summaries,
+           required={'claim_ids'}, replica=True, cacheable=True,
+           shard_by=sharding.by_claim_ids, merge=sharding.merge_summaries),
+    Method('create_comment', handle_create_comment, writes=True,  # this gets used
+           optional={'comment', 'claim_id', 'parent_id', 'channel_id', 'channel_name', *SIGNED},
+           shard_by=sharding.by_claim, records=True),
+    Method('delete_comment', handle_abandon_comment, writes=True,
+           required={'comment_id', *SIGNED}, extra=True, shard_by=sharding.by_comment,
+           forgets=sharding.named_comment),
+    Method('abandon_comment', handle_abandon_comment, writes=True,  # this gets used
+           required={'comment_id', *SIGNED}, extra=True, shard_by=sharding.by_comment,
+           forgets=sharding.named_comment),
+    Method('abandon_comments', handle_abandon_comments, writes=True,
+           required={'pieces'}, shard_by=sharding.by_pieces, merge=sharding.merge_lists,
+           forgets=sharding.named_pieces),
+    Method('hide_comments', handle_hide_comments, writes=True,  # this gets used
+           required={'pieces'}, optional={'hide'}, shard_by=sharding.by_pieces, merge=sharding.merge_lists),
+    Method('edit_comment', handle_edit_comment, writes=True,  # this gets used
+           optional={'comment', 'comment_id', *SIGNED}, extra=True, shard_by=sharding.by_comment),
+    Method('edit_comments', handle_edit_comments, writes=True,
+           required={'pieces'}, shard_by=sharding.by_pieces, merge=sharding.merge_lists),
+])
+
+
+def read_keys(params: dict) -> typing.List[str]:
+    # what a read is about, checked against the pins left by recent writes
+    keys = [params.get(key) for key in ('claim_id', 'channel_id', 'comment_id', 'parent_id')]
+    for key in ('claim_ids', 'comment_ids'):
+        keys.extend(params.get(key) or ())
+    return keys
+
+
+async def call_method(app: web.Application, method: Method, params: dict, db=None):
+    if method.is_async:
+        # a write can't be cut off from outside, it may have committed already. its statements
+        # still keep to the deadline, and one refused before the commit rolls everything back
+        if method.writes:
+            return await method.handler(app, **params)
+        return await asyncio.wait_for(method.handler(app, **params), method.deadline)
+    if method.replica:
+        replicas = app['replicas']
+        return replicas.run(db or replicas.reader(read_keys(params)), method.handler, app, **params)
+    return method.handler(app, **params)
+
+
+async def call_sharded(app: web.Application, method: Method, params: dict):
+    # calls the handler once for every shard the params belong to
+    shards = app['shards']
+    results = []
+    for db, part in method.shard_by(shards, params):
+        with shards.using(db):
+            thread = thread_ids(method.forgets(part)) if method.forgets else []
+            result = await call_method(app, method, part)
+            deleted = set(thread) - set(existing_comments(thread))
+        if method.records:
+            shards.record([result['comment_id']], db)
+        if deleted:
+            shards.forget(deleted)
+        results.append(result)
+    return method.merge(results, params) if method.merge else results[0]
+
+
+def load_versions(app: web.Application, db, claim_ids: typing.List[str]) -> tuple:
+    versions = app['claim_versions']
+    if 'shards' not in app:
+        return app['replicas'].run(db, versions.load, claim_ids)
+    shards, found = app['shards'], {}
+    for shard, ids in shards.by_claim(claim_ids).items():
+        with shards.using(shard):
+            found.update(zip(ids, versions.load(ids)))
+    return tuple(found[claim_id] for claim_id in claim_ids)
+
+
+async def process_json(app, body: dict, db=None) -> dict:
     response = {'jsonrpc': '2.0', 'id': body['id']}
-    if body['method'] in METHODS:
-        method = body['method']
+    method = app['methods'].get(body['method'])
+    if method is not None:
         params = body.get('params', {})
         clean_input_params(params)
-        logger.debug(f'Received Method {method}, params: {params}')
+        logger.debug(f'Received Method {method.name}, params: {params}')
+        invalid = method.validate(params)
+        if invalid:
+            failure_log.warning(f'Rejected {method.name}: {invalid}')
+            response['error'] = make_error('INVALID_PARAMS', ValueError(invalid))
+            return response
         start = time.time()
         try:
-            if asyncio.iscoroutinefunction(METHODS[method]):
-                result = await METHODS[method](app, **params)
-            else:
-                result = METHODS[method](app, **params)
-
+            with deadline(method.deadline):
+                if 'shards' in app and method.shard_by:
+                    result = await call_sharded(app, method, params)
+                else:
+                    result = await call_method(app, method, params, db)
+
+        except (asyncio.TimeoutError, DeadlineExceeded) as err:
+            logger.warning(f'{method.name} ran past its {method.deadline}s deadline')
+            response['error'] = make_error('DEADLINE_EXCEEDED', err)
+        except RateLimited as err:
+            failure_log.warning(f'Rejected {method.name}: {err}')
+            response['error'] = make_error('RATE_LIMITED', err)
+        except SpamRejected as err:
+            failure_log.warning(f'Rejected {method.name}: {err}')
+            response['error'] = make_error('SPAM', err)
         except Exception as err:
             logger.exception(f'Got {type(err).__name__}:\n{err}')
             if type(err) in (ValueError, TypeError):  # param error, not too important
@@ -249,13 +522,99 @@ async def process_json(app, body: dict) -> dict:
 
         finally:
             end = time.time()
-            logger.debug(f'Time taken to process {method}: {end - start} secs')
+            method.record(end - start, 'error' in response)
+            logger.debug(f'Time taken to process {method.name}: {end - start} secs')
     else:
         response['error'] = make_error('METHOD_NOT_FOUND')
     return response
 
 
+def rate_limited(request: web.Request, body: dict) -> typing.Optional[dict]:
+    # admission check, made before the params are cleaned, validated or looked up
+    limiter = request.app.get('rate_limiter')
+    if limiter is None:
+        return None
+    if not limiter.allow(body.get('method'), request.remote, request.headers.get('X-Forwarded-For')):
+        return {'jsonrpc': '2.0', 'id': body.get('id'), 'error': make_error('RATE_LIMITED')}
+
+
+async def process_conditional(request: web.Request, body: dict, claim_ids: list, db=None) -> web.Response:
+    # answers 304 when the client's ETag still matches the versions of the claims involved,
+    # and serves results already built for the same ETag from the response cache
+    versions = request.app['claim_versions']
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        cached = versions.cached(claim_ids)
+        if cached is not None and make_etag(body, cached) == if_none_match:
+            return web.Response(status=304, headers={'ETag': if_none_match})
+    # loaded before the read and from the same database, so a write racing it
+    # can only make the ETag too old, never too new
+    replicas = request.app['replicas']
+    db = db or replicas.reader(read_keys(body.get('params') or {}))
+    etag = make_etag(body, load_versions(request.app, db, claim_ids))
+    if etag == if_none_match:
+        return web.Response(status=304, headers={'ETag': etag})
+
+    cache = request.app.get('response_cache')
+    cached = cache and cache.get(etag)
+    if cached is None:
+        result = await process_json(request.app, body, db)
+        if 'result' not in result:
+            return json_response(request, result)
+        compression = request.app['config'].get('compression', {})
+        cached = CachedResult(result['result'], compress=compression.get('enabled', False))
+        if cache is not None:
+            cache.put(etag, cached)
+    return cached.response(request, body.get('id'), {'ETag': etag})
+
+
+def shed_load(request: web.Request, body) -> bool:
+    # admission check, made before the request waits for a job slot
+    shedder = request.app.get('load_shedder')
+    if shedder is None:
+        return False
+    parts = body if type(body) is list else [body]
+    return not shedder.admit([part.get('method') for part in parts if isinstance(part, dict)])
+
+
+def busy_response(request: web.Request, body) -> web.Response:
+    retry_after = request.app['config'].get('overload', {}).get('retry_after', 1)
+    if type(body) is list:
+        error = [{'jsonrpc': '2.0', 'id': part.get('id'), 'error': make_error('BUSY')}
+                 for part in body if isinstance(part, dict)]
+    else:
+        error = {'jsonrpc': '2.0', 'id': body.get('id'), 'error': make_error('BUSY')}
+    return json_response(request, error, status=503, headers={'Retry-After': str(retry_after)})
+
+
 @atomic
+async def process_request(request: web.Request):
+    body = request['jsonrpc_body']
+    methods = request.app['methods']
+    db = request.app['replicas'].primary if pinned_client(request) else None
+    if type(body) is list:
+        # for batching
+        response = json_response(
+            request, [rate_limited(request, part) or await process_json(request.app, part, db)
+                      for part in body]
+        )
+        if any(isinstance(part, dict) and part.get('method') in methods.writes for part in body):
+            pin_client(request, response)
+        return response
+    limited = rate_limited(request, body)
+    if limited:
+        return json_response(request, limited)
+    params = body.get('params') or {}
+    clean_input_params(params)
+    method = methods.get(body.get('method'))
+    # params that don't pass go through process_json, to be turned away there
+    claim_ids = method and method.cacheable and not method.validate(params) and conditional_claim_ids(params)
+    if claim_ids and 'claim_versions' in request.app:
+        return await process_conditional(request, body, claim_ids, db)
+    response = json_response(request, await process_json(request.app, body, db))
+    return pin_client(request, response) if method and method.writes else response
+
+
 async def api_endpoint(request: web.Request):
     try:
         web.access_logger.info(f'Forwarded headers: {request.remote}')
@@ -265,13 +624,14 @@ async def api_endpoint(request: web.Request):
 
         body = await request.json()
         if type(body) is list or type(body) is dict:
-            if type(body) is list:
-                # for batching
-                return web.json_response(
-                    [await process_json(request.app, part) for part in body]
-                )
-            else:
-                return web.json_response(await process_json(request.app, body))
+            if shed_load(request, body):
+                return busy_response(request, body)
+            try:
+                request['jsonrpc_body'] = body
+                return await process_request(request)
+            finally:
+                if 'load_shedder' in request.app:
+                    request.app['load_shedder'].release()
     except Exception as e:
         return make_error('INVALID_REQUEST', e)
 
@@ -280,5 +640,10 @@ async def get_api_endpoint(request: web.Request):
     return web.json_response({
         'text': 'OK',
         'is_running': True,
-        'uptime': int(time.time()) - request.app['start_time']
+        'uptime': int(time.time()) - request.app['start_time'],
+        'rate_limited': request.app['rate_limiter'].counters() if 'rate_limiter' in request.app else {},
+        'spam': request.app['spam_filter'].counters() if 'spam_filter' in request.app else {},
+        'in_flight': request.app['load_shedder'].in_flight if 'load_shedder' in request.app else 0,
+        'shed': dict(request.app['load_shedder'].shed) if 'load_shedder' in request.app else {},
+        'methods': request.app['methods'].stats(),
     })
@@ -0,0 +1,34 @@
+import typing
+from collections import Counter
+
+
+class LoadShedder:
+    """
+    Caps the requests in flight, counted from the moment they arrive rather than when
+    they get a job slot. Writes are turned away once `write_share` of `max_in_flight`
+    is taken, reads only at `max_in_flight`, and pings are always let through, so the
+    cheap requests keep getting answers while writes back off.
+    """
+
+    def __init__(self, write_methods: typing.Set[str], max_in_flight: int = 500, write_share: float = 0.5):
+        self.write_methods = write_methods
+        self.max_in_flight = max_in_flight
+        self.write_limit = int(max_in_flight * write_share)
+        self.in_flight = 0
+        self.shed = Counter()
+
+    def admit(self, methods: typing.List[str]) -> bool:
+        if any(method in self.write_methods for method in methods):
+            kind, limit = 'write', self.write_limit
+        elif all(method == 'ping' for method in methods):
+            kind, limit = 'ping', None
+        else:
+            kind, limit = 'read', self.max_in_flight
+        if limit is not None and self.in_flight >= limit:
+            self.shed[kind] += 1
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
@@ -0,0 +1,93 @@
+import ipaddress
+import time
+import typing
+from collections import Counter, OrderedDict
+
+
+class RateLimited(Exception):
+    pass
+
+
+def parse_networks(addresses: typing.Iterable[str]) -> list:
+    return [ipaddress.ip_network(str(address), strict=False) for address in addresses or ()]
+
+
+def is_trusted(address: str, networks: list) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in networks)
+
+
+def client_address(remote: str, forwarded_for: typing.Optional[str], trusted: list) -> str:
+    # the address a request came from, past the proxies in front of the server. only the
+    # hops our own proxies added can be believed, so X-Forwarded-For is walked back from
+    # the nearest one to the first that isn't one of them
+    if not forwarded_for or not is_trusted(remote, trusted):
+        return remote
+    hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+    for hop in reversed(hops):
+        if not is_trusted(hop, trusted):
+            return hop
+    return hops[0] if hops else remote
+
+
+class RateLimiter:
+    """
+    Token buckets per method, one for each client address and one for each channel,
+    refilled at `rate` tokens a second up to `burst`. Buckets live in a bounded LRU;
+    one that gets evicted starts over full, which is where an idle bucket ends up anyway.
+    Addresses are charged on admission, channels by the handler once the channel's
+    credentials check out, so nobody can spend another channel's tokens.
+
+        limits = {'create_comment': {'ip': {'rate': 1, 'burst': 10},
+                                     'channel': {'rate': 0.2, 'burst': 5}}}
+    """
+
+    def __init__(self, limits: dict, trusted_proxies: typing.Iterable[str] = (), max_buckets: int = 100000):
+        self.limits = {
+            method: {kind: (float(limit['rate']), float(limit['burst'])) for kind, limit in kinds.items()}
+            for method, kinds in (limits or {}).items()
+        }
+        self.trusted_proxies = parse_networks(trusted_proxies)
+        self.max_buckets = max_buckets
+        self.buckets: typing.Dict[tuple, list] = OrderedDict()
+        self.rejected = Counter()
+
+    def take(self, key: tuple, rate: float, burst: float, now: float) -> bool:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            # [tokens, last refill]
+            bucket = self.buckets[key] = [burst, now]
+            if len(self.buckets) > self.max_buckets:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def charge(self, method: str, kind: str, key: typing.Optional[str]) -> bool:
+        limits = self.limits.get(method)
+        if key is None or not limits or kind not in limits:
+            return True
+        if not self.take((method, kind, key), *limits[kind], time.monotonic()):
+            self.rejected[(method, kind)] += 1
+            return False
+        return True
+
+    def allow(self, method: str, remote: str = None, forwarded_for: str = None) -> bool:
+        return self.charge(method, 'ip', client_address(remote, forwarded_for, self.trusted_proxies))
+
+    def allow_channel(self, method: str, channel_id: str) -> bool:
+        return self.charge(method, 'channel', channel_id.strip().lower() if isinstance(channel_id, str) else None)
+
+    def counters(self) -> dict:
+        counters = {}
+        for (method, kind), count in self.rejected.items():
+            counters.setdefault(method, {})[kind] = count
+        return counters
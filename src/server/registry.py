@@ -0,0 +1,92 @@
+import asyncio
+import copy
+import logging
+import typing
+
+from src.server.validation import validate_params
+
+
+logger = logging.getLogger(__name__)
+
+
+class Method:
+    """
+    An API method and what the request pipeline needs to know about it: the params
+    it takes, whether it writes, whether it can read from a replica, whether its
+    result can be answered conditionally and cached, and how it finds its shards
+    when comments are sharded. Per-server settings (its deadline) and counters live on the copy
+    a server binds at startup.
+    """
+
+    def __init__(self, name: str, handler: typing.Callable, required: typing.Iterable[str] = (),
+                 optional: typing.Iterable[str] = (), extra: bool = False, writes: bool = False,
+                 replica: bool = False, cacheable: bool = False, shard_by: typing.Callable = None,
+                 merge: typing.Callable = None, records: bool = False, forgets: typing.Callable = None):
+        self.name = name
+        self.handler = handler
+        self.is_async = asyncio.iscoroutinefunction(handler)
+        self.required = frozenset(required)
+        self.optional = frozenset(optional)
+        # whether the handler takes params beyond the ones it declares
+        self.extra = extra
+        self.writes = writes
+        # only sync handlers can be routed, the models stay bound to the replica while they run
+        self.replica = replica and not self.is_async
+        self.cacheable = cacheable
+        self.shard_by = shard_by
+        self.merge = merge
+        # whether the comment it returns is new, and has to be entered in the shard index
+        self.records = records
+        # the comment_ids it deletes, which leave the shard index along with their replies
+        self.forgets = forgets
+        self.deadline: typing.Optional[float] = None
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    def validate(self, params: dict) -> typing.Optional[str]:
+        return validate_params(params, self.required, self.optional, self.extra)
+
+    def bind(self, config: dict) -> 'Method':
+        bound = copy.copy(self)
+        deadlines = config.get('deadlines') or {}
+        bound.deadline = deadlines.get(self.name, deadlines.get('default'))
+        return bound
+
+    def record(self, seconds: float, failed: bool):
+        self.calls += 1
+        self.errors += failed
+        self.seconds += seconds
+
+
+class MethodRegistry:
+    def __init__(self, methods: typing.Iterable[Method]):
+        self.methods: typing.Dict[str, Method] = {method.name: method for method in methods}
+        self.writes = frozenset(name for name, method in self.methods.items() if method.writes)
+
+    def __contains__(self, name) -> bool:
+        return name in self.methods
+
+    def __getitem__(self, name: str) -> Method:
+        return self.methods[name]
+
+    def get(self, name) -> typing.Optional[Method]:
+        return self.methods.get(name)
+
+    def bind(self, config: dict) -> 'MethodRegistry':
+        # resolves per-method settings once, for the server that's starting
+        sections = {
+            'deadlines': config.get('deadlines'),
+            'rate_limits': (config.get('rate_limits') or {}).get('methods'),
+        }
+        for section, methods in sections.items():
+            for name in (methods or {}):
+                if name != 'default' and name not in self.methods:
+                    logger.warning(f'{section} configured for unknown method {name}')
+        return MethodRegistry(method.bind(config) for method in self.methods.values())
+
+    def stats(self) -> dict:
+        return {
+            name: {'calls': m.calls, 'errors': m.errors, 'seconds': round(m.seconds, 3)}
+            for name, m in self.methods.items() if m.calls
+        }
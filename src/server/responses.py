@@ -0,0 +1,101 @@
+import json
+import struct
+import typing
+import zlib
+from collections import OrderedDict
+
+from aiohttp import web
+
+
+# header of a gzip member: deflate, no name or mtime, unknown OS
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+
+def accepts_gzip(request: web.Request) -> bool:
+    qualities = {}
+    for token in request.headers.get('Accept-Encoding', '').split(','):
+        coding, *params = token.strip().split(';')
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    return qualities.get('gzip', qualities.get('*', 0.0)) > 0
+
+
+def should_compress(request: web.Request, size: int) -> bool:
+    compression = request.app['config'].get('compression', {})
+    return compression.get('enabled', False) and size >= compression.get('min_size', 1024) \
+        and accepts_gzip(request)
+
+
+def deflate(data: bytes, mode: int = zlib.Z_FINISH) -> bytes:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(mode)
+
+
+def json_response(request: web.Request, data: typing.Union[dict, list], headers: dict = None,
+                  status: int = 200) -> web.Response:
+    body = json.dumps(data).encode()
+    headers = {'Vary': 'Accept-Encoding', **(headers or {})}
+    if should_compress(request, len(body)):
+        headers['Content-Encoding'] = 'gzip'
+        body = GZIP_HEADER + deflate(body) + struct.pack('<II', zlib.crc32(body), len(body) & 0xffffffff)
+    return web.Response(body=body, status=status, content_type='application/json', headers=headers)
+
+
+class CachedResult:
+    """
+    A JSON-RPC result, serialized and gzipped once when it's cached.
+    Responses differ only in their id, which comes last, so per request just
+    that tail gets compressed and spliced onto the stored deflate stream.
+    """
+
+    def __init__(self, result, compress: bool):
+        self.head = b'{"jsonrpc": "2.0", "result": ' + json.dumps(result).encode()
+        self.crc = zlib.crc32(self.head)
+        # a sync flush ends the stream on a byte boundary without closing it
+        self.gzipped = deflate(self.head, zlib.Z_SYNC_FLUSH) if compress else None
+
+    @property
+    def size(self) -> int:
+        return len(self.head) + len(self.gzipped or b'')
+
+    def response(self, request: web.Request, request_id, headers: dict) -> web.Response:
+        tail = b', "id": ' + json.dumps(request_id).encode() + b'}'
+        headers = {'Vary': 'Accept-Encoding', **headers}
+        if self.gzipped is not None and should_compress(request, len(self.head)):
+            headers['Content-Encoding'] = 'gzip'
+            size = len(self.head) + len(tail)
+            body = GZIP_HEADER + self.gzipped + deflate(tail) + \
+                struct.pack('<II', zlib.crc32(tail, self.crc), size & 0xffffffff)
+        else:
+            body = self.head + tail
+        return web.Response(body=body, content_type='application/json', headers=headers)
+
+
+class ResponseCache:
+    """ Bounded LRU of cached results, keyed by the ETag of the request they answer """
+
+    def __init__(self, max_bytes: int = 64 * 2**20):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.results: typing.Dict[str, CachedResult] = OrderedDict()
+
+    def get(self, etag: str) -> typing.Optional[CachedResult]:
+        cached = self.results.get(etag)
+        if cached is not None:
+            self.results.move_to_end(etag)
+        return cached
+
+    def put(self, etag: str, cached: CachedResult):
+        if etag in self.results:
+            self.size -= self.results.pop(etag).size
+        self.results[etag] = cached
+        self.size += cached.size
+        while self.size > self.max_bytes and self.results:
+            self.size -= self.results.popitem(last=False)[1].size
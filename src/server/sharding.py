@@ -0,0 +1,115 @@
+import itertools
+import math
+import typing
+
+from src.database.shards import ShardSet
+
+
+# How each method finds its shards when comments are sharded by claim.
+# A split returns the (database, params) pairs to call the handler with,
+# a merge puts the results of a multi-shard call back together.
+
+def by_claim(shards: ShardSet, params: dict) -> list:
+    if params.get('claim_id'):
+        return [(shards.for_claim(params['claim_id']), params)]
+    if params.get('parent_id'):
+        # a reply given without its claim goes wherever its parent is
+        return [(shards.for_comment(params['parent_id']), params)]
+    return [(shards.home, params)]
+
+
+def by_comment(shards: ShardSet, params: dict) -> list:
+    if params.get('comment_id'):
+        return [(shards.for_comment(params['comment_id']), params)]
+    return [(shards.home, params)]
+
+
+def by_claim_ids(shards: ShardSet, params: dict) -> list:
+    groups = shards.by_claim(params['claim_ids'])
+    return [(db, {**params, 'claim_ids': ids}) for db, ids in groups.items()] or [(shards.home, params)]
+
+
+def by_comment_ids(shards: ShardSet, params: dict) -> list:
+    groups = shards.by_comment(params['comment_ids'])
+    return [(db, {**params, 'comment_ids': ids}) for db, ids in groups.items()] or [(shards.home, params)]
+
+
+def by_pieces(shards: ShardSet, params: dict) -> list:
+    pieces = {piece['comment_id']: piece for piece in params['pieces']}
+    groups = shards.by_comment(pieces)
+    return [(db, {**params, 'pieces': [pieces[i] for i in ids]}) for db, ids in groups.items()] \
+        or [(shards.home, params)]
+
+
+def every_shard(shards: ShardSet, params: dict) -> list:
+    return [(db, params) for db in shards.databases]
+
+
+def by_search(shards: ShardSet, params: dict) -> list:
+    if params.get('claim_id'):
+        return [(shards.for_claim(params['claim_id']), params)]
+    # every shard's best matches, down to the last one the requested page could hold
+    depth = params.get('page', 1) * params.get('page_size', 50)
+    return [(db, {**params, 'page': 1, 'page_size': depth}) for db in shards.databases]
+
+
+def named_comment(params: dict) -> list:
+    return [params['comment_id']]
+
+
+def named_pieces(params: dict) -> list:
+    return [piece['comment_id'] for piece in params['pieces']]
+
+
+def newest_first(items: typing.Iterable[dict]) -> list:
+    return sorted(items, key=lambda c: (c['timestamp'], c['comment_id']), reverse=True)
+
+
+def merge_lists(results: list, params: dict) -> dict:
+    return {key: list(itertools.chain.from_iterable(r[key] for r in results)) for key in results[0]}
+
+
+def merge_comment_lists(results: list, params: dict) -> dict:
+    total = sum(r['total_items'] for r in results)
+    page_size = sum(r['page_size'] for r in results)
+    return {
+        **results[0],
+        'page_size': page_size,
+        'total_pages': math.ceil(total / page_size) if page_size else 0,
+        'total_items': total,
+        'items': newest_first(itertools.chain.from_iterable(r['items'] for r in results)),
+    }
+
+
+def merge_channel_pages(results: list, params: dict) -> dict:
+    page_size = params.get('page_size', 50)
+    items = newest_first(itertools.chain.from_iterable(r['items'] for r in results))
+    has_more = len(items) > page_size or any(r['next_cursor'] for r in results)
+    items = items[:page_size]
+    return {
+        'items': items,
+        'page_size': page_size,
+        'next_cursor': f'{items[-1]["timestamp"]}:{items[-1]["comment_id"]}' if has_more and items else None,
+        'total_items': sum(r['total_items'] for r in results),
+        'hidden_items': sum(r['hidden_items'] for r in results),
+    }
+
+
+def merge_search_pages(results: list, params: dict) -> dict:
+    # ranks aren't comparable between shards, so their results are interleaved by rank
+    page, page_size = params.get('page', 1), params.get('page_size', 50)
+    ranked = [item for tier in itertools.zip_longest(*(r['items'] for r in results))
+              for item in tier if item is not None]
+    total = sum(r['total_items'] for r in results)
+    return {
+        'page': page,
+        'page_size': page_size,
+        'total_pages': math.ceil(total / page_size),
+        'total_items': total,
+        'items': ranked[(page - 1) * page_size:page * page_size],
+    }
+
+
+def merge_summaries(results: list, params: dict) -> dict:
+    found = {item['claim_id']: item for r in results for item in r['items']}
+    return {'items': [found[claim_id] for claim_id in params['claim_ids']]}
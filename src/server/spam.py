@@ -0,0 +1,165 @@
+import itertools
+import logging
+import re
+import time
+import typing
+import unicodedata
+from array import array
+from collections import Counter, deque
+
+
+logger = logging.getLogger(__name__)
+
+
+class SpamRejected(Exception):
+    pass
+
+
+HASH_MASK = 2**64 - 1
+VALUE_MASK = 2**32 - 1
+
+
+def normalize(body: str) -> typing.List[str]:
+    # the words of the body, so case, punctuation & spacing don't make copies look different
+    return re.findall(r'\w+', unicodedata.normalize('NFKC', body).casefold())
+
+
+def shingles(words: typing.List[str], size: int = 3) -> typing.Set[str]:
+    if len(words) <= size:
+        return {' '.join(words)}
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash(features: typing.Set[str], bins: int) -> array:
+    # one permutation hashing: every feature is hashed once into one of the bins, which
+    # keep their smallest value. bins left empty by short bodies take the value of the
+    # next filled one, shifted by how far it is, so equal sets still get equal signatures.
+    # python's hash is salted per process, which is fine for an index that lives in one
+    values = [None] * bins
+    for feature in features:
+        h = hash(feature) & HASH_MASK
+        i, value = h % bins, (h // bins) & VALUE_MASK
+        if values[i] is None or value < values[i]:
+            values[i] = value
+    carry = None
+    for i in reversed(range(2 * bins)):
+        value = values[i % bins]
+        if value is not None:
+            carry = value, i
+        elif i < bins and carry is not None:
+            values[i] = (carry[0] + carry[1] - i) & VALUE_MASK
+    return array('I', values)
+
+
+class SpamFilter:
+    """
+    Fingerprints of the bodies of recently created comments, over every channel and claim,
+    to turn away waves of the same or nearly the same body before they reach the database.
+    Exact copies are counted by their words, near ones are found by MinHash signatures of
+    their word triples, bucketed into `bands` so only likely matches are compared. Entries
+    are dropped once they're `window_seconds` old, or `max_entries` newer ones came in.
+    A body with `max_copies` others like it in the index gets that check's `action`,
+    `reject` or `log`:
+
+        config = {'window_seconds': 600, 'max_entries': 50000, 'min_length': 30,
+                  'exact': {'max_copies': 20, 'action': 'reject'},
+                  'near': {'max_copies': 20, 'similarity': 0.8, 'action': 'log'}}
+    """
+
+    def __init__(self, config: dict, bins: int = 32, bands: int = 8, max_compared: int = 1000):
+        self.window = float(config.get('window_seconds', 600))
+        self.max_entries = int(config.get('max_entries', 50000))
+        # shorter bodies are too often written the same way by different people
+        self.min_length = int(config.get('min_length', 30))
+        self.checks = {
+            kind: {'max_copies': int(check['max_copies']), 'action': check.get('action', 'reject'),
+                   'similarity': float(check.get('similarity', 1))}
+            for kind, check in config.items() if kind in ('exact', 'near') and check
+        }
+        self.bins, self.bands = bins, bands
+        self.rows = bins // bands
+        self.max_compared = max_compared
+        self.ids = itertools.count()
+        # (id, time, exact key, band keys), oldest first
+        self.entries = deque()
+        self.exact = Counter()
+        self.buckets: typing.Dict[int, typing.Set[int]] = {}
+        self.signatures: typing.Dict[int, array] = {}
+        self.caught = Counter()
+
+    def evict(self, now: float):
+        while self.entries and (len(self.entries) > self.max_entries or self.entries[0][1] < now - self.window):
+            entry_id, _, key, band_keys = self.entries.popleft()
+            self.exact[key] -= 1
+            if not self.exact[key]:
+                del self.exact[key]
+            for band_key in band_keys:
+                bucket = self.buckets[band_key]
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self.buckets[band_key]
+            del self.signatures[entry_id]
+
+    def band_keys(self, signature: array) -> typing.List[int]:
+        return [hash((band, signature[band * self.rows:(band + 1) * self.rows].tobytes()))
+                for band in range(self.bands)]
+
+    def near_copies(self, signature: array, band_keys: typing.List[int], enough: int, similarity: float) -> int:
+        # stops counting at `enough`, in a wave most of the candidates are copies,
+        # and after `max_compared` candidates whatever they are
+        seen, copies = set(), 0
+        for band_key in band_keys:
+            for entry_id in self.buckets.get(band_key, ()):
+                if entry_id in seen:
+                    continue
+                if len(seen) >= self.max_compared:
+                    return copies
+                seen.add(entry_id)
+                other = self.signatures[entry_id]
+                if sum(a == b for a, b in zip(signature, other)) >= similarity * self.bins:
+                    copies += 1
+                    if copies >= enough:
+                        return copies
+        return copies
+
+    def rejects(self, body: str) -> bool:
+        # records the body, and tells whether it should be turned away
+        if not isinstance(body, str):
+            return False
+        words = normalize(body)
+        text = ' '.join(words)
+        if len(text) < self.min_length:
+            return False
+        now = time.monotonic()
+        self.evict(now)
+
+        key = hash(text)
+        signature = minhash(shingles(words), self.bins)
+        band_keys = self.band_keys(signature)
+        tripped = []
+        exact, near = self.checks.get('exact'), self.checks.get('near')
+        if exact and self.exact[key] >= exact['max_copies']:
+            tripped.append(('exact', exact['action']))
+        # exact copies are near ones as well, which may be rejected where these are only logged
+        if near and not any(action == 'reject' for _, action in tripped):
+            copies = self.near_copies(signature, band_keys, near['max_copies'], near['similarity'])
+            if copies >= near['max_copies']:
+                tripped.append(('near', near['action']))
+
+        entry_id = next(self.ids)
+        self.entries.append((entry_id, now, key, band_keys))
+        self.exact[key] += 1
+        for band_key in band_keys:
+            self.buckets.setdefault(band_key, set()).add(entry_id)
+        self.signatures[entry_id] = signature
+
+        for kind, action in tripped:
+            self.caught[(kind, action)] += 1
+            logger.warning(f'{kind} copy of a recent comment ({action}): {text[:80]}')
+        return any(action == 'reject' for _, action in tripped)
+
+    def counters(self) -> dict:
+        counters = {'entries': len(self.entries)}
+        for (kind, action), count in self.caught.items():
+            counters.setdefault(kind, {})[action] = count
+        return counters
@@ -0,0 +1,184 @@
+import asyncio
+import json
+import logging
+import time
+import typing
+import uuid
+
+from aiohttp import web, WSMsgType, WSCloseCode
+
+from src.database.models import StreamEvent
+from src.server.external import create_notification_batch
+from src.server.validation import claim_id_is_valid
+
+
+logger = logging.getLogger(__name__)
+
+
+class Subscriber:
+    """ One websocket client, with a bounded buffer of events waiting to be sent """
+
+    def __init__(self, ws: web.WebSocketResponse, buffer_size: int):
+        self.ws = ws
+        self.queue = asyncio.Queue(maxsize=buffer_size)
+        self.claim_ids = set()
+        self.evicted = False
+
+    def push(self, event: dict) -> bool:
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def run(self):
+        while True:
+            event = await self.queue.get()
+            await self.ws.send_json(event)
+
+
+def log_failure(task: asyncio.Future):
+    # retrieves what a background send or close ended with, so it's logged rather than
+    # reported as never retrieved. clients going away mid-send is the usual cause
+    if not task.cancelled() and task.exception() is not None:
+        logger.info(f'Stream task failed: {task.exception()!r}')
+
+
+class CommentStream:
+    """
+    Fans comment events out to the websocket clients subscribed to their claims.
+    Clients that fall `buffer_size` events behind are disconnected rather than
+    buffered for, so a slow reader can't hold on to an unbounded backlog.
+
+    Every worker only has its own clients, with `relay` the events each one publishes
+    are also written to STREAM_EVENT, where the others pick them up by `poll`. Rows
+    are read again for `settle_seconds`, as on mysql an insert can commit after a
+    later one has been read, and deleted after `keep_seconds`.
+    """
+
+    def __init__(self, buffer_size: int = 100, max_claims: int = 1000, relay: bool = False,
+                 settle_seconds: int = 2, keep_seconds: int = 60):
+        self.buffer_size = buffer_size
+        self.max_claims = max_claims
+        self.subscribers: typing.Dict[str, typing.Set[Subscriber]] = {}
+        self.clients: typing.Set[Subscriber] = set()
+        self.evictions = 0
+        self.relay = relay
+        self.origin = uuid.uuid4().hex
+        self.settle_seconds = settle_seconds
+        self.keep_seconds = keep_seconds
+        # ids of the relayed rows already delivered, to when they were created
+        self.relayed: typing.Dict[int, int] = {}
+
+    def subscribe(self, subscriber: Subscriber, claim_ids: typing.List[str]) -> typing.List[str]:
+        added = []
+        for claim_id in claim_ids:
+            if len(subscriber.claim_ids) >= self.max_claims:
+                break
+            if isinstance(claim_id, str) and claim_id_is_valid(claim_id.lower()):
+                claim_id = claim_id.lower()
+                subscriber.claim_ids.add(claim_id)
+                self.subscribers.setdefault(claim_id, set()).add(subscriber)
+                added.append(claim_id)
+        return added
+
+    def unsubscribe(self, subscriber: Subscriber, claim_ids: typing.Iterable[str]):
+        for claim_id in list(claim_ids):
+            if not isinstance(claim_id, str):
+                continue
+            claim_id = claim_id.lower()
+            subscriber.claim_ids.discard(claim_id)
+            subscribers = self.subscribers.get(claim_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.subscribers[claim_id]
+
+    def remove(self, subscriber: Subscriber):
+        self.unsubscribe(subscriber, subscriber.claim_ids)
+        self.clients.discard(subscriber)
+
+    def publish(self, action: str, comments: typing.List[dict]):
+        events = create_notification_batch(action, comments)
+        self.deliver(events)
+        if self.relay:
+            try:
+                StreamEvent.insert(origin=self.origin, created=int(time.time()), events=json.dumps(events)).execute()
+            except Exception:
+                # the comments are written already, only the other workers' subscribers miss them
+                logger.exception('Relaying stream events failed')
+
+    def deliver(self, events: typing.List[dict]):
+        for event in events:
+            for subscriber in list(self.subscribers.get(event['claim_id'], ())):
+                if not subscriber.push(event):
+                    self.evict(subscriber)
+
+    def poll(self) -> int:
+        # delivers the events other workers published since the last poll
+        now = int(time.time())
+        rows = (StreamEvent
+                .select(StreamEvent.id, StreamEvent.created, StreamEvent.events)
+                .where((StreamEvent.created >= now - self.settle_seconds) & (StreamEvent.origin != self.origin))
+                .tuples())
+        delivered = 0
+        for row_id, created, events in rows:
+            if row_id not in self.relayed:
+                self.relayed[row_id] = created
+                if self.subscribers:
+                    self.deliver(json.loads(events))
+                    delivered += 1
+        self.relayed = {row_id: created for row_id, created in self.relayed.items()
+                        if created >= now - self.settle_seconds}
+        return delivered
+
+    def prune(self) -> int:
+        return StreamEvent.delete().where(StreamEvent.created < int(time.time()) - self.keep_seconds).execute()
+
+    def evict(self, subscriber: Subscriber):
+        logger.info(f'Evicting a slow stream consumer with {subscriber.queue.qsize()} events pending')
+        self.evictions += 1
+        subscriber.evicted = True
+        self.remove(subscriber)
+        closing = asyncio.ensure_future(subscriber.ws.close(code=WSCloseCode.TRY_AGAIN_LATER, message=b'slow consumer'))
+        closing.add_done_callback(log_failure)
+
+    async def close(self):
+        for subscriber in list(self.clients):
+            await subscriber.ws.close(code=WSCloseCode.GOING_AWAY, message=b'server shutdown')
+
+
+async def stream_endpoint(request: web.Request) -> web.WebSocketResponse:
+    # clients send {"subscribe": [claim_ids]} or {"unsubscribe": [claim_ids]}
+    # and receive the events of the claims they're subscribed to
+    stream: CommentStream = request.app['comment_stream']
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    subscriber = Subscriber(ws, stream.buffer_size)
+    stream.clients.add(subscriber)
+    sender = asyncio.ensure_future(subscriber.run())
+    sender.add_done_callback(log_failure)
+    try:
+        async for msg in ws:
+            if subscriber.evicted:
+                break
+            if msg.type != WSMsgType.TEXT:
+                continue
+            try:
+                message = json.loads(msg.data)
+                assert isinstance(message, dict)
+            except (ValueError, AssertionError):
+                reply = {'error': 'expected a JSON object'}
+            else:
+                if isinstance(message.get('unsubscribe'), list):
+                    stream.unsubscribe(subscriber, message['unsubscribe'])
+                if isinstance(message.get('subscribe'), list):
+                    stream.subscribe(subscriber, message['subscribe'])
+                reply = {'subscribed': sorted(subscriber.claim_ids)}
+            # replies queue up behind pending events, so only the sender ever writes
+            if not subscriber.push(reply):
+                stream.evict(subscriber)
+    finally:
+        stream.remove(subscriber)
+        sender.cancel()
+    return ws
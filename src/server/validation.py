@@ -1,7 +1,9 @@
 import logging
 import binascii
+import functools
 import hashlib
 import re
+import time
 
 import ecdsa
 import typing
@@ -14,6 +16,43 @@ from cryptography.hazmat.primitives.serialization import load_der_public_key
 
 logger = logging.getLogger(__name__)
 
+CHANNEL_NAME_PATTERN = re.compile(
+    '@(?:(?![\x00-\x08\x0b\x0c\x0e-\x1f\x23-\x26'
+    '\x2f\x3a\x3d\x3f-\x40\uFFFE-\U0000FFFF]).){1,255}'
+)
+COMMENT_ID_PATTERN = re.compile('([a-z0-9]{64}|[A-Z0-9]{64})')
+CLAIM_ID_PATTERN = re.compile('([a-z0-9]{40}|[A-Z0-9]{40})')
+# the most ids or pieces a single request can name
+MAX_LIST_LENGTH = 500
+# the most comments a single page can hold
+MAX_PAGE_SIZE = 500
+
+
+class ThrottledLog:
+    """
+    Logs at most one message every `interval` seconds and counts the ones it drops,
+    so a flood of bad requests can't turn into a flood of log lines.
+    """
+
+    def __init__(self, log: logging.Logger, interval: float = 10.0):
+        self.log = log
+        self.interval = interval
+        self.last = None
+        self.suppressed = 0
+
+    def warning(self, message: str):
+        now = time.monotonic()
+        if self.last is not None and now - self.last < self.interval:
+            self.suppressed += 1
+            return
+        if self.suppressed:
+            message += f' ({self.suppressed} similar failures not logged)'
+        self.last, self.suppressed = now, 0
+        self.log.warning(message)
+
+
+failure_log = ThrottledLog(logger)
+
 
 def is_valid_channel(channel_id: str, channel_name: str) -> bool:
     return channel_id and claim_id_is_valid(channel_id) and \
@@ -30,12 +69,10 @@ def is_signature_valid(encoded_signature, signature_digest, public_key_bytes) ->
     return False
 
 
+@functools.lru_cache(maxsize=65536)
 def channel_name_is_valid(channel_name: str) -> bool:
-    return re.fullmatch(
-        '@(?:(?![\x00-\x08\x0b\x0c\x0e-\x1f\x23-\x26'
-        '\x2f\x3a\x3d\x3f-\x40\uFFFE-\U0000FFFF]).){1,255}',
-        channel_name
-    ) is not None
+    # a few channels post most of the comments, so the same names get checked over & over
+    return CHANNEL_NAME_PATTERN.fullmatch(channel_name) is not None
 
 
 def body_is_valid(comment: str) -> bool:
@@ -43,11 +80,11 @@ def body_is_valid(comment: str) -> bool:
 
 
 def comment_id_is_valid(comment_id: str) -> bool:
-    return re.fullmatch('([a-z0-9]{64}|[A-Z0-9]{64})', comment_id) is not None
+    return COMMENT_ID_PATTERN.fullmatch(comment_id) is not None
 
 
 def claim_id_is_valid(claim_id: str) -> bool:
-    return re.fullmatch('([a-z0-9]{40}|[A-Z0-9]{40})', claim_id) is not None
+    return CLAIM_ID_PATTERN.fullmatch(claim_id) is not None
 
 
 # default to None so params can be treated as kwargs; param count becomes more manageable
@@ -88,12 +125,99 @@ def is_valid_credential_input(channel_id: str = None, channel_name: str = None,
 
         return True
 
-    except Exception as e:
-        logger.exception(f'Failed to validate channel: lbry://{channel_name}#{channel_id}, '
-                         f'signature: {signature} signing_ts: {signing_ts}')
+    except Exception:
+        failure_log.warning(f'Failed to validate channel: lbry://{channel_name}#{channel_id}, '
+                            f'signature: {signature} signing_ts: {signing_ts}')
         return False
 
 
+def _is_claim_id(value) -> bool:
+    return type(value) is str and claim_id_is_valid(value)
+
+
+def _is_comment_id(value) -> bool:
+    return type(value) is str and comment_id_is_valid(value)
+
+
+def _is_channel_name(value) -> bool:
+    return type(value) is str and channel_name_is_valid(value)
+
+
+def _is_body(value) -> bool:
+    return type(value) is str and body_is_valid(value)
+
+
+def _is_signature(value) -> bool:
+    return type(value) is str and len(value) == 128
+
+
+def _is_signing_ts(value) -> bool:
+    return type(value) is str and value.isalnum()
+
+
+def _is_page(value) -> bool:
+    return type(value) is int and value > 0
+
+
+def _is_page_size(value) -> bool:
+    return _is_page(value) and value <= MAX_PAGE_SIZE
+
+
+def _is_text(value) -> bool:
+    return type(value) is str and len(value) > 0
+
+
+def _is_id_list(value) -> bool:
+    return type(value) in (list, tuple) and 0 < len(value) <= MAX_LIST_LENGTH and all(type(v) is str for v in value)
+
+
+def _is_piece_list(value) -> bool:
+    return type(value) is list and 0 < len(value) <= MAX_LIST_LENGTH and \
+        all(type(p) is dict and type(p.get('comment_id')) is str for p in value)
+
+
+# the format every param of that name has to be in, whichever method it's sent to.
+# params missing here (flags like `hidden`) are passed through as they are
+PARAM_CHECKS = {
+    'claim_id': _is_claim_id,
+    'channel_id': _is_claim_id,
+    'comment_id': _is_comment_id,
+    'parent_id': _is_comment_id,
+    'channel_name': _is_channel_name,
+    'comment': _is_body,
+    'signature': _is_signature,
+    'signing_ts': _is_signing_ts,
+    'page': _is_page,
+    'page_size': _is_page_size,
+    'query': _is_text,
+    'cursor': _is_text,
+    'comment_ids': _is_id_list,
+    'claim_ids': _is_id_list,
+    'pieces': _is_piece_list,
+}
+
+
+def validate_params(params: dict, required: typing.AbstractSet[str], optional: typing.AbstractSet[str],
+                    extra: bool = False) -> typing.Optional[str]:
+    # one pass over a request's params before it's dispatched, returns what's wrong with them if anything.
+    # a param sent as null counts as left out, the same as it would for the handler's defaults
+    found = 0
+    for name, value in params.items():
+        if name in required:
+            if value is None:
+                return f'{name} is required'
+            found += 1
+        elif name not in optional:
+            if not extra:
+                return f'unexpected param {name}'
+            continue
+        if value is not None and name in PARAM_CHECKS and not PARAM_CHECKS[name](value):
+            return f'invalid {name}'
+    if found < len(required):
+        return 'missing ' + ', '.join(sorted(required - params.keys()))
+    return None
+
+
 def validate_signature_from_claim(claim: dict, signature: typing.Union[str, bytes],
                                   signing_ts: str, data: str) -> bool:
     try:
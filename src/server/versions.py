@@ -0,0 +1,62 @@
+import hashlib
+import json
+import time
+import typing
+from collections import OrderedDict
+
+from src.database.models import ClaimSummary
+
+
+class ClaimVersions:
+    """
+    Per-claim version counters from CLAIM_SUMMARY, kept in memory for `ttl` seconds
+    so conditional requests can be answered without going to the database.
+    Writes made through this server invalidate the claims they touch right away,
+    the ttl bounds how long a write made elsewhere can go unnoticed.
+    """
+
+    def __init__(self, ttl: float = 1.0, max_size: int = 100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.versions = OrderedDict()
+
+    def cached(self, claim_ids: typing.List[str]) -> typing.Optional[tuple]:
+        now = time.monotonic()
+        versions = []
+        for claim_id in claim_ids:
+            entry = self.versions.get(claim_id)
+            if entry is None or now - entry[1] > self.ttl:
+                return None
+            versions.append(entry[0])
+        return tuple(versions)
+
+    def load(self, claim_ids: typing.List[str]) -> tuple:
+        found = dict(ClaimSummary
+                     .select(ClaimSummary.claim_id, ClaimSummary.version)
+                     .where(ClaimSummary.claim_id.in_(claim_ids))
+                     .tuples())
+        now = time.monotonic()
+        for claim_id in claim_ids:
+            self.versions[claim_id] = (found.get(claim_id, 0), now)
+            self.versions.move_to_end(claim_id)
+        while len(self.versions) > self.max_size:
+            self.versions.popitem(last=False)
+        return tuple(found.get(claim_id, 0) for claim_id in claim_ids)
+
+    def invalidate(self, claim_ids: typing.Iterable[str]):
+        for claim_id in claim_ids:
+            self.versions.pop(claim_id, None)
+
+
+def conditional_claim_ids(params: dict) -> typing.Optional[typing.List[str]]:
+    # the claims the result of a cacheable method depends on
+    if isinstance(params.get('claim_id'), str):
+        return [params['claim_id']]
+    if isinstance(params.get('claim_ids'), list) and all(isinstance(c, str) for c in params['claim_ids']):
+        return params['claim_ids'] or None
+
+
+def make_etag(body: dict, versions: tuple) -> str:
+    # the request id is left out, it doesn't change what the result is
+    key = json.dumps([body['method'], body.get('params') or {}, versions], sort_keys=True)
+    return '"' + hashlib.sha1(key.encode()).hexdigest()[:32] + '"'
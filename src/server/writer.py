@@ -0,0 +1,72 @@
+import asyncio
+import contextvars
+import logging
+import typing
+
+from src.database.models import create_comment_batch
+from src.database.shards import current_shard
+
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommitWriter:
+    """
+    Coalesces comment creations that arrive within `window` seconds of each other
+    and writes them in a single transaction, so a burst of comments costs one
+    commit instead of one per comment. Each caller still gets back its own
+    comment, or the error that its comment alone ran into.
+    """
+
+    def __init__(self, db, window: float = 0.005, max_batch: int = 200):
+        self.db = db
+        self.window = window
+        self.max_batch = max_batch
+        self.pending: typing.List[typing.Tuple[dict, asyncio.Future, typing.Any]] = []
+        self.timer: typing.Optional[asyncio.TimerHandle] = None
+
+    async def create_comment(self, **params) -> dict:
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        # the shard the caller is on, if comments are sharded
+        self.pending.append((params, future, current_shard.get()))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        pending, self.pending = self.pending, []
+        batches = {}
+        for params, future, shard in pending:
+            batches.setdefault(shard, []).append((params, future))
+        for shard, batch in batches.items():
+            self.commit(shard, batch)
+
+    def commit(self, shard, batch: typing.List[typing.Tuple[dict, asyncio.Future]]):
+        try:
+            # the batch is shared, so it runs outside of any one caller's deadline
+            results = contextvars.Context().run(self.write, shard, [params for params, _ in batch])
+        except Exception as err:
+            logger.exception(f'Group commit of {len(batch)} comments failed')
+            results = [err] * len(batch)
+        logger.debug(f'Group committed {len(batch)} comments')
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def write(self, shard, comments: typing.List[dict]) -> list:
+        current_shard.set(shard)
+        with self.db.atomic():
+            return create_comment_batch(comments)
+
+    async def close(self):
+        self.flush()
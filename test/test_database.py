@@ -1,3 +1,5 @@
+import io
+import time
 from random import randint
 import faker
 from faker.providers import internet
@@ -8,7 +10,23 @@ from src.database.models import create_comment
 from src.database.models import delete_comment
 from src.database.models import comment_list, get_comment
 from src.database.models import set_hidden_flag
-from test.testcase import DatabaseTestCase
+from src.database.models import bulk_create_comments
+from src.database.models import iter_comments
+from src.database.models import search_comments
+from src.database.models import edit_comment
+from src.database.models import get_channel_comments
+from src.database.models import rebuild_channel_stats
+from src.database.models import create_comment_batch
+from src.database.models import get_claim_summaries, rebuild_claim_summaries
+from src.database.models import ClaimSummary
+from src.database.models import ArchivedComment, archive_cold_claims
+from src.database.models import Comment, CommentBody, edit_comments
+from src.database.models import Channel, archive_in_use, body_store_in_use, enable_tables
+from src.database.deadlines import deadline, DeadlineExceeded, DeadlineSqliteDatabase
+from peewee import SQL
+from src.server.app import add_indexes
+from scripts.import_comments import read_csv
+from test.testcase import DatabaseTestCase, test_db
 
 fake = faker.Faker()
 fake.add_provider(internet)
@@ -186,6 +204,384 @@ class TestDatabaseOperations(DatabaseTestCase):
             comment_id=comm['comment_id'],
         )
 
+    def test07BulkCreateComments(self):
+        claim_ids = [fake.sha1() for _ in range(2)]
+        comments = [{
+            'claim_id': claim_ids[i % 2],
+            'comment': fake.text(),
+            'channel_name': '@' + fake.user_name(),
+            'channel_id': fake.sha1(),
+            'signature': fake.sha256() + fake.sha256(),
+            'signing_ts': str(randint(1, 2**32))
+        } for i in range(40)]
+        comments.append({'claim_id': claim_ids[0], 'comment': 'no channel attached'})
+        result = bulk_create_comments(comments)
+        self.assertEqual(result, {'inserted': 40, 'duplicates': 0, 'invalid': 1})
+        self.assertEqual(comment_list(claim_ids[0])['total_items'], 20)
+
+        # re-importing the same dump is a no-op
+        result = bulk_create_comments(comments)
+        self.assertEqual(result['inserted'], 0)
+
+        # replies without a claim_id inherit the one from their parent
+        parent = comment_list(claim_ids[1], page_size=1)['items'][0]
+        reply = dict(comments[0], comment='a reply', parent_id=parent['comment_id'], claim_id=None,
+                     signature='f' * 128)
+        result = bulk_create_comments([reply])
+        self.assertEqual(result['inserted'], 1)
+        replies = comment_list(claim_ids[1], parent_id=None)['items']
+        self.assertIn(parent['comment_id'], [c.get('parent_id') for c in replies])
+
+    def test07BulkCreateFromCSV(self):
+        claim_id = fake.sha1()
+        flags = ['False', '0', 'no', 'True', '1', 'yes', '']
+        dump = io.StringIO()
+        dump.write('claim_id,comment,channel_name,channel_id,signature,signing_ts,is_hidden\n')
+        for i, flag in enumerate(flags):
+            dump.write(f'{claim_id},Comment #{i},@importer,{fake.sha1()},{fake.sha256() + fake.sha256()},1,{flag}\n')
+        dump.seek(0)
+        self.assertEqual(bulk_create_comments(read_csv(dump))['inserted'], len(flags))
+        hidden = {c['comment']: c['is_hidden'] for c in comment_list(claim_id)['items']}
+        self.assertEqual([hidden[f'Comment #{i}'] for i in range(len(flags))],
+                         [False, False, False, True, True, True, False])
+
+    def test08IterComments(self):
+        channel_ids = [fake.sha1() for _ in range(2)]
+        bulk_create_comments([{
+            'claim_id': self.claimId,
+            'comment': f'Comment #{i}',
+            'channel_name': '@Doge123',
+            'channel_id': channel_ids[i % 2],
+            'signature': fake.sha256() + fake.sha256(),
+            'signing_ts': '123',
+            'timestamp': 1000 + i
+        } for i in range(25)])
+
+        # chunk boundaries must not drop or repeat anything
+        everything = list(iter_comments(chunk_size=4))
+        self.assertEqual(len(everything), 25)
+        self.assertEqual(len({c['comment_id'] for c in everything}), 25)
+        self.assertIn('channel_url', everything[0])
+
+        by_channel = list(iter_comments(channel_id=channel_ids[0], chunk_size=5))
+        self.assertEqual(len(by_channel), 13)
+        self.assertTrue(all(c['channel_id'] == channel_ids[0] for c in by_channel))
+
+        in_range = list(iter_comments(claim_id=self.claimId, since=1010, until=1020, chunk_size=3))
+        self.assertEqual(sorted(c['timestamp'] for c in in_range), list(range(1010, 1020)))
+
+    def test09SearchComments(self):
+        other_claim = fake.sha1()
+        comm1 = create_comment(
+            comment='The quick brown fox', claim_id=self.claimId,
+            channel_id='1'*40, channel_name='@Doge123',
+            signature='a'*128, signing_ts='123'
+        )
+        create_comment(
+            comment='the lazy dog jumped over the fox', claim_id=other_claim,
+            channel_id='2'*40, channel_name='@Cate',
+            signature='b'*128, signing_ts='123'
+        )
+        results = search_comments('fox')
+        self.assertEqual(results['total_items'], 2)
+        self.assertIn('channel_url', results['items'][0])
+
+        # every word has to match, and filters narrow it down
+        self.assertEqual(search_comments('quick fox')['total_items'], 1)
+        self.assertEqual(search_comments('fox', claim_id=other_claim)['total_items'], 1)
+        self.assertEqual(search_comments('fox', channel_id='1'*40)['items'][0]['comment_id'], comm1['comment_id'])
+
+        # search syntax is treated as plain words
+        self.assertEqual(search_comments('"fox* (')['total_items'], 2)
+        self.assertRaises(ValueError, search_comments, '"*')
+
+        # the index follows edits & deletes
+        edit_comment(comm1['comment_id'], 'a slow red panda', 'c'*128, '124')
+        self.assertEqual(search_comments('fox')['total_items'], 1)
+        self.assertEqual(search_comments('panda')['total_items'], 1)
+        delete_comment(comm1['comment_id'])
+        self.assertEqual(search_comments('panda')['total_items'], 0)
+
+    def test10ChannelComments(self):
+        channel_id = fake.sha1()
+        other_claim = fake.sha1()
+        bulk_create_comments([{
+            'claim_id': self.claimId if i % 3 else other_claim,
+            'comment': f'Comment #{i}',
+            'channel_name': '@Doge123',
+            'channel_id': channel_id,
+            'signature': fake.sha256() + fake.sha256(),
+            'signing_ts': '123',
+            # duplicate timestamps make sure the cursor breaks ties
+            'timestamp': 1000 + i // 2
+        } for i in range(30)])
+        first = comment_list(channel_id=channel_id, page_size=1)['items'][0]
+        set_hidden_flag([first['comment_id']])
+
+        seen, cursor = [], None
+        while True:
+            page = get_channel_comments(channel_id, page_size=7, cursor=cursor)
+            seen += page['items']
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(len(seen), 30)
+        self.assertEqual(len({c['comment_id'] for c in seen}), 30)
+        self.assertEqual(seen[0]['comment_id'], first['comment_id'])
+        self.assertEqual([c['timestamp'] for c in seen], sorted((c['timestamp'] for c in seen), reverse=True))
+        self.assertEqual((page['total_items'], page['hidden_items']), (30, 1))
+
+        self.assertEqual(len(get_channel_comments(channel_id, claim_id=other_claim)['items']), 10)
+        self.assertEqual(len(get_channel_comments(channel_id, hidden=True)['items']), 1)
+        self.assertEqual(len(get_channel_comments(channel_id, hidden=False)['items']), 29)
+        self.assertRaises(ValueError, get_channel_comments, channel_id, cursor='nope')
+
+        # totals stay current through the single-row write paths
+        reply = create_comment(
+            comment='a reply', claim_id=self.claimId, parent_id=first['comment_id'],
+            channel_id=channel_id, channel_name='@Doge123', signature='a'*128, signing_ts='1'
+        )
+        self.assertEqual(get_channel_comments(channel_id)['total_items'], 31)
+        set_hidden_flag([first['comment_id'], reply['comment_id']], hidden=False)
+        self.assertEqual(get_channel_comments(channel_id)['hidden_items'], 0)
+        set_hidden_flag([reply['comment_id']])
+        delete_comment(first['comment_id'])
+        page = get_channel_comments(channel_id)
+        self.assertEqual((page['total_items'], page['hidden_items']), (29, 0))
+
+        rebuild_channel_stats()
+        page = get_channel_comments(channel_id)
+        self.assertEqual((page['total_items'], page['hidden_items']), (29, 0))
+
+    def test11WritesReturnStoredRow(self):
+        # what the write paths hand back has to match what a read returns
+        comment = create_comment(
+            comment='Returned as stored', claim_id=self.claimId,
+            channel_id='1'*40, channel_name='@Doge123',
+            signature='a'*128, signing_ts='123'
+        )
+        self.assertEqual(comment, get_comment(comment['comment_id']))
+
+        reply, = create_comment_batch([{
+            'comment': 'A batched reply', 'parent_id': comment['comment_id'],
+            'channel_id': '2'*40, 'channel_name': '@Cate',
+            'signature': 'b'*128, 'signing_ts': '123'
+        }])
+        self.assertEqual(reply, get_comment(reply['comment_id']))
+
+        edited = edit_comment(comment['comment_id'], 'Edited as stored', 'c'*128, '124')
+        self.assertEqual(edited, get_comment(comment['comment_id']))
+
+        # a channel known under another name is turned away the same way by both
+        renamed = {'comment': 'Under a new name', 'claim_id': self.claimId, 'channel_id': '1'*40,
+                   'channel_name': '@Doge456', 'signature': 'd'*128, 'signing_ts': '125'}
+        with self.assertRaisesRegex(ValueError, 'known as @Doge123'):
+            create_comment(**renamed)
+        result, = create_comment_batch([renamed])
+        self.assertIsInstance(result, ValueError)
+        self.assertEqual(str(result), 'Channel 1111111111111111111111111111111111111111 is known as @Doge123')
+
+    def test12ClaimSummaries(self):
+        other_claim = fake.sha1()
+        channels = [('1'*40, '@Doge123'), ('2'*40, '@Cate')]
+        top = [create_comment(
+            comment=f'Top level #{i}', claim_id=self.claimId,
+            channel_id=channels[i % 2][0], channel_name=channels[i % 2][1],
+            signature=fake.sha256() + fake.sha256(), signing_ts='123'
+        ) for i in range(3)]
+        reply, = create_comment_batch([{
+            'comment': 'A reply', 'parent_id': top[0]['comment_id'],
+            'channel_id': '3'*40, 'channel_name': '@Newcomer',
+            'signature': fake.sha256() + fake.sha256(), 'signing_ts': '123'
+        }])
+        bulk_create_comments([{
+            'comment': 'Old comment', 'claim_id': self.claimId, 'timestamp': 1000,
+            'channel_id': channels[0][0], 'channel_name': channels[0][1],
+            'signature': fake.sha256() + fake.sha256(), 'signing_ts': '123'
+        }])
+
+        summary, empty = get_claim_summaries([self.claimId, other_claim])['items']
+        self.assertEqual(summary['total_comments'], 5)
+        self.assertEqual(summary['top_level_comments'], 4)
+        self.assertEqual(summary['channels'], 3)
+        self.assertEqual(summary['latest_timestamp'], max(c['timestamp'] for c in top + [reply]))
+        self.assertEqual(empty, {'claim_id': other_claim, 'total_comments': 0,
+                                 'top_level_comments': 0, 'channels': 0})
+
+        def version():
+            return ClaimSummary.get_by_id(self.claimId).version
+
+        # every write touching the claim moves its version forward
+        before = version()
+        set_hidden_flag([reply['comment_id']])
+        self.assertEqual(version(), before + 1)
+        edit_comment(top[1]['comment_id'], 'edited', fake.sha256() + fake.sha256(), '124')
+        self.assertEqual(version(), before + 2)
+        delete_comment(top[0]['comment_id'])
+        self.assertEqual(version(), before + 3)
+
+        summary, = get_claim_summaries([self.claimId])['items']
+        self.assertEqual((summary['total_comments'], summary['top_level_comments'], summary['channels']), (3, 3, 2))
+        incremental = get_claim_summaries([self.claimId])
+        rebuild_claim_summaries()
+        self.assertEqual(get_claim_summaries([self.claimId]), incremental)
+
+    def test13QueryDeadlines(self):
+        db = DeadlineSqliteDatabase(':memory:')
+        slow = 'WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT count(*) FROM n'
+        start = time.monotonic()
+        with deadline(0.05):
+            with self.assertRaises(DeadlineExceeded):
+                db.execute_sql(slow)
+            # nothing new gets started past the deadline either
+            with self.assertRaises(DeadlineExceeded):
+                db.execute_sql('SELECT 1')
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(db.execute_sql('SELECT 1').fetchone(), (1,))
+        db.close()
+
+    def test14ArchiveTier(self):
+        channel_id, cold_claim, warm_claim = fake.sha1(), fake.sha1(), fake.sha1()
+        bulk_create_comments([{
+            'claim_id': cold_claim if i < 20 else warm_claim,
+            'comment': f'Comment #{i}',
+            'channel_name': '@Doge123',
+            'channel_id': channel_id,
+            'signature': fake.sha256() + fake.sha256(),
+            'signing_ts': '123',
+            # the warm claim has a few comments older than the cold one's
+            'timestamp': (1000 + i if i < 20 else 500 + i) if i < 25 else 5000 + i
+        } for i in range(30)])
+        before = {
+            'cold': comment_list(cold_claim, page_size=7, page=2),
+            'channel': [comment_list(channel_id=channel_id, page_size=8, page=p) for p in range(1, 5)],
+            'ids': sorted(c['comment_id'] for c in iter_comments()),
+            'summaries': get_claim_summaries([cold_claim, warm_claim]),
+        }
+        # binding a model binds its refs along, which doesn't turn the archive on
+        with test_db.bind_ctx([Channel]):
+            self.assertIs(ArchivedComment._meta.database, test_db)
+            self.assertFalse(archive_in_use() or body_store_in_use())
+        with test_db.bind_ctx([ArchivedComment], bind_refs=False, bind_backrefs=False):
+            ArchivedComment.create_table()
+            enable_tables(test_db, archive=True)
+            try:
+                after, moved = archive_cold_claims(3000, limit=1)
+                while after is not None:
+                    after, count = archive_cold_claims(3000, after, limit=1)
+                    moved += count
+                self.assertEqual(moved, 20)
+                self.assertEqual(ArchivedComment.select().count(), 20)
+
+                # reads see both tiers as one
+                self.assertEqual(comment_list(cold_claim, page_size=7, page=2), before['cold'])
+                self.assertEqual([comment_list(channel_id=channel_id, page_size=8, page=p) for p in range(1, 5)],
+                                 before['channel'])
+                self.assertEqual(sorted(c['comment_id'] for c in iter_comments()), before['ids'])
+                self.assertEqual(get_claim_summaries([cold_claim, warm_claim]), before['summaries'])
+                rebuild_claim_summaries()
+                rebuild_channel_stats()
+                self.assertEqual(get_claim_summaries([cold_claim, warm_claim]), before['summaries'])
+                self.assertEqual(get_channel_comments(channel_id)['total_items'], 30)
+                archived = before['cold']['items'][0]
+                self.assertEqual(get_comment(archived['comment_id']), archived)
+
+                # writing to an archived claim brings it back whole
+                set_hidden_flag([archived['comment_id']])
+                self.assertEqual(ArchivedComment.select().count(), 0)
+                self.assertTrue(comment_list(cold_claim, exclude_mode='hidden')['items'][0]['is_hidden'])
+            finally:
+                enable_tables(test_db)
+                ArchivedComment.drop_table()
+
+    def test14ArchiveEditedThread(self):
+        claim_id, channel = fake.sha1(), {'channel_id': fake.sha1(), 'channel_name': '@Doge123'}
+
+        def signed() -> dict:
+            return {'signature': fake.sha256() + fake.sha256(), 'signing_ts': '123'}
+
+        parent = create_comment('parent', claim_id, **channel, **signed())
+        reply = create_comment('reply', parent_id=parent['comment_id'], **channel, **signed())
+        nested = create_comment('nested', parent_id=reply['comment_id'], **channel, **signed())
+        Comment.update(timestamp=1000).execute()
+        # editing the parent puts it after its replies by timestamp
+        edit_comment(parent['comment_id'], 'parent, edited', *signed().values())
+        Comment.update(timestamp=2000).where(Comment.comment_id == parent['comment_id']).execute()
+        rebuild_claim_summaries([claim_id])
+        thread = [parent['comment_id'], reply['comment_id'], nested['comment_id']]
+
+        def inserted(model) -> list:
+            return [comment_id for comment_id, in model.select(model.comment_id).order_by(SQL('rowid')).tuples()]
+
+        test_db.pragma('foreign_keys', 1)
+        with test_db.bind_ctx([ArchivedComment], bind_refs=False, bind_backrefs=False):
+            ArchivedComment.create_table()
+            enable_tables(test_db, archive=True)
+            try:
+                _, moved = archive_cold_claims(3000)
+                self.assertEqual(moved, 3)
+                self.assertEqual(inserted(ArchivedComment), thread)
+                set_hidden_flag([nested['comment_id']])
+                self.assertEqual(inserted(Comment), thread)
+                self.assertEqual(get_comment(parent['comment_id'])['comment'], 'parent, edited')
+            finally:
+                enable_tables(test_db)
+                ArchivedComment.drop_table()
+                test_db.pragma('foreign_keys', 0)
+
+    def test15BodyStore(self):
+        spam = 'Buy cheap LBC at the best rate, only today! ' * 4
+        claim_id = fake.sha1()
+
+        def post(body, i):
+            return create_comment(body, claim_id, channel_name=f'@spammer{i}', channel_id=fake.sha1(),
+                                  signature=fake.sha256() + fake.sha256(), signing_ts=str(i))
+
+        def refs():
+            return dict(CommentBody.select(CommentBody.body_hash, CommentBody.refs).tuples())
+
+        with test_db.bind_ctx([CommentBody], bind_refs=False, bind_backrefs=False):
+            CommentBody.create_table()
+            enable_tables(test_db, body_store=True)
+            try:
+                first = post(spam, 0)
+                unique = post('A comment long enough to be hashed, that nobody else posted. ' * 3, 1)
+                self.assertEqual(refs(), {})
+                # the second copy moves the body out of both rows
+                spammed = [first] + [post(spam, i) for i in range(2, 4)]
+                self.assertEqual(list(refs().values()), [3])
+                self.assertEqual(Comment.select().where(Comment.comment == '').count(), 3)
+                for comment in spammed:
+                    self.assertEqual(comment['comment'], spam)
+                    self.assertEqual(get_comment(comment['comment_id']), comment)
+                self.assertEqual({c['comment'] for c in comment_list(claim_id)['items']}, {spam, unique['comment']})
+                self.assertEqual({c['comment'] for c in iter_comments()}, {spam, unique['comment']})
+                # repeated bodies are left out of search
+                self.assertEqual(search_comments('cheap')['total_items'], 0)
+                self.assertEqual(search_comments('nobody')['items'], [unique])
+
+                edited = edit_comments([{'comment_id': spammed[0]['comment_id'], 'comment': unique['comment'],
+                                         'signature': fake.sha256() + fake.sha256(), 'signing_ts': '9'}])
+                self.assertEqual(edited[0]['comment'], unique['comment'])
+                self.assertEqual(sorted(refs().values()), [2, 2])
+                delete_comment(spammed[1]['comment_id'])
+                delete_comment(spammed[2]['comment_id'])
+                self.assertEqual(list(refs().values()), [2])
+                self.assertEqual(get_comment(unique['comment_id'])['comment'], unique['comment'])
+
+                # imports count what they actually inserted
+                rows = [{
+                    'comment_id': fake.sha256(), 'claim_id': claim_id, 'comment': spam,
+                    'channel_name': '@importer', 'channel_id': fake.sha1(),
+                    'signature': fake.sha256() + fake.sha256(), 'signing_ts': '1',
+                } for _ in range(3)]
+                bulk_create_comments(rows)
+                bulk_create_comments(rows)
+                self.assertEqual(sorted(refs().values()), [2, 3])
+            finally:
+                enable_tables(test_db)
+                CommentBody.drop_table()
+
 
 class ListDatabaseTest(DatabaseTestCase):
     def setUp(self) -> None:
@@ -268,6 +664,42 @@ class ListDatabaseTest(DatabaseTestCase):
         self.assertEqual(composite_ids, all_ids)
 
 
+    def testHiddenCommentsByClaim(self):
+        # a database from before the index was added to the model gets it on startup
+        test_db.execute_sql('DROP INDEX comment_lbryclaimid_ishidden_timestamp')
+        add_indexes(test_db, [Comment])
+        self.assertIn('comment_lbryclaimid_ishidden_timestamp', [i.name for i in test_db.get_indexes('COMMENT')])
+        add_indexes(test_db, [Comment])
+
+        claim_id = 'b' * 40
+        channel = {'channel_id': '1' * 40, 'channel_name': '@Doge123'}
+
+        def signed() -> dict:
+            return {'signature': fake.sha256() + fake.sha256(), 'signing_ts': '123'}
+
+        created = [create_comment(f'Comment #{i}', claim_id, **channel, **signed()) for i in range(10)]
+        for i, comment in enumerate(created):
+            Comment.update(timestamp=1000 - i).where(Comment.comment_id == comment['comment_id']).execute()
+        hidden_ids = [created[i]['comment_id'] for i in (2, 5, 7)]
+        set_hidden_flag(hidden_ids)
+        create_comment('Elsewhere', 'c' * 40, **channel, **signed())
+
+        hidden = comment_list(claim_id, exclude_mode='hidden')
+        self.assertEqual(hidden['total_items'], 3)
+        self.assertTrue(all(c['is_hidden'] for c in hidden['items']))
+        self.assertEqual([c['comment_id'] for c in hidden['items']], hidden_ids)
+        visible = comment_list(claim_id, exclude_mode='visible')
+        self.assertEqual(visible['total_items'], 7)
+        self.assertFalse(any(c['is_hidden'] for c in visible['items']))
+
+        query = (Comment.select(Comment.comment_id)
+                 .where((Comment.claim_id == claim_id) & (Comment.is_hidden == True))
+                 .order_by(Comment.timestamp.desc()))
+        sql, params = query.sql()
+        plan = ' '.join(str(row) for row in test_db.execute_sql('EXPLAIN QUERY PLAN ' + sql, params))
+        self.assertIn('comment_lbryclaimid_ishidden_timestamp', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
 def generate_top_comments(ncid=15, ncomm=100, minchar=50, maxchar=500):
     claim_ids = [fake.sha1() for _ in range(ncid)]
     top_comments = {
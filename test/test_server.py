@@ -1,5 +1,14 @@
+import asyncio
+import gzip
+import io
+import json
 import os
 import random
+import tempfile
+import unittest
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
 
 import aiohttp
 from itertools import *
@@ -11,9 +20,19 @@ from faker.providers import misc
 
 from src.main import get_config, CONFIG_FILE
 from src.server import app
-from src.server.validation import is_valid_base_comment
+from src.server.validation import is_valid_base_comment, MAX_LIST_LENGTH, MAX_PAGE_SIZE
+from src.server.handles import METHODS
+from src.server.stream import CommentStream, Subscriber
+from src.server.ratelimit import client_address, parse_networks
+from src.database.models import create_comment, iter_comments
+from src.database.deadlines import DeadlineSqliteDatabase
+from src.database.models import Comment, ChannelStats, ClaimSummary, StreamEvent
+from src.database.shards import ShardSet
+from scripts.reshard import reshard
+from scripts.valid_signatures import ChannelKeys, Checkpoint, audit, init_worker
 
 from test.testcase import AsyncioTestCase
+from scripts.lbrynet import FakeLBRYNet
 
 
 config = get_config(CONFIG_FILE)
@@ -24,6 +43,19 @@ config['testing']['file'] = ':memory:'
 if 'slack_webhook' in config:
     config.pop('slack_webhook')
 
+# the tests below create comments far faster than anybody should, often with the same body
+unlimited = mock.patch.dict(config)
+
+
+def setUpModule():
+    unlimited.start()
+    config.pop('rate_limits', None)
+    config.pop('spam_filter', None)
+
+
+def tearDownModule():
+    unlimited.stop()
+
 
 fake = faker.Faker()
 fake.add_provider(internet)
@@ -182,6 +214,41 @@ class ServerTest(AsyncioTestCase):
                     else:
                         self.assertTrue(is_valid_base_comment(**test))
 
+    async def testParamSchemas(self):
+        claim_id = fake.sha1()
+        self.assertIsNone(METHODS['get_claim_comments'].validate({'claim_id': claim_id, 'page': 2}))
+        self.assertIsNone(METHODS['abandon_comment'].validate({
+            'comment_id': fake.sha256(), 'signature': fake_signature(), 'signing_ts': '1234', 'channel_id': claim_id
+        }))
+        self.assertEqual(METHODS['get_claim_comments'].validate({'page': 1}), 'missing claim_id')
+        self.assertEqual(METHODS['get_claim_comments'].validate({'claim_id': claim_id, 'page_size': 0}),
+                         'invalid page_size')
+        self.assertIsNone(METHODS['get_claim_comments'].validate({'claim_id': claim_id, 'page_size': MAX_PAGE_SIZE}))
+        self.assertEqual(METHODS['get_claim_comments'].validate({'claim_id': claim_id,
+                                                                 'page_size': MAX_PAGE_SIZE + 1}),
+                         'invalid page_size')
+        self.assertEqual(METHODS['get_claim_summaries'].validate({'claim_ids': [claim_id], 'limit': 5}),
+                         'unexpected param limit')
+        for comment_ids in ([], [fake.sha256() for _ in range(MAX_LIST_LENGTH + 1)]):
+            self.assertEqual(METHODS['get_comments_by_id'].validate({'comment_ids': comment_ids}),
+                             'invalid comment_ids')
+        self.assertEqual(METHODS['hide_comments'].validate({'pieces': []}), 'invalid pieces')
+        self.assertEqual(METHODS.writes, {'create_comment', 'delete_comment', 'abandon_comment',
+                                          'abandon_comments', 'hide_comments', 'edit_comment', 'edit_comments'})
+
+        response = await jsonrpc_post(self.url, 'get_claim_comments', claim_id='not a claim id')
+        self.assertEqual(response['error']['code'], -32602)
+        response = await jsonrpc_post(self.url, 'get_claim_comments', claim_id=claim_id, page_size=MAX_PAGE_SIZE + 1)
+        self.assertEqual(response['error']['code'], -32602)
+        response = await self.post_comment(claim_id=claim_id, comment='hi', channel_name='not a channel')
+        self.assertEqual(response['error']['code'], -32602)
+
+        # rejected requests never reach the handler, so they don't count towards its calls
+        self.assertIn('result', await jsonrpc_post(self.url, 'get_claim_comments', claim_id=claim_id))
+        async with aiohttp.request('GET', f'http://{self.host}:{self.port}/') as response:
+            stats = (await response.json())['methods']
+        self.assertEqual((stats['get_claim_comments']['calls'], stats['get_claim_comments']['errors']), (1, 0))
+
     async def testSlackWebhook(self):
         claim_id = '1d8a5cc39ca02e55782d619e67131c0a20843be8'
         channel_name = '@name'
@@ -276,3 +343,843 @@ class ListCommentsTest(AsyncioTestCase):
         self.assertIs(type(response['items']), list)
         self.assertEqual(response['total_items'], response_one['total_items'])
         self.assertEqual(response['total_pages'], response_one['total_pages'])
+
+    async def testConditionalRequests(self):
+        await self.create_lots_of_comments()
+        body = {'jsonrpc': '2.0', 'id': 1, 'method': 'get_claim_comments',
+                'params': {'claim_id': self.claim_id, 'page_size': 5}}
+
+        async def post(headers=None, **params):
+            json_body = {**body, 'params': {**body['params'], **params}}
+            async with aiohttp.request('POST', self.url, json=json_body, headers=headers) as response:
+                return response.status, response.headers.get('ETag')
+
+        status, etag = await post()
+        self.assertEqual(status, 200)
+        self.assertIsNotNone(etag)
+        self.assertEqual(await post({'If-None-Match': etag}), (304, etag))
+
+        # other pages are other resources
+        status, page_two = await post({'If-None-Match': etag}, page=2)
+        self.assertEqual(status, 200)
+        self.assertNotEqual(page_two, etag)
+
+        # writing to the claim invalidates it straight away
+        created = await self.post_comment(
+            **{**self.comment_list[0], 'comment': 'one more', 'signature': fake_signature()}
+        )
+        self.assertIn('result', created)
+        status, new_etag = await post({'If-None-Match': etag})
+        self.assertEqual(status, 200)
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(await post({'If-None-Match': new_etag}), (304, new_etag))
+
+    async def testCompressedResponses(self):
+        await self.create_lots_of_comments()
+        body = {'jsonrpc': '2.0', 'method': 'get_claim_comments',
+                'params': {'claim_id': self.claim_id, 'page_size': 50}}
+
+        async def post(request_id, encoding):
+            async with aiohttp.ClientSession(auto_decompress=False) as session:
+                async with session.post(self.url, json={**body, 'id': request_id},
+                                        headers={'Accept-Encoding': encoding}) as response:
+                    return response.headers.get('Content-Encoding'), await response.read()
+
+        encoding, plain = await post(1, 'identity')
+        self.assertIsNone(encoding)
+        expected = json.loads(plain)
+        self.assertEqual(len(expected['result']['items']), 23)
+
+        # the second request is served from the cache with its own id spliced in
+        for request_id in (1, 'second', None):
+            with self.subTest(request_id=request_id):
+                encoding, compressed = await post(request_id, 'br;q=1.0, gzip;q=0.8')
+                self.assertEqual(encoding, 'gzip')
+                self.assertLess(len(compressed), len(plain))
+                self.assertEqual(json.loads(gzip.decompress(compressed)), {**expected, 'id': request_id})
+
+        encoding, _ = await post(2, 'gzip;q=0')
+        self.assertIsNone(encoding)
+
+    async def testLiveStream(self):
+        other_claim = fake.sha1()
+        async with aiohttp.ClientSession() as session:
+            async with session.ws_connect(f'http://{self.host}:{self.port}/stream') as ws:
+                await ws.send_json({'subscribe': [self.claim_id, 'not a claim']})
+                self.assertEqual(await ws.receive_json(), {'subscribed': [self.claim_id]})
+
+                comment = {key: self.replace[key]() for key in self.replace.keys()}
+                await self.post_comment(**{**comment, 'claim_id': other_claim})
+                created = (await self.post_comment(
+                    **{**comment, 'claim_id': self.claim_id, 'comment': 'live', 'signature': fake_signature()}
+                ))['result']
+                event = await ws.receive_json()
+                self.assertEqual(event['action_type'], 'C')
+                self.assertEqual(event['comment_id'], created['comment_id'])
+                self.assertEqual(event['claim_id'], self.claim_id)
+
+                await ws.send_json({'unsubscribe': [self.claim_id]})
+                self.assertEqual(await ws.receive_json(), {'subscribed': []})
+
+
+class SignedCommentsTest(AsyncioTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.host = 'localhost'
+        self.port = 5931
+        self.lbrynet = FakeLBRYNet()
+        self.channel = self.lbrynet.add_channel('@signer')
+        self.claim_owner = self.lbrynet.add_channel('@creator')
+        self.claim_id = self.lbrynet.add_claim(channel=self.claim_owner)['claim_id']
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}/api'
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        await self.lbrynet.start(self.host, 5932)
+        self.addCleanup(self.lbrynet.stop)
+        self.server = app.CommentDaemon({**config, 'lbrynet': self.lbrynet.url})
+        await self.server.start(host=self.host, port=self.port)
+        self.addCleanup(self.server.stop)
+
+    async def create_signed_comment(self, body: str) -> dict:
+        response = await jsonrpc_post(
+            self.url, 'create_comment',
+            comment=body,
+            claim_id=self.claim_id,
+            channel_id=self.channel.claim_id,
+            channel_name=self.channel.name,
+            **self.channel.sign(body)
+        )
+        return response['result']
+
+    async def testEditComment(self):
+        comment = await self.create_signed_comment('first version')
+        edited = await jsonrpc_post(
+            self.url, 'edit_comment',
+            comment_id=comment['comment_id'],
+            comment='second version',
+            **self.channel.sign('second version')
+        )
+        self.assertIn('result', edited)
+        self.assertEqual(edited['result']['comment'], 'second version')
+
+        forged = await jsonrpc_post(
+            self.url, 'edit_comment',
+            comment_id=comment['comment_id'],
+            comment='forged version',
+            **self.claim_owner.sign('forged version')
+        )
+        self.assertIn('error', forged)
+
+    async def testAbandonComment(self):
+        comment = await self.create_signed_comment('to be abandoned')
+        response = await jsonrpc_post(
+            self.url, 'abandon_comment',
+            comment_id=comment['comment_id'],
+            **self.channel.sign(comment['comment_id'])
+        )
+        self.assertTrue(response['result']['abandoned'])
+        self.assertEqual(self.lbrynet.calls['claim_search'], 1)
+
+    async def testHideComments(self):
+        comment = await self.create_signed_comment('to be hidden')
+        response = await jsonrpc_post(
+            self.url, 'hide_comments',
+            pieces=[{'comment_id': comment['comment_id'], **self.claim_owner.sign(comment['comment_id'])}]
+        )
+        self.assertEqual(response['result']['hidden'], [comment['comment_id']])
+
+    async def testBatchEditAndAbandon(self):
+        other = self.lbrynet.add_channel('@other')
+        comments = [await self.create_signed_comment(f'comment {i}') for i in range(3)]
+        response = await jsonrpc_post(
+            self.url, 'create_comment',
+            comment='from the other channel',
+            claim_id=self.claim_id,
+            channel_id=other.claim_id,
+            channel_name=other.name,
+            **other.sign('from the other channel')
+        )
+        comments.append(response['result'])
+
+        pieces = [{'comment_id': c['comment_id'], 'comment': f'edited {i}', **self.channel.sign(f'edited {i}')}
+                  for i, c in enumerate(comments[:3])]
+        pieces.append({'comment_id': comments[3]['comment_id'], 'comment': 'forged', **self.channel.sign('forged')})
+        edited = await jsonrpc_post(self.url, 'edit_comments', pieces=pieces)
+        self.assertEqual([c['comment'] for c in edited['result']['edited']], ['edited 0', 'edited 1', 'edited 2'])
+        self.assertEqual(edited['result']['failed'], [comments[3]['comment_id']])
+        # both channels resolved in a single lookup
+        self.assertEqual(self.lbrynet.calls['claim_search'], 1)
+
+        pieces = [{'comment_id': c['comment_id'], **self.channel.sign(c['comment_id'])} for c in comments[:2]]
+        pieces.append({'comment_id': comments[3]['comment_id'], **other.sign(comments[3]['comment_id'])})
+        pieces.append({'comment_id': comments[2]['comment_id'], **other.sign(comments[2]['comment_id'])})
+        abandoned = await jsonrpc_post(self.url, 'abandon_comments', pieces=pieces)
+        self.assertEqual(
+            sorted(abandoned['result']['abandoned']),
+            sorted(c['comment_id'] for c in (comments[0], comments[1], comments[3]))
+        )
+        self.assertEqual(abandoned['result']['failed'], [comments[2]['comment_id']])
+        remaining = await jsonrpc_post(self.url, 'get_claim_comments', claim_id=self.claim_id)
+        self.assertEqual([c['comment_id'] for c in remaining['result']['items']], [comments[2]['comment_id']])
+
+
+class GroupCommitTest(AsyncioTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.host = 'localhost'
+        self.port = 5931
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}/api'
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        group_config = {**config, 'group_commit': {'enabled': True, 'window_ms': 50, 'max_batch': 100}}
+        self.server = app.CommentDaemon(group_config)
+        await self.server.start(host=self.host, port=self.port)
+        self.addCleanup(self.server.stop)
+
+    async def testCoalescedCreates(self):
+        claim_id = fake.sha1()
+        channel = {'channel_id': fake.sha1(), 'channel_name': fake_lbryusername()}
+        comments = [{
+            'claim_id': claim_id,
+            'comment': f'comment number {i}',
+            'signature': fake_signature(),
+            'signing_ts': fake_signing_ts(),
+            **channel
+        } for i in range(20)]
+        # same body, channel & timestamp as the first comment, so the ids collide
+        duplicate = {**comments[0], 'signature': fake_signature()}
+        invalid = {**comments[1], 'comment': 'no channel name', 'channel_name': None}
+
+        responses = await asyncio.gather(*(
+            jsonrpc_post(self.url, 'create_comment', **c)
+            for c in comments + [duplicate, invalid]
+        ))
+        for comment, response in zip(comments, responses):
+            self.assertIn('result', response)
+            self.assertEqual(response['result']['comment'], comment['comment'])
+            self.assertEqual(response['result']['claim_id'], claim_id)
+        self.assertIn('error', responses[-2])
+        self.assertIn('error', responses[-1])
+
+        listed = await jsonrpc_post(self.url, 'get_claim_comments', claim_id=claim_id, page_size=50)
+        self.assertEqual(listed['result']['total_items'], 20)
+
+    async def testWriteOutlastsDeadline(self):
+        # the batch commits after the caller's deadline, which mustn't report the write as failed
+        self.server.app['methods']['create_comment'].deadline = 0.01
+        claim_id = fake.sha1()
+        response = await jsonrpc_post(
+            self.url, 'create_comment', claim_id=claim_id, comment='written late', channel_id=fake.sha1(),
+            channel_name=fake_lbryusername(), signature=fake_signature(), signing_ts=fake_signing_ts()
+        )
+        self.assertIn('result', response)
+        listed = await jsonrpc_post(self.url, 'get_claim_comments', claim_id=claim_id)
+        self.assertEqual([c['comment_id'] for c in listed['result']['items']], [response['result']['comment_id']])
+
+
+class ReplicaTest(AsyncioTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.host = 'localhost'
+        self.port = 5931
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}/api'
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.replica = DeadlineSqliteDatabase(os.path.join(tmp.name, 'replica.db'))
+        with self.replica.bind_ctx(app.MODELS, bind_refs=False, bind_backrefs=False):
+            app.create_tables(self.replica)
+        self.replica.close()
+
+        testing = {
+            **config['testing'],
+            'file': os.path.join(tmp.name, 'primary.db'),
+            'replicas': [{'file': self.replica.database}, {'file': os.path.join(tmp.name, 'gone', 'replica.db')}]
+        }
+        self.server = app.CommentDaemon({
+            **config, 'testing': testing, 'read_your_writes_seconds': 0.2, 'replica_health_interval': 0.05
+        })
+        await self.server.start(host=self.host, port=self.port)
+        self.addCleanup(self.server.stop)
+
+    async def count(self, claim_id):
+        return len((await jsonrpc_post(self.url, 'get_claim_comments', claim_id=claim_id))['result']['items'])
+
+    async def testReadRouting(self):
+        await asyncio.sleep(0.1)
+        replicas = self.server.app['replicas']
+        self.assertEqual([db.database for db in replicas.healthy], [self.replica.database])
+
+        # the replica has comments the primary doesn't, as if it were ahead of it
+        replicated = fake.sha1()
+        with self.replica.bind_ctx(app.MODELS, bind_refs=False, bind_backrefs=False):
+            create_comment(claim_id=replicated, comment='from the replica', channel_id=fake.sha1(),
+                           channel_name='@replica', signature=fake_signature(), signing_ts='1234')
+        self.assertEqual(await self.count(replicated), 1)
+
+        # right after a write, its claim reads from the primary...
+        claim_id = fake.sha1()
+        response = await jsonrpc_post(
+            self.url, 'create_comment', claim_id=claim_id, comment='on the primary', channel_id=fake.sha1(),
+            channel_name='@primary', signature=fake_signature(), signing_ts='1234'
+        )
+        self.assertIn('result', response)
+        self.assertEqual(await self.count(claim_id), 1)
+        by_id = await jsonrpc_post(self.url, 'get_comments_by_id', comment_ids=[response['result']['comment_id']])
+        self.assertEqual(len(by_id['result']['items']), 1)
+
+        # ...and from a replica that hasn't caught up once the pin is over
+        await asyncio.sleep(0.25)
+        self.assertEqual(await self.count(claim_id), 0)
+
+        # a replica that fails a query is dropped and the primary answers instead,
+        # until the health checks say which replicas are up again
+        await app.close_replica_checks(self.server.app)
+        replicas.healthy = [replicas.replicas[1]]
+        self.assertEqual(await self.count(replicated), 0)
+        self.assertEqual(replicas.healthy, [])
+        self.server.app['replica_checks'] = asyncio.ensure_future(app.check_replicas(self.server.app))
+        await asyncio.sleep(0.1)
+        self.assertEqual(replicas.healthy, [replicas.replicas[0]])
+        self.assertEqual(await self.count(replicated), 1)
+
+    async def testClientPinnedAcrossWorkers(self):
+        await asyncio.sleep(0.1)
+        claim_id = fake.sha1()
+        async with aiohttp.ClientSession() as writer:
+            async def count():
+                body = {'jsonrpc': '2.0', 'id': 1, 'method': 'get_claim_comments', 'params': {'claim_id': claim_id}}
+                async with writer.post(self.url, json=body) as response:
+                    return len((await response.json())['result']['items'])
+
+            params = {'claim_id': claim_id, 'comment': 'on the primary', 'channel_id': fake.sha1(),
+                      'channel_name': '@primary', 'signature': fake_signature(), 'signing_ts': '1234'}
+            body = {'jsonrpc': '2.0', 'id': 1, 'method': 'create_comment', 'params': params}
+            async with writer.post(self.url, json=body) as response:
+                self.assertIn('primary_until', response.cookies)
+            # as if the reads went to another worker, which has no pins of its own
+            self.server.app['replicas'].pins.clear()
+            self.assertEqual(await count(), 1)
+            self.assertEqual(await self.count(claim_id), 0)
+            await asyncio.sleep(0.25)
+            self.assertEqual(await count(), 0)
+
+
+class StandaloneTest(AsyncioTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.host = 'localhost'
+        self.port = 5931
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}/api'
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        standalone = {**config['standalone'], 'file': os.path.join(tmp.name, 'comments.db'), 'readers': 2}
+        self.server = app.CommentDaemon({**config, 'mode': 'standalone', 'standalone': standalone})
+        await self.server.start(host=self.host, port=self.port)
+        self.addCleanup(self.server.stop)
+
+    async def testReadOnlyReaders(self):
+        readers = self.server.app['replicas']
+        self.assertEqual(len(readers.healthy), 2)
+        self.assertEqual(self.server.app['db'].execute_sql('PRAGMA journal_mode').fetchone(), ('wal',))
+
+        # whatever was just written is read back from a reader, nothing is pinned
+        claim_id = fake.sha1()
+        for i in range(3):
+            response = await jsonrpc_post(
+                self.url, 'create_comment', claim_id=claim_id, comment=f'comment #{i}', channel_id=fake.sha1(),
+                channel_name='@standalone', signature=fake_signature(), signing_ts='1234'
+            )
+            self.assertIn('result', response)
+            listed = await jsonrpc_post(self.url, 'get_claim_comments', claim_id=claim_id)
+            self.assertEqual(listed['result']['total_items'], i + 1)
+        self.assertFalse(readers.pins)
+
+        for reader in readers.replicas:
+            self.assertEqual(reader.execute_sql('PRAGMA query_only').fetchone(), (1,))
+            with self.assertRaises(Exception):
+                reader.execute_sql('DELETE FROM COMMENT')
+        self.assertEqual(readers.healthy, readers.replicas)
+
+
+class ShardTest(AsyncioTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.host = 'localhost'
+        self.port = 5931
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}/api'
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = tmp.name
+        testing = {
+            **config['testing'],
+            'file': os.path.join(tmp.name, 'shard0.db'),
+            'shards': [{'file': os.path.join(tmp.name, f'shard{i}.db')} for i in (1, 2)]
+        }
+        self.lbrynet = FakeLBRYNet()
+        await self.lbrynet.start(self.host, 5932)
+        self.addCleanup(self.lbrynet.stop)
+        self.server = app.CommentDaemon({**config, 'testing': testing, 'lbrynet': self.lbrynet.url})
+        await self.server.start(host=self.host, port=self.port)
+        self.addCleanup(self.server.stop)
+        self.shards = self.server.app['shards']
+
+    def placement(self, shards: ShardSet) -> dict:
+        # claim_id -> (shards holding its comments, shards holding its summary)
+        placed = {}
+        for i, db in enumerate(shards.databases):
+            with shards.using(db):
+                for claim_id, in Comment.select(Comment.claim_id).distinct().tuples():
+                    placed.setdefault(claim_id, (set(), set()))[0].add(i)
+                for claim_id, in ClaimSummary.select(ClaimSummary.claim_id).tuples():
+                    placed.setdefault(claim_id, (set(), set()))[1].add(i)
+        return placed
+
+    async def testShardedStorage(self):
+        channel = {'channel_id': fake.sha1(), 'channel_name': '@sharded'}
+        claim_ids = [fake.sha1() for _ in range(8)]
+        comment_ids = {}
+        for n, claim_id in enumerate(claim_ids):
+            for i in range(n % 3 + 1):
+                response = await jsonrpc_post(
+                    self.url, 'create_comment', claim_id=claim_id, comment=f'comment {i} on claim {n}',
+                    signature=fake_signature(), signing_ts=fake_signing_ts(), **channel
+                )
+                comment_ids.setdefault(claim_id, []).append(response['result']['comment_id'])
+        total = sum(len(ids) for ids in comment_ids.values())
+
+        placed = self.placement(self.shards)
+        self.assertGreater(len({min(shards) for shards, _ in placed.values()}), 1)
+        for claim_id in claim_ids:
+            self.assertEqual(placed[claim_id], ({self.shards.shard_of(claim_id)},) * 2)
+            listed = await jsonrpc_post(self.url, 'get_claim_comments', claim_id=claim_id)
+            self.assertEqual(len(listed['result']['items']), len(comment_ids[claim_id]))
+
+        # a reply without its claim_id finds its parent's shard through the index
+        parent_id = comment_ids[claim_ids[0]][0]
+        reply = await jsonrpc_post(self.url, 'create_comment', parent_id=parent_id, comment='a reply',
+                                   signature=fake_signature(), signing_ts=fake_signing_ts(), **channel)
+        self.assertEqual(reply['result']['claim_id'], claim_ids[0])
+        comment_ids[claim_ids[0]].append(reply['result']['comment_id'])
+        total += 1
+
+        everything = [i for ids in comment_ids.values() for i in ids]
+        by_id = await jsonrpc_post(self.url, 'get_comments_by_id', comment_ids=everything)
+        self.assertEqual(sorted(c['comment_id'] for c in by_id['result']['items']), sorted(everything))
+        self.assertEqual(by_id['result']['total_items'], total)
+        owner = await jsonrpc_post(self.url, 'get_channel_from_comment_id', comment_id=everything[-1])
+        self.assertEqual(owner['result']['channel_id'], channel['channel_id'])
+
+        summaries = await jsonrpc_post(self.url, 'get_claim_summaries', claim_ids=claim_ids[::-1])
+        self.assertEqual([s['claim_id'] for s in summaries['result']['items']], claim_ids[::-1])
+        self.assertEqual([s['total_comments'] for s in summaries['result']['items']],
+                         [len(comment_ids[c]) for c in claim_ids[::-1]])
+
+        # a channel's comments come from every shard, newest first, a page at a time
+        pages, cursor = [], None
+        while True:
+            params = {'channel_id': channel['channel_id'], 'page_size': 4}
+            page = (await jsonrpc_post(self.url, 'get_channel_comments', **params,
+                                       **({'cursor': cursor} if cursor else {})))['result']
+            self.assertEqual(page['total_items'], total)
+            pages.extend(page['items'])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(sorted(c['comment_id'] for c in pages), sorted(everything))
+        self.assertEqual(pages, sorted(pages, key=lambda c: (c['timestamp'], c['comment_id']), reverse=True))
+
+        # growing to four shards moves only the claims that now land on the new one, and back
+        versions = {}
+        for db in self.shards.databases:
+            with self.shards.using(db):
+                versions.update(ClaimSummary.select(ClaimSummary.claim_id, ClaimSummary.version).tuples())
+        grown = ShardSet(self.shards.databases + [DeadlineSqliteDatabase(os.path.join(self.path, 'shard3.db'))])
+        with grown.using(grown.databases[-1]):
+            app.create_tables(grown.databases[-1])
+        moved = reshard(grown)
+        placed = self.placement(grown)
+        for claim_id in claim_ids:
+            self.assertEqual(placed[claim_id], ({grown.shard_of(claim_id)},) * 2)
+        self.assertEqual(moved['claims'], sum(grown.shard_of(c) == 3 for c in claim_ids))
+        self.assertEqual(set(grown.lookup(everything).items()),
+                         {(i, grown.shard_of(c)) for c, ids in comment_ids.items() for i in ids})
+
+        reshard(grown, drain=1)
+        placed = self.placement(grown)
+        for claim_id in claim_ids:
+            self.assertEqual(placed[claim_id], ({self.shards.shard_of(claim_id)},) * 2)
+        by_id = await jsonrpc_post(self.url, 'get_comments_by_id', comment_ids=everything)
+        self.assertEqual(by_id['result']['total_items'], total)
+        # a claim's version never goes back down by moving it
+        for claim_id in claim_ids:
+            with self.shards.using(self.shards.for_claim(claim_id)):
+                version = ClaimSummary.get_by_id(claim_id).version
+            self.assertEqual(version, versions[claim_id] + (2 if grown.shard_of(claim_id) == 3 else 0))
+        grown.databases[-1].close()
+
+    def channel_totals(self, shards: ShardSet) -> dict:
+        totals = Counter()
+        for db in shards.databases:
+            with shards.using(db):
+                totals.update(dict(ChannelStats.select(ChannelStats.channel, ChannelStats.total_comments).tuples()))
+        return totals
+
+    async def testInterruptedReshard(self):
+        channel = {'channel_id': fake.sha1(), 'channel_name': '@resharded'}
+        for i in range(24):
+            response = await jsonrpc_post(self.url, 'create_comment', claim_id=fake.sha1(), comment=f'comment {i}',
+                                          signature=fake_signature(), signing_ts=fake_signing_ts(), **channel)
+            self.assertIn('result', response)
+        grown = ShardSet(self.shards.databases + [DeadlineSqliteDatabase(os.path.join(self.path, 'shard3.db'))])
+        self.addCleanup(grown.databases[-1].close)
+        with grown.using(grown.databases[-1]):
+            app.create_tables(grown.databases[-1])
+
+        # stopped after the comments were copied, before they were deleted where they came from
+        with mock.patch('scripts.reshard.release_bodies', side_effect=RuntimeError('interrupted')):
+            with self.assertRaises(RuntimeError):
+                reshard(grown)
+        moved = reshard(grown)
+        self.assertGreater(moved['claims'], 0)
+        self.assertEqual(self.channel_totals(grown), {channel['channel_id']: 24})
+
+    async def testAbandonLeavesIndex(self):
+        signer = self.lbrynet.add_channel('@signer')
+        claim_id = self.lbrynet.add_claim(channel=signer)['claim_id']
+
+        async def create(body, **params):
+            response = await jsonrpc_post(self.url, 'create_comment', comment=body, channel_id=signer.claim_id,
+                                          channel_name=signer.name, **signer.sign(body), **params)
+            return response['result']['comment_id']
+
+        parent = await create('parent', claim_id=claim_id)
+        reply = await create('reply', parent_id=parent)
+        kept = await create('kept', claim_id=claim_id)
+        self.assertEqual(set(self.shards.lookup([parent, reply, kept])), {parent, reply, kept})
+
+        response = await jsonrpc_post(self.url, 'abandon_comment', comment_id=parent, **signer.sign(parent))
+        self.assertTrue(response['result']['abandoned'])
+        self.assertEqual(set(self.shards.lookup([parent, reply, kept])), {kept})
+        response = await jsonrpc_post(self.url, 'abandon_comments', pieces=[
+            {'comment_id': kept, **signer.sign(kept)}
+        ])
+        self.assertEqual(response['result']['abandoned'], [kept])
+        self.assertEqual(self.shards.lookup([kept]), {})
+
+    async def testIterComments(self):
+        channel = {'channel_id': fake.sha1(), 'channel_name': '@exported'}
+        claim_ids = [fake.sha1() for _ in range(6)]
+        comment_ids = {}
+        for n, claim_id in enumerate(claim_ids):
+            for i in range(n % 3 + 1):
+                response = await jsonrpc_post(
+                    self.url, 'create_comment', claim_id=claim_id, comment=f'comment {i} on claim {n}',
+                    signature=fake_signature(), signing_ts=fake_signing_ts(), **channel
+                )
+                comment_ids.setdefault(claim_id, []).append(response['result']['comment_id'])
+        everything = sorted(i for ids in comment_ids.values() for i in ids)
+        self.assertGreater(len({self.shards.shard_of(claim_id) for claim_id in claim_ids}), 1)
+
+        # the home shard alone only holds some of them
+        self.assertLess(len(list(iter_comments())), len(everything))
+        self.assertEqual([c['comment_id'] for c in self.shards.iter_comments(chunk_size=2)], everything)
+        resumed = self.shards.iter_comments(after=everything[3], chunk_size=2)
+        self.assertEqual([c['comment_id'] for c in resumed], everything[4:])
+        for claim_id in claim_ids:
+            by_claim = self.shards.iter_comments(claim_id=claim_id, chunk_size=2)
+            self.assertEqual([c['comment_id'] for c in by_claim], sorted(comment_ids[claim_id]))
+
+
+class RateLimitTest(AsyncioTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.host = 'localhost'
+        self.port = 5931
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}/api'
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        limits = {'create_comment': {'ip': {'rate': 0.001, 'burst': 4}, 'channel': {'rate': 0.001, 'burst': 2}}}
+        rate_limits = {'enabled': True, 'trusted_proxies': ['127.0.0.1', '::1'], 'methods': limits}
+        self.server = app.CommentDaemon({**config, 'rate_limits': rate_limits})
+        await self.server.start(host=self.host, port=self.port)
+        self.addCleanup(self.server.stop)
+
+    async def create(self, channel_id, forwarded_for='203.0.113.1', **params):
+        # the tests talk to the server the way nginx does, from 127.0.0.1
+        body = {'jsonrpc': '2.0', 'id': None, 'method': 'create_comment', 'params': {
+            'claim_id': fake.sha1(), 'comment': fake.text(), 'channel_id': channel_id,
+            'channel_name': '@ratelimited', 'signature': fake_signature(), 'signing_ts': fake_signing_ts(),
+            **params
+        }}
+        async with aiohttp.request('POST', self.url, json=body, headers={'X-Forwarded-For': forwarded_for}) as r:
+            return await r.json()
+
+    async def testTokenBuckets(self):
+        channel_id = fake.sha1()
+        responses = [await self.create(channel_id) for _ in range(3)]
+        self.assertEqual(['result' in r for r in responses], [True, True, False])
+        self.assertEqual(responses[-1]['error']['code'], -32001)
+
+        # another channel still has tokens, until the address runs out
+        responses = [await self.create(fake.sha1()) for _ in range(3)]
+        self.assertEqual(['result' in r for r in responses], [True, False, False])
+
+        # rejected before validation, even with garbage params
+        self.assertEqual((await self.create(channel_id=None))['error']['code'], -32001)
+        self.assertIn('result', await jsonrpc_post(self.url, 'get_claim_comments', claim_id=fake.sha1()))
+
+        async with aiohttp.request('GET', f'http://{self.host}:{self.port}/') as response:
+            status = await response.json()
+        self.assertEqual(status['rate_limited'], {'create_comment': {'channel': 1, 'ip': 3}})
+
+    async def testClientBehindProxy(self):
+        # every client behind the proxy has its own bucket, whatever hops it claims itself
+        for client in ('198.51.100.1', '198.51.100.2'):
+            responses = [await self.create(fake.sha1(), f'10.9.9.9, {client}, 127.0.0.1') for _ in range(5)]
+            self.assertEqual(['result' in r for r in responses], [True] * 4 + [False])
+        self.assertIn('result', await self.create(fake.sha1(), '10.9.9.9, 198.51.100.3'))
+
+    async def testChannelChargedOnceValid(self):
+        channel_id = fake.sha1()
+        for i in range(3):
+            invalid = await self.create(channel_id, f'198.51.100.{i}', signature=None)
+            self.assertEqual(invalid['error']['code'], -32602)
+        responses = [await self.create(channel_id, '198.51.100.9') for _ in range(3)]
+        self.assertEqual(['result' in r for r in responses], [True, True, False])
+
+
+class RateLimiterTest(unittest.TestCase):
+    def testClientAddress(self):
+        trusted = parse_networks(['127.0.0.1', '10.0.0.0/8'])
+        self.assertEqual(client_address('127.0.0.1', '198.51.100.1', trusted), '198.51.100.1')
+        self.assertEqual(client_address('127.0.0.1', '1.1.1.1, 198.51.100.1, 10.0.0.2', trusted), '198.51.100.1')
+        self.assertEqual(client_address('127.0.0.1', None, trusted), '127.0.0.1')
+        # nobody else gets to say where a request came from
+        self.assertEqual(client_address('198.51.100.7', '198.51.100.1', trusted), '198.51.100.7')
+        self.assertEqual(client_address('127.0.0.1', '10.0.0.3, 127.0.0.1', trusted), '10.0.0.3')
+
+
+class SpamFilterTest(AsyncioTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.host = 'localhost'
+        self.port = 5931
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}/api'
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        spam_filter = {'enabled': True, 'window_seconds': 600, 'max_entries': 1000, 'min_length': 30,
+                       'exact': {'max_copies': 2, 'action': 'reject'},
+                       'near': {'max_copies': 2, 'similarity': 0.7, 'action': 'reject'}}
+        self.server = app.CommentDaemon({**config, 'spam_filter': spam_filter})
+        await self.server.start(host=self.host, port=self.port)
+        self.addCleanup(self.server.stop)
+
+    async def create(self, comment):
+        return await jsonrpc_post(
+            self.url, 'create_comment', claim_id=fake.sha1(), comment=comment,
+            channel_id=fake.sha1(), channel_name=fake_lbryusername(),
+            signature=fake_signature(), signing_ts=fake_signing_ts()
+        )
+
+    async def testExactCopies(self):
+        spam = 'Free LBC for everyone who follows my channel, only today!'
+        # copies over other channels & claims, down to case and punctuation
+        responses = [await self.create(body) for body in (spam, spam.upper(), spam.replace(',', ' ,'), spam)]
+        self.assertEqual(['result' in r for r in responses], [True, True, False, False])
+        self.assertEqual(responses[-1]['error']['code'], -32004)
+        self.assertEqual(Comment.select().count(), 2)
+        self.assertIn('result', await self.create('Short and common'))
+
+    async def testNearCopies(self):
+        spam = ('Free LBC for everyone who follows my channel and shares this video with three friends, '
+                'the giveaway ends tonight so hurry up and claim yours with code {}')
+        responses = [await self.create(spam.format(fake.sha1()[:8])) for _ in range(4)]
+        self.assertEqual(['result' in r for r in responses], [True, True, False, False])
+        self.assertIn('result', await self.create(fake.text()))
+
+        async with aiohttp.request('GET', f'http://{self.host}:{self.port}/') as response:
+            status = await response.json()
+        self.assertEqual(status['spam'], {'entries': 5, 'near': {'reject': 2}})
+
+
+class OverloadTest(AsyncioTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.host = 'localhost'
+        self.port = 5931
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}/api'
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.server = app.CommentDaemon({
+            **config,
+            'overload': {'max_in_flight': 4, 'write_share': 0.5, 'retry_after': 3},
+            'deadlines': {'default': 5, 'get_comment_ids': 0}
+        })
+        await self.server.start(host=self.host, port=self.port)
+        self.addCleanup(self.server.stop)
+
+    async def post(self, method, **params):
+        body = {'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': params}
+        async with aiohttp.request('POST', self.url, json=body) as response:
+            return response.status, response.headers, await response.json()
+
+    async def testLoadShedding(self):
+        shedder = self.server.app['load_shedder']
+        shedder.in_flight = 2
+        status, headers, response = await self.post('create_comment', claim_id=fake.sha1(), comment='shed')
+        self.assertEqual(status, 503)
+        self.assertEqual(headers['Retry-After'], '3')
+        self.assertEqual(response['error']['code'], -32002)
+        status, _, response = await self.post('get_claim_comments', claim_id=fake.sha1())
+        self.assertEqual(status, 200)
+        self.assertIn('result', response)
+
+        shedder.in_flight = 4
+        self.assertEqual((await self.post('get_claim_comments', claim_id=fake.sha1()))[0], 503)
+        status, _, response = await self.post('ping')
+        self.assertEqual((status, response['result']), (200, 'pong'))
+
+        shedder.in_flight = 0
+        async with aiohttp.request('GET', f'http://{self.host}:{self.port}/') as response:
+            status = await response.json()
+        self.assertEqual((status['in_flight'], status['shed']), (0, {'write': 1, 'read': 1}))
+
+    async def testDeadlines(self):
+        _, _, response = await self.post('get_comment_ids', claim_id=fake.sha1())
+        self.assertEqual(response['error']['code'], -32003)
+        _, _, response = await self.post('get_claim_comments', claim_id=fake.sha1())
+        self.assertIn('result', response)
+
+
+class StalledSocket:
+    def __init__(self):
+        self.close_code = None
+
+    async def send_json(self, data):
+        await asyncio.Event().wait()
+
+    async def close(self, code, message):
+        self.close_code = code
+
+
+class SignatureAuditTest(AsyncioTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.lbrynet = FakeLBRYNet()
+        await self.lbrynet.start('localhost', 5932)
+        self.addCleanup(self.lbrynet.stop)
+        self.app = {'config': {**config, 'lbrynet': self.lbrynet.url}}
+        app.setup_database(self.app)
+        self.app['db'].connect()
+        app.create_tables(self.app['db'])
+        self.addCleanup(self.app['db'].close)
+
+    async def testAudit(self):
+        channel = self.lbrynet.add_channel('@signer')
+        claim_id = self.lbrynet.add_claim(channel=channel)['claim_id']
+        for i in range(5):
+            create_comment(f'Valid #{i}', claim_id, channel_id=channel.claim_id, channel_name=channel.name,
+                           **channel.sign(f'Valid #{i}'))
+        forged = create_comment('Forged', claim_id, channel_id=channel.claim_id, channel_name=channel.name,
+                                **channel.sign('Something else'))
+        unknown = create_comment('Unknown', claim_id, channel_id=fake.sha1(), channel_name='@unknown',
+                                 signature=fake_signature(), signing_ts=fake_signing_ts())
+
+        report = io.StringIO()
+        with tempfile.TemporaryDirectory() as tmpdir, ProcessPoolExecutor(2, initializer=init_worker) as pool:
+            checkpoint = Checkpoint(os.path.join(tmpdir, 'audit.checkpoint'))
+            totals = await audit(iter_comments(chunk_size=3), ChannelKeys(self.app), pool, checkpoint,
+                                 report, workers=2, chunk_size=3)
+            saved = Checkpoint(checkpoint.path)
+            saved.load()
+
+        self.assertEqual(totals, {'checked': 7, 'valid': 5, 'invalid': 1, 'unresolved': 1})
+        found = {line['comment_id']: line['reason'] for line in map(json.loads, report.getvalue().splitlines())}
+        self.assertEqual(found, {forged['comment_id']: 'invalid_signature',
+                                 unknown['comment_id']: 'unresolved_channel'})
+        self.assertEqual(saved.totals, totals)
+        self.assertEqual(saved.last_comment_id, max(c['comment_id'] for c in iter_comments()))
+
+
+class CommentStreamTest(AsyncioTestCase):
+    async def testSlowConsumerEviction(self):
+        stream = CommentStream(buffer_size=2)
+        claim_id = fake.sha1()
+        slow, fast = Subscriber(StalledSocket(), 2), Subscriber(StalledSocket(), 2)
+        for subscriber in (slow, fast):
+            stream.clients.add(subscriber)
+            stream.subscribe(subscriber, [claim_id])
+
+        for i in range(3):
+            stream.publish('CREATE', [{'comment_id': str(i), 'claim_id': claim_id}])
+            fast.queue.get_nowait()
+        await asyncio.sleep(0)
+
+        self.assertTrue(slow.evicted)
+        self.assertIsNotNone(slow.ws.close_code)
+        self.assertFalse(fast.evicted)
+        self.assertEqual(stream.subscribers[claim_id], {fast})
+        self.assertEqual(stream.evictions, 1)
+
+    async def testRelayBetweenWorkers(self):
+        db = DeadlineSqliteDatabase(':memory:')
+        with db.bind_ctx([StreamEvent]):
+            db.create_tables([StreamEvent])
+            publisher, listener = CommentStream(relay=True), CommentStream(relay=True)
+            claim_id = fake.sha1()
+            subscribers = Subscriber(StalledSocket(), 10), Subscriber(StalledSocket(), 10)
+            for stream, subscriber in zip((publisher, listener), subscribers):
+                stream.clients.add(subscriber)
+                stream.subscribe(subscriber, [claim_id])
+
+            publisher.publish('CREATE', [{'comment_id': 'a' * 64, 'claim_id': claim_id}])
+            self.assertEqual(subscribers[0].queue.get_nowait()['comment_id'], 'a' * 64)
+            self.assertTrue(subscribers[1].queue.empty())
+
+            self.assertEqual(listener.poll(), 1)
+            self.assertEqual(subscribers[1].queue.get_nowait()['comment_id'], 'a' * 64)
+            # read again while it settles, but delivered once, and never back to where it came from
+            self.assertEqual(listener.poll(), 0)
+            self.assertEqual(publisher.poll(), 0)
+            self.assertTrue(subscribers[0].queue.empty() and subscribers[1].queue.empty())
+
+            StreamEvent.update(created=StreamEvent.created - 120).execute()
+            self.assertEqual(listener.prune(), 1)
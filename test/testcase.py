@@ -7,13 +7,14 @@ import asyncio
 from asyncio.runners import _cancel_all_tasks  # type: ignore
 from peewee import *
 
-from src.database.models import Channel, Comment
+from src.database.models import Channel, Comment, ChannelStats, ClaimSummary
+from src.database.models import setup_search_index
 
 
 test_db = SqliteDatabase(':memory:')
 
 
-MODELS = [Channel, Comment]
+MODELS = [Channel, Comment, ChannelStats, ClaimSummary]
 
 
 class DatabaseTestCase(unittest.TestCase):
@@ -26,6 +27,7 @@ class DatabaseTestCase(unittest.TestCase):
 
         test_db.connect()
         test_db.create_tables(MODELS)
+        setup_search_index(test_db)
 
     def tearDown(self) -> None:
         # drop tables for next test